@@ -0,0 +1,69 @@
+# Backlog-driven sizing for the supervised worker pool (`worker run
+# --autoscale`). The policy is pure: given the current pool size, the backlog
+# and a clock it returns a target size, so it can be tested with simulated load.
+import math
+import time
+
+
+class Autoscaler:
+    """
+    Sizes the pool between `min_workers` and `max_workers` so that each
+    worker has about `per_worker` pending jobs, and adds a worker whenever the
+    oldest runnable job has waited longer than `target_wait` seconds.
+    Scale-ups jump straight to the target but wait `up_cooldown` seconds
+    after the previous change; scale-downs retire one worker at a time, at
+    most once per `down_cooldown`.
+    """
+
+    def __init__(
+        self,
+        min_workers=1,
+        max_workers=4,
+        per_worker=10,
+        target_wait=None,
+        up_cooldown=10.0,
+        down_cooldown=60.0,
+        clock=time.monotonic,
+    ):
+        if min_workers < 0 or max_workers < max(min_workers, 1):
+            raise ValueError("need 0 <= min_workers <= max_workers, max >= 1")
+        self.min_workers = min_workers
+        self.max_workers = max_workers
+        self.per_worker = max(per_worker, 1)
+        self.target_wait = target_wait
+        self.up_cooldown = up_cooldown
+        self.down_cooldown = down_cooldown
+        self.clock = clock
+        self._changed_at = None
+
+    def _target(self, current, pending, oldest_wait):
+        want, reason = math.ceil(pending / self.per_worker), "backlog"
+        waited = oldest_wait or 0
+        if self.target_wait is not None and waited > self.target_wait:
+            if want <= current:
+                want, reason = current + 1, "queue wait"
+        return min(max(want, self.min_workers), self.max_workers), reason
+
+    def desired(self, current, pending, oldest_wait=0.0):
+        """Pool size the backlog calls for, ignoring cooldowns."""
+        return self._target(current, pending, oldest_wait)[0]
+
+    def decide(self, current, pending, oldest_wait=0.0):
+        """
+        Returns (size, reason). `size` equals `current` when nothing should
+        change; `reason` says why, for the scaling log.
+        """
+        now = self.clock()
+        want, reason = self._target(current, pending, oldest_wait)
+        since = None if self._changed_at is None else now - self._changed_at
+        if want > current:
+            if since is not None and since < self.up_cooldown:
+                return current, "scale-up cooldown"
+        elif want < current:
+            if since is not None and since < self.down_cooldown:
+                return current, "scale-down cooldown"
+            want, reason = current - 1, "idle capacity"
+        else:
+            return current, "steady"
+        self._changed_at = now
+        return want, reason
@@ -0,0 +1,6 @@
+"""
+Reproducible performance benchmarks (`queuectl bench`, `python -m flam.benchmarks`).
+Every run uses a throwaway database in a temp directory.
+"""
+
+from .suite import BENCHMARKS, compare, run_suite
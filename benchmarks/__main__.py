@@ -0,0 +1,3 @@
+from flam.cli import bench_cmd
+
+bench_cmd(prog_name="python -m flam.benchmarks")
@@ -0,0 +1,288 @@
+# Benchmarks for the queue's hot paths. Each one builds its own temp database
+# with the production engine profile and schema, so runs are repeatable and
+# need nothing beyond this package and SQLite.
+import contextlib
+import os
+import platform
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, select
+from sqlalchemy.orm import sessionmaker
+
+from flam.db.base import create_sqlite_engine
+from flam.db.migrations import init_db
+from flam.db.models import Job, Worker
+from flam.queue_manager import (
+    claim_next_job,
+    enqueue_many,
+    iter_jobs,
+    summarize_jobs,
+)
+
+_PKG = __name__.split(".")[0]
+
+# end-to-end workers run in their own interpreter against the temp database
+_WORKER = f"from {_PKG}.worker import worker_loop; worker_loop('data', 0.05, 3.0)"
+
+NOOP_JOBS = {
+    "callable": {"callable": "builtins:len", "args": [[]]},
+    "shell": {"command": "exit 0"},
+}
+
+
+def _metric(value, unit, better):
+    return {"value": round(value, 4), "unit": unit, "better": better}
+
+
+def _percentile(samples, q):
+    ordered = sorted(samples)
+    return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+
+@contextlib.contextmanager
+def _temp_db():
+    tmp = tempfile.mkdtemp(prefix="queuectl-bench-")
+    path = os.path.join(tmp, "bench.db")
+    engine = create_sqlite_engine(f"sqlite:///{path}")
+    init_db(engine)
+    session = sessionmaker(bind=engine, expire_on_commit=False)()
+    try:
+        yield session, path
+    finally:
+        session.close()
+        engine.dispose()
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def _fill(session, rows, pending, batch=5000):
+    """
+    Load `rows` jobs straight into the table (setup, not measured); the
+    newest `pending` stay pending, the rest look like finished history.
+    """
+    table = Job.__table__
+    base = datetime.utcnow() - timedelta(days=1)
+    for start in range(0, rows, batch):
+        session.execute(
+            table.insert(),
+            [
+                {
+                    "id": f"j{i:08d}",
+                    "command": "exit 0",
+                    "kind": "shell",
+                    "status": "pending" if i >= rows - pending else "completed",
+                    "attempts": 0,
+                    "created_at": base + timedelta(microseconds=i),
+                    "updated_at": base,
+                }
+                for i in range(start, min(start + batch, rows))
+            ],
+        )
+        session.commit()
+
+
+def bench_enqueue(rows=10000, batch_size=1000):
+    """Bulk enqueue rate through enqueue_many."""
+    with _temp_db() as (session, _):
+        records = ({"id": f"e{i}", "command": "exit 0"} for i in range(rows))
+        started = time.perf_counter()
+        enqueue_many(records, session, batch_size=batch_size)
+        elapsed = time.perf_counter() - started
+    return {"enqueue.rows_per_sec": _metric(rows / elapsed, "rows/s", "higher")}
+
+
+def bench_claim(sizes=(1000, 10000, 100000), claims=200):
+    """claim_next_job latency (claim + commit) as the jobs table grows."""
+    results = {}
+    for size in sizes:
+        with _temp_db() as (session, _):
+            _fill(session, size, pending=min(size, max(claims, size // 10)))
+            samples = []
+            for _ in range(min(claims, size)):
+                started = time.perf_counter()
+                claim_next_job(session)
+                samples.append((time.perf_counter() - started) * 1000)
+        results[f"claim.p50_ms@{size}"] = _metric(
+            _percentile(samples, 0.5), "ms", "lower"
+        )
+        results[f"claim.p95_ms@{size}"] = _metric(
+            _percentile(samples, 0.95), "ms", "lower"
+        )
+    return results
+
+
+def bench_status(rows=100000, repeat=50):
+    """`status` summary, first `list` page, and a full `list` stream."""
+    with _temp_db() as (session, _):
+        _fill(session, rows, pending=rows // 10)
+        status, page = [], []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            summarize_jobs(session)
+            status.append((time.perf_counter() - started) * 1000)
+            started = time.perf_counter()
+            list(iter_jobs(session, state="pending", limit=50))
+            page.append((time.perf_counter() - started) * 1000)
+        started = time.perf_counter()
+        streamed = sum(1 for _ in iter_jobs(session))
+        stream_rate = streamed / (time.perf_counter() - started)
+    return {
+        "status.p50_ms": _metric(_percentile(status, 0.5), "ms", "lower"),
+        "list_page.p50_ms": _metric(_percentile(page, 0.5), "ms", "lower"),
+        "list_stream.rows_per_sec": _metric(stream_rate, "rows/s", "higher"),
+    }
+
+
+@contextlib.contextmanager
+def _cwd(path):
+    old = os.getcwd()
+    os.chdir(path)
+    try:
+        yield
+    finally:
+        os.chdir(old)
+
+
+def _wait(predicate, timeout, interval=0.05):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(interval)
+    return False
+
+
+def bench_end_to_end(workers=(1, 2, 4), jobs=500, kind="callable", timeout=300):
+    """
+    Jobs/sec for no-op jobs against N real worker processes: time from the
+    bulk enqueue until the last job is completed.
+    """
+    results = {}
+    for count in workers:
+        with _temp_db() as (session, path):
+            env = dict(os.environ, QUEUECTL_DB=path)
+            procs = [
+                subprocess.Popen(
+                    [sys.executable, "-c", _WORKER],
+                    cwd=os.path.dirname(path),
+                    env=env,
+                    stdout=subprocess.DEVNULL,
+                    stderr=subprocess.DEVNULL,
+                )
+                for _ in range(count)
+            ]
+
+            def registered():
+                session.rollback()  # fresh snapshot each poll
+                query = select(func.count()).select_from(Worker)
+                return session.scalar(query) >= count
+
+            def finished():
+                session.rollback()
+                return summarize_jobs(session)["completed"] >= jobs
+
+            try:
+                if not _wait(registered, 60):
+                    raise RuntimeError("benchmark workers did not start")
+                time.sleep(0.5)  # let callable pools come up
+                records = (dict(NOOP_JOBS[kind], id=f"e2e{i}") for i in range(jobs))
+                started = time.perf_counter()
+                # from the workers' directory, so the enqueue wakes them
+                with _cwd(os.path.dirname(path)):
+                    enqueue_many(records, session)
+                if not _wait(finished, timeout, interval=0.01):
+                    raise RuntimeError(f"{jobs} jobs did not finish in {timeout}s")
+                elapsed = time.perf_counter() - started
+            finally:
+                for p in procs:
+                    p.terminate()
+                for p in procs:
+                    try:
+                        p.wait(30)
+                    except subprocess.TimeoutExpired:
+                        p.kill()
+        results[f"e2e.jobs_per_sec@{count}w"] = _metric(
+            jobs / elapsed, "jobs/s", "higher"
+        )
+    return results
+
+
+BENCHMARKS = {
+    "enqueue": bench_enqueue,
+    "claim": bench_claim,
+    "e2e": bench_end_to_end,
+    "status": bench_status,
+}
+
+# smaller inputs for a quick smoke run (CI, laptops)
+QUICK = {
+    "enqueue": {"rows": 2000},
+    "claim": {"sizes": (1000, 10000), "claims": 100},
+    "e2e": {"workers": (1, 2), "jobs": 200},
+    "status": {"rows": 10000, "repeat": 20},
+}
+
+
+def run_suite(only=None, quick=False, params=None, progress=None):
+    """
+    Run the selected benchmarks (all by default) and return a JSON-ready
+    report: {"meta": {...}, "results": {name: {value, unit, better}}}.
+    `params` maps a benchmark name to keyword overrides.
+    """
+    names = list(only or BENCHMARKS)
+    unknown = [n for n in names if n not in BENCHMARKS]
+    if unknown:
+        raise ValueError(f"Unknown benchmark(s): {', '.join(unknown)}")
+    report = {
+        "meta": {
+            "timestamp": datetime.utcnow().isoformat(),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "quick": quick,
+            "benchmarks": names,
+        },
+        "results": {},
+    }
+    for name in names:
+        kwargs = dict(QUICK.get(name, {})) if quick else {}
+        kwargs.update((params or {}).get(name, {}))
+        started = time.perf_counter()
+        results = BENCHMARKS[name](**kwargs)
+        report["results"].update(results)
+        if progress:
+            progress(name, results, time.perf_counter() - started)
+    return report
+
+
+def compare(current, baseline, threshold=0.2):
+    """
+    Compare two reports metric by metric. A metric regressed when it moved
+    the wrong way (per its "better" direction) by more than `threshold`
+    (relative). Returns one dict per metric present in both.
+    """
+    rows = []
+    base = baseline.get("results", {})
+    for name, cur in current.get("results", {}).items():
+        if name not in base or not base[name]["value"]:
+            continue
+        old, new = base[name]["value"], cur["value"]
+        change = (new - old) / old
+        worse = -change if cur["better"] == "higher" else change
+        rows.append(
+            {
+                "name": name,
+                "baseline": old,
+                "current": new,
+                "unit": cur["unit"],
+                "change": round(change, 4),
+                "regressed": worse > threshold,
+            }
+        )
+    return rows
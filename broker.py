@@ -0,0 +1,989 @@
+# Optional queue broker daemon ("queuectld", run as `queuectl broker run`).
+# SQLite takes one writer at a time, which caps direct workers at a few
+# hundred state transitions per second. While the broker runs it owns the
+# queue instead. Pending jobs sit in in-memory heaps. Every change is appended
+# to a journal under data/broker/, with one fsync per group of concurrent
+# writes. Changed rows are folded into the regular tables every few seconds.
+# Workers and the CLI talk to it over a Unix socket, and fall back to SQLite
+# when it is not running.
+import heapq
+import json
+import os
+import signal
+import socket
+import socketserver
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from itertools import islice
+
+from sqlalchemy import bindparam, delete, insert, select, update
+
+from flam.db.base import beside_db, get_session
+from flam.db.models import (
+    BrokerCheckpoint,
+    DeadJob,
+    Job,
+    JobAttempt,
+    JobDep,
+    JobResult,
+)
+from flam.idempotency import complete_keys
+from flam.notify import wake_workers
+from flam.results import result_settings, split_results
+from flam.queue_manager import (
+    CONFLICT_POLICIES,
+    DEFAULT_QUEUE,
+    LEASE_EXPIRED_ERROR,
+    chunk_rows,
+    dependency_failure_policy,
+    fail_dependents,
+    resolve_dependents,
+)
+
+BROKER_DIR = beside_db("broker")
+BROKER_SOCKET = beside_db("broker.sock")
+DEFAULT_SNAPSHOT_INTERVAL = 2.0
+REAP_INTERVAL = 1.0
+
+JOB_COLUMNS = tuple(c.name for c in Job.__table__.columns)
+DEAD_COLUMNS = tuple(c.name for c in DeadJob.__table__.columns)
+_DATES = (
+    "next_run_at",
+    "created_at",
+    "updated_at",
+    "lease_expires_at",
+    "failed_at",
+    "started_at",
+    "finished_at",
+)
+
+# A client only hears back once these are on disk. Claims and lease
+# renewals are journaled too but not waited for: losing one only means the
+# job runs again, which leases allow anyway.
+_DURABLE_OPS = ("enqueue", "ack", "nack", "bury", "release")
+# record fields settled against job.db, so only accepted without a broker
+_DIRECT_FIELDS = ("after", "idempotency_key", "dedupe")
+
+
+class BrokerError(Exception):
+    pass
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def _dumps(obj):
+    return json.dumps(obj, separators=(",", ":"), default=_json_default).encode()
+
+
+def _decode(row):
+    """Turn the ISO timestamps of a journaled/sent row back into naive UTC."""
+    for name in _DATES:
+        value = row.get(name)
+        if isinstance(value, str):
+            value = datetime.fromisoformat(value)
+        if isinstance(value, datetime) and value.tzinfo is not None:
+            value = value.astimezone(timezone.utc).replace(tzinfo=None)
+        if value is not None:
+            row[name] = value
+    return row
+
+
+def _segments(directory):
+    found = []
+    if os.path.isdir(directory):
+        for name in os.listdir(directory):
+            if name.startswith("journal-") and name.endswith(".log"):
+                try:
+                    found.append(int(name[len("journal-") : -len(".log")]))
+                except ValueError:
+                    pass
+    return sorted(found)
+
+
+def _segment_path(directory, number):
+    return os.path.join(directory, f"journal-{number:08d}.log")
+
+
+class Journal:
+    """
+    Append-only log in numbered segments. `append` only buffers; a flusher
+    thread writes and fsyncs whatever has accumulated, so every writer that
+    arrived during one fsync shares the next one (group commit). `wait(seq)`
+    blocks until an append is on disk.
+    """
+
+    def __init__(self, directory, fsync=True, after=0):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.fsync = fsync
+        # numbers only grow, so a checkpoint never covers a newer segment
+        self.segment = max([after] + _segments(directory)) + 1
+        self._fp = open(_segment_path(directory, self.segment), "ab")
+        self._buf = []
+        self._seq = 0
+        self._durable = 0
+        self._error = None
+        self._closed = False
+        self._cond = threading.Condition()
+        self._io = threading.Lock()  # file writes and segment switches
+        self._thread = threading.Thread(target=self._run, name="journal", daemon=True)
+        self._thread.start()
+
+    def append(self, entries):
+        lines = [_dumps(e) + b"\n" for e in entries]
+        with self._cond:
+            self._buf.extend(lines)
+            self._seq += 1
+            self._cond.notify_all()
+            return self._seq
+
+    def wait(self, seq):
+        with self._cond:
+            while self._durable < seq:
+                if self._error is not None:
+                    raise BrokerError(f"journal write failed: {self._error!r}")
+                self._cond.wait()
+
+    def _take(self):
+        with self._cond:
+            lines, self._buf = self._buf, []
+            return lines, self._seq
+
+    def _write(self, lines):
+        if lines:
+            self._fp.write(b"".join(lines))
+            self._fp.flush()
+            if self.fsync:
+                os.fsync(self._fp.fileno())
+
+    def _mark(self, seq):
+        with self._cond:
+            self._durable = max(self._durable, seq)
+            self._cond.notify_all()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._buf and not self._closed:
+                    self._cond.wait()
+                if self._closed:
+                    return
+            with self._io:
+                lines, seq = self._take()
+                try:
+                    self._write(lines)
+                except OSError as e:
+                    with self._cond:
+                        self._error = e
+                        self._cond.notify_all()
+                    return
+            self._mark(seq)
+
+    def rotate(self):
+        """
+        Sync and close the current segment and start the next one. Returns
+        the closed segment's number. Callers pause appends around it.
+        """
+        with self._io:
+            lines, seq = self._take()
+            self._write(lines)
+            self._fp.close()
+            closed = self.segment
+            self.segment += 1
+            self._fp = open(_segment_path(self.directory, self.segment), "ab")
+        self._mark(seq)
+        return closed
+
+    def remove_through(self, segment):
+        for number in _segments(self.directory):
+            if number <= segment:
+                os.remove(_segment_path(self.directory, number))
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
+        with self._io:
+            lines, seq = self._take()
+            self._write(lines)
+            self._fp.close()
+        self._mark(seq)
+        path = _segment_path(self.directory, self.segment)
+        if os.path.getsize(path) == 0:
+            os.remove(path)  # nothing to replay
+
+
+class Broker:
+    """
+    The queue state while the broker runs. Pending jobs are kept in heaps:
+    `_ready` holds one per queue (runnable, by priority then created_at, as
+    claim_jobs orders them) and `_delayed` one by next_run_at (moved over
+    once due). Heap entries carry a version and are skipped once a job has
+    changed since they were pushed.
+    Terminal rows stay in memory only until a snapshot has written them.
+    """
+
+    def __init__(
+        self,
+        session_factory=get_session,
+        directory=BROKER_DIR,
+        fsync=True,
+        default_max_retries=3,
+    ):
+        self._session_factory = session_factory
+        self.directory = directory
+        self.fsync = fsync
+        self.default_max_retries = default_max_retries
+        self.lock = threading.Lock()
+        self._db_lock = threading.Lock()  # snapshots vs. enqueue id lookups
+        self.stopping = threading.Event()
+        self.journal = None
+        self.jobs = {}
+        self._version = {}
+        self._tick = 0
+        self._ready = {}  # queue -> heap
+        self._delayed = []
+        self._leased = {}  # job id -> lease_expires_at
+        self._dirty = set()
+        self._dead = []  # DLQ records not yet written
+        self._dead_ids = set()
+        self._replaced = set()  # ids whose old dependency edges must go
+        self._attempts = []
+        self._unsaved = 0  # journal entries since the last snapshot
+        self.snapshot_at = None
+
+    # state
+
+    def _put(self, row, dirty=True):
+        job_id = row["id"]
+        self.jobs[job_id] = row
+        self._tick += 1
+        self._version[job_id] = self._tick
+        self._leased.pop(job_id, None)
+        if row["status"] == "pending":
+            due = row.get("next_run_at")
+            if due is not None and due > datetime.utcnow():
+                heapq.heappush(self._delayed, (due, job_id, self._tick))
+            else:
+                self._push_ready(row, self._tick)
+        elif row["status"] == "processing":
+            self._leased[job_id] = row.get("lease_expires_at") or datetime.utcnow()
+        if dirty:
+            self._dirty.add(job_id)
+
+    def _push_ready(self, job, version):
+        key = (
+            -(job.get("priority") or 0),
+            job.get("created_at") or datetime.min,
+            job["id"],
+            version,
+        )
+        heapq.heappush(
+            self._ready.setdefault(job.get("queue") or DEFAULT_QUEUE, []), key
+        )
+
+    def _pop_ready(self, queue):
+        """The next runnable job id in `queue` (any queue if None), or None."""
+        while True:
+            if queue is None:
+                heads = [(heap[0], name) for name, heap in self._ready.items() if heap]
+                if not heads:
+                    return None
+                heap = self._ready[min(heads)[1]]
+            else:
+                heap = self._ready.get(queue)
+                if not heap:
+                    return None
+            _, _, job_id, version = heapq.heappop(heap)
+            if self._version.get(job_id) == version:
+                return job_id
+
+    def _remove_dead(self, record):
+        job_id = record["id"]
+        self.jobs.pop(job_id, None)
+        self._version.pop(job_id, None)
+        self._leased.pop(job_id, None)
+        self._dirty.discard(job_id)
+        self._dead.append(record)
+        self._dead_ids.add(job_id)
+
+    def _bury(self, job, error, now):
+        record = {
+            "id": job["id"],
+            "command": job["command"],
+            "kind": job.get("kind"),
+            "args": job.get("args"),
+            "queue": job.get("queue"),
+            "priority": job.get("priority"),
+            "last_error": error,
+            "failed_at": now,
+        }
+        self._remove_dead(record)
+        return {"dead": record}
+
+    def _owned(self, job_id, owner):
+        job = self.jobs.get(job_id)
+        if job is None or job["status"] != "processing":
+            return None
+        if owner is not None and job.get("lease_owner") != owner:
+            return None
+        return job
+
+    def _finish(self, job, now, **values):
+        job.update(values, lease_owner=None, lease_expires_at=None, updated_at=now)
+        self._put(job)
+        return {"put": job}
+
+    def _apply(self, entry):
+        if "put" in entry:
+            self._put(_decode(entry["put"]))
+            if entry.get("replaced"):
+                self._replaced.add(entry["put"]["id"])
+        elif "dead" in entry:
+            self._remove_dead(_decode(entry["dead"]))
+        elif "attempt" in entry:
+            self._attempts.append(_decode(entry["attempt"]))
+
+    # operations; each returns (result, journal entries) and runs under lock
+
+    def claim(self, limit, owner, lease_seconds, queues=None):
+        now = datetime.utcnow()
+        while self._delayed and self._delayed[0][0] <= now:
+            _, job_id, version = heapq.heappop(self._delayed)
+            if self._version.get(job_id) == version:
+                self._push_ready(self.jobs[job_id], version)
+        expires = now + timedelta(seconds=lease_seconds)
+        # the same quota rules as queue_manager.claim_jobs
+        picked = []
+        if not queues:
+            plan = [(None, limit)]
+        else:
+            plan = list(queues.items()) + [(name, limit) for name in queues]
+        for queue, quota in plan:
+            quota = min(quota, limit - len(picked))
+            for _ in range(quota):
+                job_id = self._pop_ready(queue)
+                if job_id is None:
+                    break
+                picked.append(job_id)
+        claimed = []
+        for job_id in picked:
+            job = self.jobs[job_id]
+            job.update(
+                status="processing",
+                updated_at=now,
+                lease_owner=owner,
+                lease_expires_at=expires,
+            )
+            self._leased[job_id] = expires
+            self._dirty.add(job_id)
+            claimed.append(job)
+        next_due = self._delayed[0][0] if self._delayed else None
+        result = {"jobs": claimed, "next_due": next_due}
+        return result, [{"put": job} for job in claimed]
+
+    def _attempt(self, attempt):
+        if not attempt:
+            return []
+        self._attempts.append(_decode(attempt))
+        return [{"attempt": attempt}]
+
+    def ack(self, job_id, owner, attempt=None):
+        job = self._owned(job_id, owner)
+        if job is None:
+            return {"done": False}, []
+        now = datetime.utcnow()
+        entry = self._finish(
+            job, now, status="completed", last_error=None, next_run_at=None
+        )
+        return {"done": True}, [entry] + self._attempt(attempt)
+
+    def nack(self, job_id, owner, attempts, error, run_at, attempt=None):
+        job = self._owned(job_id, owner)
+        if job is None:
+            return {"done": False}, []
+        run_at = _decode({"next_run_at": run_at})["next_run_at"]
+        entry = self._finish(
+            job,
+            datetime.utcnow(),
+            status="pending",
+            attempts=attempts,
+            last_error=error,
+            next_run_at=run_at,
+        )
+        return {"done": True, "wake": True}, [entry] + self._attempt(attempt)
+
+    def bury(self, job_id, owner, error, attempt=None):
+        job = self._owned(job_id, owner)
+        if job is None:
+            return {"done": False}, []
+        entry = self._bury(job, error, datetime.utcnow())
+        return {"done": True}, [entry] + self._attempt(attempt)
+
+    def release(self, ids, owner=None):
+        now = datetime.utcnow()
+        entries = []
+        for job_id in ids:
+            job = self._owned(job_id, owner)
+            if job is not None:
+                entries.append(self._finish(job, now, status="pending"))
+        return {"released": len(entries), "wake": bool(entries)}, entries
+
+    def renew(self, owner, lease_seconds):
+        expires = datetime.utcnow() + timedelta(seconds=lease_seconds)
+        entries = []
+        for job_id in list(self._leased):
+            job = self.jobs[job_id]
+            if job.get("lease_owner") == owner:
+                job["lease_expires_at"] = expires
+                self._leased[job_id] = expires
+                self._dirty.add(job_id)
+                entries.append({"put": job})
+        return {"renewed": len(entries)}, entries
+
+    def reap(self):
+        """Same rules as reap_expired_leases, over the in-memory leases."""
+        now = datetime.utcnow()
+        entries = []
+        requeued = buried = 0
+        for job_id, expires in list(self._leased.items()):
+            if expires >= now:
+                continue
+            job = self.jobs[job_id]
+            attempts = (job.get("attempts") or 0) + 1
+            limit = job.get("max_retries")
+            if attempts >= (self.default_max_retries if limit is None else limit):
+                entries.append(self._bury(job, LEASE_EXPIRED_ERROR, now))
+                buried += 1
+            else:
+                entries.append(
+                    self._finish(
+                        job,
+                        now,
+                        status="pending",
+                        attempts=attempts,
+                        last_error=LEASE_EXPIRED_ERROR,
+                        next_run_at=None,
+                    )
+                )
+                requeued += 1
+        result = {"requeued": requeued, "dead": buried, "wake": bool(requeued)}
+        return result, entries
+
+    def enqueue(self, rows, on_conflict, in_db):
+        if on_conflict not in CONFLICT_POLICIES:
+            raise ValueError(f"on_conflict must be one of {CONFLICT_POLICIES}")
+        rows = [_decode(row) for row in rows]
+        existing = {r["id"] for r in rows if r["id"] in self.jobs}
+        existing |= set(in_db) - self._dead_ids
+        stats = {"inserted": 0, "replaced": 0, "skipped": 0}
+        if existing:
+            if on_conflict == "fail":
+                dup = ", ".join(sorted(existing)[:5])
+                raise ValueError(f"Job(s) already exist: {dup}")
+            if on_conflict == "skip":
+                rows = [r for r in rows if r["id"] not in existing]
+                stats["skipped"] = len(existing)
+            else:
+                stats["replaced"] = len(existing)
+        entries = []
+        for row in rows:
+            row = {name: row.get(name) for name in JOB_COLUMNS}
+            row["unmet_deps"] = row["unmet_deps"] or 0
+            self._put(row)
+            if on_conflict == "replace" and row["id"] in existing:
+                self._replaced.add(row["id"])
+                entries.append({"put": row, "replaced": True})
+            else:
+                entries.append({"put": row})
+        stats["inserted"] = len(rows) - stats["replaced"]
+        return dict(stats, wake=bool(rows)), entries
+
+    def stats(self):
+        counts = {}
+        for job in self.jobs.values():
+            counts[job["status"]] = counts.get(job["status"], 0) + 1
+        return {
+            "jobs": counts,
+            "ready_heap": sum(len(heap) for heap in self._ready.values()),
+            "delayed_heap": len(self._delayed),
+            "leased": len(self._leased),
+            "unsaved": self._unsaved,
+            "segment": self.journal.segment if self.journal else None,
+            "snapshot_at": self.snapshot_at,
+        }
+
+    # plumbing
+
+    def _log(self, entries):
+        if not entries:
+            return None
+        self._unsaved += len(entries)
+        return self.journal.append(entries)
+
+    def _ids_in_db(self, ids):
+        session = self._session_factory()
+        try:
+            found = set()
+            it = iter(ids)
+            while True:
+                chunk = list(islice(it, 500))
+                if not chunk:
+                    return found
+                found.update(session.scalars(select(Job.id).where(Job.id.in_(chunk))))
+        finally:
+            session.close()
+
+    _OPS = ("claim", "ack", "nack", "bury", "release", "renew", "enqueue")
+
+    def dispatch(self, request):
+        """Handle one client request; returns the JSON-ready reply."""
+        request = dict(request)
+        op = request.pop("op", None)
+        if op == "ping":
+            return {"ok": True, "pid": os.getpid()}
+        if self.stopping.is_set():
+            raise BrokerError("broker is shutting down")
+        if op == "stats":
+            with self.lock:
+                return dict(self.stats(), ok=True)
+        if op == "shutdown":
+            self.stopping.set()
+            return {"ok": True}
+        if op not in self._OPS:
+            raise ValueError(f"Unknown broker operation {op!r}")
+        if op == "enqueue":
+            # no snapshot may land between the lookup and the insert
+            with self._db_lock:
+                in_db = self._ids_in_db(r["id"] for r in request["rows"])
+                with self.lock:
+                    result, entries = self.enqueue(in_db=in_db, **request)
+                    seq = self._log(entries)
+        else:
+            with self.lock:
+                result, entries = getattr(self, op)(**request)
+                seq = self._log(entries)
+        if seq is not None and op in _DURABLE_OPS:
+            self.journal.wait(seq)
+        if result.pop("wake", False):
+            wake_workers()
+        return dict(result, ok=True)
+
+    def start(self):
+        """
+        Load pending and processing jobs from the tables, replay journal
+        segments newer than the last snapshot, and open a new segment.
+        Returns the number of journal entries replayed.
+        """
+        session = self._session_factory()
+        try:
+            checkpoint = session.get(BrokerCheckpoint, 1)
+            done = checkpoint.segment if checkpoint is not None else 0
+            columns = [Job.__table__.c[name] for name in JOB_COLUMNS]
+            live = Job.status.in_(("pending", "processing"))
+            for row in session.execute(select(*columns).where(live)).mappings():
+                self._put(dict(row), dirty=False)
+        finally:
+            session.close()
+        replayed = 0
+        for number in _segments(self.directory):
+            path = _segment_path(self.directory, number)
+            if number <= done:
+                os.remove(path)  # written by a snapshot already
+                continue
+            with open(path, "rb") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        break  # torn final write
+                    self._apply(entry)
+                    replayed += 1
+        self._unsaved = replayed
+        self.journal = Journal(self.directory, self.fsync, after=done)
+        return replayed
+
+    def snapshot(self):
+        """
+        Write every row changed since the last snapshot into the tables in
+        one transaction, then drop the journal segments it covers. Returns
+        the number of rows written.
+        """
+        with self._db_lock:
+            with self.lock:
+                if not self._unsaved:
+                    return 0
+                segment = self.journal.rotate()
+                rows = [dict(self.jobs[i]) for i in self._dirty]
+                dead, attempts = self._dead, self._attempts
+                replaced = self._replaced
+                self._dirty, self._dead, self._attempts = set(), [], []
+                self._replaced = set()
+                self._unsaved = 0
+            try:
+                ready = self._write(rows, dead, attempts, segment, replaced)
+            except Exception:
+                with self.lock:
+                    self._dirty.update(r["id"] for r in rows if r["id"] in self.jobs)
+                    self._replaced |= replaced
+                    self._dead = dead + self._dead
+                    self._attempts = attempts + self._attempts
+                    self._unsaved += len(rows) + len(dead) + len(attempts)
+                raise
+            with self.lock:
+                for row in rows:
+                    job = self.jobs.get(row["id"])
+                    if (
+                        job is not None
+                        and job["status"] == "completed"
+                        and row["id"] not in self._dirty
+                    ):
+                        del self.jobs[row["id"]]
+                        self._version.pop(row["id"], None)
+                pending = {d["id"] for d in self._dead}
+                self._dead_ids -= {d["id"] for d in dead} - pending
+                for row in ready:
+                    if row["id"] not in self.jobs:
+                        self._put(row, dirty=False)
+                self.snapshot_at = datetime.utcnow()
+        self.journal.remove_through(segment)
+        if ready:
+            wake_workers()
+        return len(rows) + len(dead) + len(attempts)
+
+    def _write(self, rows, dead, attempts, segment, replaced=()):
+        jobs, deps = Job.__table__, JobDep.__table__
+        policy = dependency_failure_policy()
+        codec, inline_bytes = result_settings()
+        session = self._session_factory()
+        try:
+            # No upserts here: the job_counts triggers' INSERT OR IGNORE
+            # takes on an upsert's conflict handling and aborts. Replace or
+            # update existing rows instead, and insert the rest.
+            if dead:
+                dead_table = DeadJob.__table__
+                ids = [d["id"] for d in dead]
+                for i in range(0, len(ids), 500):
+                    part = ids[i : i + 500]
+                    session.execute(delete(jobs).where(jobs.c.id.in_(part)))
+                    session.execute(delete(dead_table).where(dead_table.c.id.in_(part)))
+                session.execute(
+                    insert(dead_table),
+                    [{c: d.get(c) for c in DEAD_COLUMNS} for d in dead],
+                )
+            if rows:
+                ids = [r["id"] for r in rows]
+                known = set()
+                for i in range(0, len(ids), 500):
+                    known.update(
+                        session.scalars(
+                            select(jobs.c.id).where(jobs.c.id.in_(ids[i : i + 500]))
+                        )
+                    )
+                changed = [
+                    dict({c: r.get(c) for c in JOB_COLUMNS if c != "id"}, _id=r["id"])
+                    for r in rows
+                    if r["id"] in known
+                ]
+                if changed:
+                    stmt = (
+                        update(jobs)
+                        .where(jobs.c.id == bindparam("_id"))
+                        .values({c: bindparam(c) for c in JOB_COLUMNS if c != "id"})
+                    )
+                    session.connection().execute(stmt, changed)
+                added = [
+                    {c: r.get(c) for c in JOB_COLUMNS}
+                    for r in rows
+                    if r["id"] not in known
+                ]
+                if added:
+                    session.execute(insert(jobs), added)
+            # a replaced job starts over: its old parents no longer gate it
+            replaced = list(replaced)
+            for i in range(0, len(replaced), 500):
+                part = replaced[i : i + 500]
+                session.execute(delete(deps).where(deps.c.child_id.in_(part)))
+            if attempts:
+                # attempts carry their output tails; those go to job_results
+                attempts, results = split_results(
+                    attempts, session.get_bind().url.database, codec, inline_bytes
+                )
+                session.execute(insert(JobAttempt.__table__), attempts)
+                if results:
+                    session.execute(insert(JobResult.__table__), results)
+            # dependencies are tracked in the tables: settle them in the
+            # same transaction that records the parents' outcome
+            done = [r["id"] for r in rows if r["status"] == "completed"]
+            ready = resolve_dependents(session, done)
+            complete_keys(session, done, datetime.utcnow())
+            fail_dependents(session, [d["id"] for d in dead], policy)
+            session.merge(
+                BrokerCheckpoint(id=1, segment=segment, written_at=datetime.utcnow())
+            )
+            columns = [jobs.c[name] for name in JOB_COLUMNS]
+            ready_rows = [
+                dict(row)
+                for row in session.execute(
+                    select(*columns).where(jobs.c.id.in_(ready))
+                ).mappings()
+            ]
+            session.commit()
+            return ready_rows
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+    def stop(self):
+        """Final snapshot; a clean stop leaves no journal behind."""
+        self.stopping.set()
+        try:
+            self.snapshot()
+        finally:
+            self.journal.close()
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        broker = self.server.broker
+        for line in self.rfile:
+            try:
+                reply = broker.dispatch(json.loads(line))
+            except ValueError as e:
+                reply = {"ok": False, "error": str(e), "type": "ValueError"}
+            except Exception as e:
+                reply = {"ok": False, "error": repr(e)}
+            self.wfile.write(_dumps(reply) + b"\n")
+
+
+class _Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def serve(
+    broker, socket_path=BROKER_SOCKET, snapshot_interval=DEFAULT_SNAPSHOT_INTERVAL
+):
+    """
+    Serve a started broker on `socket_path` until `broker.stopping` is set,
+    reaping expired leases every second and snapshotting every
+    `snapshot_interval` seconds; then stop it cleanly.
+    """
+    server = _Server(socket_path, _Handler)
+    server.broker = broker
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    wake_workers()  # idle workers pick up whatever was pending
+    next_snapshot = time.monotonic() + snapshot_interval
+    try:
+        while not broker.stopping.wait(min(REAP_INTERVAL, snapshot_interval)):
+            try:
+                with broker.lock:
+                    result, entries = broker.reap()
+                    broker._log(entries)
+                if result["requeued"] or result["dead"]:
+                    print(
+                        f"[broker] reaped expired leases: {result['requeued']} "
+                        f"requeued, {result['dead']} to DLQ"
+                    )
+                if result["wake"]:
+                    wake_workers()
+                if time.monotonic() >= next_snapshot:
+                    next_snapshot = time.monotonic() + snapshot_interval
+                    broker.snapshot()
+            except Exception as e:
+                # the journal still holds everything; try again next round
+                print(f"[broker] snapshot failed: {e!r}")
+    finally:
+        broker.stopping.set()
+        server.shutdown()
+        server.server_close()
+        try:
+            os.remove(socket_path)
+        except OSError:
+            pass
+        broker.stop()
+
+
+def run_broker(
+    socket_path=BROKER_SOCKET,
+    directory=BROKER_DIR,
+    fsync=True,
+    snapshot_interval=DEFAULT_SNAPSHOT_INTERVAL,
+    default_max_retries=3,
+):
+    """Run the broker in the foreground until SIGTERM/SIGINT."""
+    if connect(socket_path) is not None:
+        raise BrokerError(f"A broker is already listening on {socket_path}")
+    if os.path.exists(socket_path):
+        os.remove(socket_path)  # left by a crashed broker
+    broker = Broker(
+        directory=directory, fsync=fsync, default_max_retries=default_max_retries
+    )
+    replayed = broker.start()
+
+    def _stop(signum, frame):
+        broker.stopping.set()
+
+    signal.signal(signal.SIGINT, _stop)
+    try:
+        signal.signal(signal.SIGTERM, _stop)
+    except Exception:
+        pass
+    print(
+        f"[broker {os.getpid()}] serving {len(broker.jobs)} job(s) on {socket_path}"
+        + (f", replayed {replayed} journal entries" if replayed else "")
+    )
+    serve(broker, socket_path, snapshot_interval)
+    print(f"[broker {os.getpid()}] stopped.")
+
+
+class BrokerClient:
+    """
+    One connection to the broker. Calls are serialised, so the worker's loop
+    and heartbeat threads can share a client.
+    """
+
+    def __init__(self, socket_path=BROKER_SOCKET, timeout=60.0):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(timeout)
+        try:
+            self.sock.connect(socket_path)
+        except OSError:
+            self.sock.close()
+            raise
+        self._rfile = self.sock.makefile("rb")
+        self._lock = threading.Lock()
+        self.next_due = None  # earliest delayed job, from the last claim
+
+    def call(self, op, **args):
+        message = _dumps(dict(args, op=op)) + b"\n"
+        with self._lock:
+            self.sock.sendall(message)
+            line = self._rfile.readline()
+        if not line:
+            raise BrokerError("broker closed the connection")
+        reply = json.loads(line)
+        if not reply.pop("ok"):
+            if reply.get("type") == "ValueError":
+                raise ValueError(reply["error"])
+            raise BrokerError(reply["error"])
+        return reply
+
+    def claim(self, limit, owner, lease_seconds, queues=None):
+        reply = self.call(
+            "claim",
+            limit=limit,
+            owner=owner,
+            lease_seconds=lease_seconds,
+            queues=queues,
+        )
+        self.next_due = _decode({"next_run_at": reply["next_due"]})["next_run_at"]
+        return [Job(**_decode(row)) for row in reply["jobs"]]
+
+    def ack(self, job, owner, attempt=None):
+        return self.call("ack", job_id=job.id, owner=owner, attempt=attempt)["done"]
+
+    def nack(self, job, owner, attempts, error, run_at, attempt=None):
+        reply = self.call(
+            "nack",
+            job_id=job.id,
+            owner=owner,
+            attempts=attempts,
+            error=error,
+            run_at=run_at,
+            attempt=attempt,
+        )
+        return reply["done"]
+
+    def bury(self, job, owner, error, attempt=None):
+        reply = self.call(
+            "bury", job_id=job.id, owner=owner, error=error, attempt=attempt
+        )
+        return reply["done"]
+
+    def release(self, jobs, owner=None):
+        return self.call("release", ids=[j.id for j in jobs], owner=owner)["released"]
+
+    def renew(self, owner, lease_seconds):
+        return self.call("renew", owner=owner, lease_seconds=lease_seconds)["renewed"]
+
+    def enqueue_many(self, records, batch_size=1000, on_conflict="fail"):
+        """Same contract and counts as queue_manager.enqueue_many."""
+        if on_conflict not in CONFLICT_POLICIES:
+            raise ValueError(f"on_conflict must be one of {CONFLICT_POLICIES}")
+        if batch_size < 1:
+            raise ValueError("batch_size must be >= 1")
+        stats = {"inserted": 0, "replaced": 0, "skipped": 0}
+        it = iter(records)
+        last_ts = None
+        while True:
+            chunk = list(islice(it, batch_size))
+            if not chunk:
+                return stats
+            if any(rec.get(f) for rec in chunk for f in _DIRECT_FIELDS):
+                raise ValueError(
+                    "Job dependencies and idempotency keys need the jobs "
+                    "tables; stop the broker to enqueue them"
+                )
+            rows, last_ts = chunk_rows(chunk, on_conflict, stats, last_ts)
+            reply = self.call(
+                "enqueue", rows=list(rows.values()), on_conflict=on_conflict
+            )
+            for key in stats:
+                stats[key] += reply[key]
+
+    def stats(self):
+        return self.call("stats")
+
+    def shutdown(self):
+        return self.call("shutdown")
+
+    def close(self):
+        try:
+            self._rfile.close()
+            self.sock.close()
+        except OSError:
+            pass
+
+
+def connect(socket_path=BROKER_SOCKET):
+    """A client for a live broker, or None when none answers."""
+    if not hasattr(socket, "AF_UNIX") or not os.path.exists(socket_path):
+        return None
+    try:
+        client = BrokerClient(socket_path, timeout=5.0)
+    except OSError:
+        return None
+    try:
+        client.call("ping")
+    except (OSError, BrokerError, ValueError):
+        client.close()
+        return None
+    client.sock.settimeout(60.0)
+    return client
+
+
+def broker_state(socket_path=BROKER_SOCKET, directory=BROKER_DIR):
+    """
+    "up" while a broker answers; "down" when none runs and SQLite is
+    current; "crashed" when a journal was left behind that the tables do not
+    hold yet (start the broker again to fold it in).
+    """
+    client = connect(socket_path)
+    if client is not None:
+        client.close()
+        return "up"
+    return "crashed" if _segments(directory) else "down"
+
+
+if __name__ == "__main__":
+    # `python -m flam.broker`: the same as `queuectl broker run`
+    run_broker()
@@ -1,21 +1,93 @@
+import json
 import os
+import signal
+import sqlite3
+import sys
 import time
+from datetime import datetime
+from threading import Event
+
 import click
 
-from flam.db.base import Base, engine, get_session
+from flam.db.base import (
+    DATABASE_PATH,
+    engine,
+    get_session,
+    load_profile,
+    read_pragmas,
+)
+from flam.db.migrations import init_db, get_schema_version
 from flam.queue_manager import (
     enqueue,
-    list_jobs,
+    enqueue_many,
+    CONFLICT_POLICIES,
+    iter_jobs,
+    iter_dead_jobs,
+    DEFAULT_JOB_FIELDS,
+    DEFAULT_DEAD_JOB_FIELDS,
     summarize_jobs,
-    list_dead_jobs,
+    summarize_queues,
+    parse_queues,
+    recount_jobs,
     retry_dead_job,
     delete_job,
+    reap_expired_leases,
+    DEFAULT_LEASE_SECONDS,
+    ATTEMPT_FIELDS,
+    backlog,
+    iter_attempts,
+)
+from flam.autoscale import Autoscaler
+from flam.broker import (
+    BROKER_SOCKET,
+    DEFAULT_SNAPSHOT_INTERVAL,
+    BrokerError,
+    broker_state,
+    connect,
+    run_broker,
+)
+from flam.benchmarks import compare, run_suite
+from flam.worker_manager import (
+    Supervisor,
+    signal_supervisor,
+    start_workers,
+    stop_workers,
+)
+from flam.config import set_config, get_config, get_float, get_int
+from flam.results import read_result
+from flam.registry import (
+    HEARTBEAT_INTERVAL,
+    WORKER_FIELDS,
+    count_live_workers,
+    list_workers,
+    prune_workers,
+    thresholds,
 )
-from flam.worker_manager import start_workers, stop_workers
-from flam.config import set_config, get_config
+from flam.records import (
+    FORMATS,
+    OUTPUT_FORMATS,
+    detect_format,
+    read_records,
+    write_records,
+)
+from flam.joblog import log_path, read_tail
+from flam.metrics import METRICS_DIR, collect, render_prometheus, serve
+from flam.db.models import Job
+from flam.compaction import enable_incremental_vacuum, run_gc
+from flam.scheduler import (
+    CATCH_UP_POLICIES,
+    DEFAULT_REFRESH,
+    SCHEDULE_FIELDS,
+    Scheduler,
+    add_schedule,
+    iter_schedules,
+    remove_schedule,
+)
+from flam.timeutil import parse_duration, parse_timestamp
+from flam.tracing import PROFILE_MODES
 
-# ensure tables exist
-Base.metadata.create_all(bind=engine)
+# ensure tables exist and the schema is current
+init_db(engine)
 
 
 @click.group()
@@ -24,22 +96,278 @@ def cli():
     pass
 
 
+def _duration(ctx, param, value):
+    if value is None:
+        return None
+    try:
+        return parse_duration(value)
+    except ValueError as e:
+        raise click.BadParameter(str(e))
+
+
+def _timestamp(ctx, param, value):
+    if value is None:
+        return None
+    try:
+        return parse_timestamp(value)
+    except ValueError as e:
+        raise click.BadParameter(str(e))
+
+
 # Enqueue
 @cli.command("enqueue")
-@click.option("--id", "job_id", required=True, help="Job ID")
-@click.option("--command", required=True, help="Command to execute")
+@click.option("--id", "job_id", default=None, help="Job ID")
+@click.option("--command", default=None, help="Command to execute")
+@click.option(
+    "--callable",
+    "target",
+    default=None,
+    help="Python function to call instead, as pkg.module:func",
+)
+@click.option(
+    "--args",
+    "call_args",
+    default=None,
+    help="JSON arguments for --callable (object: keywords, list: positional)",
+)
 @click.option(
     "--max-retries", type=int, default=None, help="Override per-job max retries"
 )
 @click.option("--replace", is_flag=True, help="If job exists, replace it")
-def enqueue_cmd(job_id, command, max_retries, replace):
+@click.option("--queue", default=None, help="Queue name (default: default)")
+@click.option(
+    "--priority",
+    type=int,
+    default=None,
+    help="Higher runs first within the queue (default: 0)",
+)
+@click.option(
+    "--delay",
+    default=None,
+    callback=_duration,
+    help="Run no earlier than this long from now (e.g. 30s, 10m, 2h)",
+)
+@click.option(
+    "--run-at",
+    default=None,
+    callback=_timestamp,
+    help="Run no earlier than this time (ISO 8601; UTC unless it has an offset)",
+)
+@click.option(
+    "--after",
+    "after",
+    default=None,
+    help="Comma-separated job ids that must complete first",
+)
+@click.option(
+    "--idempotency-key",
+    "key",
+    default=None,
+    help="Run at most once per key: coalesce onto or reuse the job holding it",
+)
+@click.option(
+    "--dedupe",
+    is_flag=True,
+    help="Use the job's content (kind, command, args) as its idempotency key",
+)
+@click.option(
+    "--dedupe-ttl",
+    default=None,
+    callback=_duration,
+    help="How long a key holds from its first enqueue (default: idempotency_ttl, 24h)",
+)
+@click.option(
+    "--from-file",
+    "from_file",
+    type=click.File("r"),
+    default=None,
+    help="Bulk enqueue from a JSONL/CSV file ('-' for stdin)",
+)
+@click.option(
+    "--format",
+    "fmt",
+    type=click.Choice(FORMATS),
+    default=None,
+    help="Record format for --from-file (default: from file extension, else jsonl)",
+)
+@click.option(
+    "--on-conflict",
+    type=click.Choice(CONFLICT_POLICIES),
+    default=None,
+    help="Duplicate id policy for --from-file (default: fail, or replace with --replace)",
+)
+@click.option(
+    "--batch-size", default=1000, help="Rows per insert transaction for --from-file"
+)
+def enqueue_cmd(
+    job_id,
+    command,
+    target,
+    call_args,
+    max_retries,
+    replace,
+    queue,
+    priority,
+    delay,
+    run_at,
+    after,
+    key,
+    dedupe,
+    dedupe_ttl,
+    from_file,
+    fmt,
+    on_conflict,
+    batch_size,
+):
+    if delay is not None and run_at is not None:
+        raise click.UsageError("Use either --delay or --run-at, not both")
+    if delay is not None:
+        run_at = datetime.utcnow() + delay
+    keyed = key is not None or dedupe
+    if from_file is not None:
+        per_job = (job_id, command, target, call_args, max_retries)
+        if any(v is not None for v in per_job):
+            raise click.UsageError(
+                "--id/--command/--callable/--args/--max-retries apply to single "
+                "jobs; file records carry those fields"
+            )
+        per_job = (run_at, after, queue, priority, key, dedupe_ttl)
+        if dedupe or any(v not in (None, "") for v in per_job):
+            raise click.UsageError(
+                "--delay/--run-at/--after/--queue/--priority and the dedupe "
+                "options apply to single jobs; give file records those "
+                "fields instead (idempotency_key, dedupe)"
+            )
+        policy = on_conflict or ("replace" if replace else "fail")
+        _enqueue_file(from_file, fmt, policy, batch_size)
+        return
+    if command and target:
+        raise click.UsageError("Use either --command or --callable, not both")
+    if not job_id or not (command or target):
+        raise click.UsageError(
+            "--id and --command (or --callable) are required (or use --from-file)"
+        )
+    if call_args is not None and not target:
+        raise click.UsageError("--args needs --callable")
+
+    if keyed and replace:
+        raise click.UsageError(
+            "--replace runs the job again; it cannot be combined with "
+            "--idempotency-key/--dedupe"
+        )
+    if dedupe_ttl is not None and not keyed:
+        raise click.UsageError("--dedupe-ttl needs --idempotency-key or --dedupe")
+
+    kind = "callable" if target else "shell"
+    if after or keyed:
+        _require_direct("--after/--idempotency-key/--dedupe")
+    client = _broker_client()
     s = get_session()
+    outcome = {"id": job_id, "outcome": "enqueued"}
     try:
-        enqueue(job_id, command, s, replace=replace, max_retries=max_retries)
+        if client is not None:
+            record = {
+                "id": job_id,
+                "command": target or command,
+                "kind": kind,
+                "args": call_args,
+                "max_retries": max_retries,
+                "run_at": run_at,
+                "queue": queue,
+                "priority": priority,
+            }
+            client.enqueue_many([record], on_conflict="replace" if replace else "fail")
+        else:
+            outcome = enqueue(
+                job_id,
+                target or command,
+                s,
+                replace=replace,
+                max_retries=max_retries,
+                kind=kind,
+                args=call_args,
+                run_at=run_at,
+                after=after,
+                queue=queue,
+                priority=priority,
+                idempotency_key=key,
+                dedupe=dedupe,
+                key_ttl=dedupe_ttl,
+            )
     except ValueError as e:
         click.echo(str(e))
         raise SystemExit(1)
-    click.echo(f"Enqueued job {job_id}")
+    finally:
+        if client is not None:
+            client.close()
+    if outcome["outcome"] == "cached":
+        done = outcome["completed_at"]
+        when = f" at {done.isoformat()}Z" if done is not None else ""
+        click.echo(
+            f"Not enqueued: job {outcome['id']} already completed{when} "
+            f"(see `queuectl result {outcome['id']}`)"
+        )
+    elif outcome["outcome"] == "coalesced":
+        click.echo(f"Not enqueued: coalesced onto job {outcome['id']}")
+    elif run_at is not None:
+        click.echo(f"Enqueued job {job_id} (runs at {run_at.isoformat()}Z)")
+    else:
+        click.echo(f"Enqueued job {job_id}")
+
+
+def _broker_client():
+    """A client while the broker owns the queue, None on plain SQLite."""
+    state = broker_state()
+    if state == "crashed":
+        click.echo(
+            "The broker stopped without writing its journal back to job.db; "
+            "run `queuectl broker run` to recover it first.",
+            err=True,
+        )
+        raise SystemExit(1)
+    return connect() if state == "up" else None
+
+
+def _require_direct(what):
+    """Refuse admin writes to the jobs tables while the broker owns them."""
+    if broker_state() != "down":
+        click.echo(
+            f"{what} writes job.db directly; stop the broker first "
+            "(`queuectl broker stop`).",
+            err=True,
+        )
+        raise SystemExit(1)
+
+
+def _enqueue_file(fp, fmt, on_conflict, batch_size):
+    fmt = fmt or detect_format(fp.name)
+    client = _broker_client()
+    s = get_session()
+    started = time.perf_counter()
+    try:
+        records = read_records(fp, fmt)
+        if client is not None:
+            stats = client.enqueue_many(
+                records, batch_size=batch_size, on_conflict=on_conflict
+            )
+        else:
+            stats = enqueue_many(
+                records, s, batch_size=batch_size, on_conflict=on_conflict
+            )
+    except ValueError as e:
+        click.echo(str(e))
+        raise SystemExit(1)
+    finally:
+        if client is not None:
+            client.close()
+        s.close()
+    elapsed = max(time.perf_counter() - started, 1e-9)
+    rows = stats["inserted"] + stats["replaced"]
+    click.echo(
+        f"Enqueued {rows} job(s) (inserted={stats['inserted']}, "
+        f"replaced={stats['replaced']}, skipped={stats['skipped']}) "
+        f"in {elapsed:.2f}s ({rows / elapsed:,.0f} rows/sec)"
+    )
 
 
 # Jobs admin
@@ -51,21 +379,200 @@ def jobs_group():
 @jobs_group.command("delete")
 @click.argument("job_id")
 def jobs_delete(job_id):
+    _require_direct("jobs delete")
     s = get_session()
     ok = delete_job(job_id, s)
     click.echo("deleted" if ok else "not found")
 
 
+@jobs_group.command("attempts")
+@click.argument("job_id")
+@click.option(
+    "--format",
+    "fmt",
+    type=click.Choice(OUTPUT_FORMATS),
+    default="text",
+    help="Output format",
+)
+def jobs_attempts(job_id, fmt):
+    """Show when each attempt of a job ran, where, and its exit code."""
+    s = get_session()
+    try:
+        write_records(iter_attempts(s, job_id), ATTEMPT_FIELDS, sys.stdout, fmt)
+    finally:
+        s.close()
+
+
 # Worker
 @cli.group()
 def worker():
     pass
 
 
+def _queue_weights(ctx, param, value):
+    if value is None:
+        return None
+    try:
+        return ",".join(f"{name}:{weight}" for name, weight in parse_queues(value))
+    except ValueError as e:
+        raise click.BadParameter(str(e))
+
+
 @worker.command("start")
 @click.option("--count", default=1, help="Number of workers to start")
-def worker_start(count):
-    start_workers(count)
+@click.option(
+    "--batch-size", default=1, help="Jobs each worker claims per round-trip"
+)
+@click.option(
+    "--concurrency",
+    default=1,
+    help="Jobs each worker runs at once (asyncio subprocesses when > 1)",
+)
+@click.option(
+    "--profile",
+    type=click.Choice(PROFILE_MODES),
+    is_flag=False,
+    flag_value="spans",
+    default=None,
+    help="Write periodic span summaries (or sampled cProfile) to data/profiles/",
+)
+@click.option(
+    "--profile-sql", is_flag=True, help="With --profile, also time SQL statements"
+)
+@click.option(
+    "--queues",
+    default=None,
+    callback=_queue_weights,
+    help="Queues to claim from, with weights (e.g. high:5,default:1; default: all)",
+)
+def worker_start(count, batch_size, concurrency, profile, profile_sql, queues):
+    if profile_sql and not profile:
+        profile = "spans"
+    start_workers(
+        count,
+        batch_size=batch_size,
+        concurrency=concurrency,
+        profile=profile,
+        profile_sql=profile_sql,
+        queues=queues,
+    )
+
+
+@worker.command("run")
+@click.option("--count", default=1, help="Number of workers to keep running")
+@click.option("--batch-size", default=1, help="Jobs each worker claims per round-trip")
+@click.option(
+    "--concurrency",
+    default=1,
+    help="Jobs each worker runs at once (asyncio subprocesses when > 1)",
+)
+@click.option(
+    "--queues",
+    default=None,
+    callback=_queue_weights,
+    help="Queues to claim from, with weights (e.g. high:5,default:1; default: all)",
+)
+@click.option(
+    "--stop-timeout",
+    default=30.0,
+    help="Seconds in-flight jobs get on stop before workers are killed",
+)
+@click.option(
+    "--autoscale", is_flag=True, help="Size the pool from the backlog instead"
+)
+@click.option("--min-workers", default=1, help="Autoscale: smallest pool")
+@click.option("--max-workers", default=4, help="Autoscale: largest pool")
+@click.option(
+    "--per-worker", default=10, help="Autoscale: target pending jobs per worker"
+)
+@click.option(
+    "--target-wait",
+    default=None,
+    callback=_duration,
+    help="Autoscale: add a worker while the oldest job waits longer (e.g. 30s)",
+)
+@click.option(
+    "--up-cooldown",
+    default="10s",
+    callback=_duration,
+    help="Autoscale: minimum time after a change before scaling up",
+)
+@click.option(
+    "--down-cooldown",
+    default="60s",
+    callback=_duration,
+    help="Autoscale: minimum time between scale-down steps",
+)
+def worker_run(
+    count,
+    batch_size,
+    concurrency,
+    queues,
+    stop_timeout,
+    autoscale,
+    min_workers,
+    max_workers,
+    per_worker,
+    target_wait,
+    up_cooldown,
+    down_cooldown,
+):
+    """Supervise workers in the foreground: restart crashes, drain, roll."""
+    autoscaler = None
+    if autoscale:
+        try:
+            autoscaler = Autoscaler(
+                min_workers,
+                max_workers,
+                per_worker=per_worker,
+                target_wait=target_wait.total_seconds() if target_wait else None,
+                up_cooldown=up_cooldown.total_seconds(),
+                down_cooldown=down_cooldown.total_seconds(),
+            )
+        except ValueError as e:
+            raise click.BadParameter(str(e))
+    Supervisor(
+        count,
+        batch_size=batch_size,
+        concurrency=concurrency,
+        stop_timeout=stop_timeout,
+        autoscaler=autoscaler,
+        queues=queues,
+    ).run()
+
+
+def _signal_supervisor(name, what):
+    try:
+        pid = signal_supervisor(name)
+    except RuntimeError as e:
+        raise click.ClickException(str(e))
+    if pid is None:
+        raise click.ClickException("No supervisor running (start one with worker run)")
+    click.echo(f"{what} requested from supervisor {pid}")
+    return pid
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+        return True
+    except OSError:
+        return False
+
+
+@worker.command("drain")
+@click.option("--wait", is_flag=True, help="Block until the supervisor has exited")
+def worker_drain(wait):
+    """Stop claiming, let in-flight jobs finish, then exit."""
+    pid = _signal_supervisor("SIGUSR1", "Drain")
+    while wait and _pid_alive(pid):
+        time.sleep(0.5)
+
+
+@worker.command("restart")
+def worker_restart():
+    """Rolling restart: replace workers one at a time."""
+    _signal_supervisor("SIGHUP", "Rolling restart")
 
 
 @worker.command("stop")
@@ -75,38 +582,219 @@ def worker_stop():
 
 # Status
 @cli.command("status")
-def status_cmd():
-    s = get_session()
-    summary = summarize_jobs(s)
-
-    hb_dir = "data"
-    live = 0
-    now = time.time()
-    if os.path.exists(hb_dir):
-        for name in os.listdir(hb_dir):
-            if name.startswith("worker-") and name.endswith(".hb"):
-                path = os.path.join(hb_dir, name)
-                try:
-                    # consider worker alive if heartbeat written in last 10s
-                    if now - os.path.getmtime(path) < 10:
-                        live += 1
-                except Exception:
-                    pass
+@click.option(
+    "--recount", is_flag=True, help="Rebuild the job counters from a full table scan"
+)
+def status_cmd(recount):
+    s = get_session()
+    summary = recount_jobs(s) if recount else summarize_jobs(s)
+
+    stale_after, _ = _worker_thresholds()
+    live = count_live_workers(s, stale_after)
 
     click.echo(f"Workers: {live if live else 0} active")
     for k, v in summary.items():
         click.echo(f"{k}: {v}")
+    per_queue = summarize_queues(s)
+    if per_queue:
+        click.echo("queues:")
+        for queue, counts in per_queue.items():
+            parts = " ".join(f"{state}={n}" for state, n in counts.items())
+            click.echo(f"  {queue}: {parts}")
+
+
+def _worker_thresholds():
+    return thresholds(
+        get_float("heartbeat_interval", HEARTBEAT_INTERVAL),
+        get_int("lease_seconds", DEFAULT_LEASE_SECONDS),
+    )
+
+
+@cli.command("workers")
+@click.option(
+    "--format",
+    "fmt",
+    type=click.Choice(OUTPUT_FORMATS),
+    default="text",
+    help="Output format",
+)
+@click.option("--prune", is_flag=True, help="Forget dead workers afterwards")
+def workers_cmd(fmt, prune):
+    """List live, stale and dead workers from the registry."""
+    s = get_session()
+    try:
+        stale_after, dead_after = _worker_thresholds()
+        rows = list_workers(s, stale_after, dead_after)
+        if fmt == "text" and not rows:
+            click.echo("No workers registered.")
+        else:
+            write_records(rows, WORKER_FIELDS, sys.stdout, fmt)
+        if prune:
+            click.echo(f"pruned={prune_workers(s, dead_after)}", err=True)
+    finally:
+        s.close()
 
 
 # List
+def _listing_options(f):
+    f = click.option(
+        "--format",
+        "fmt",
+        type=click.Choice(OUTPUT_FORMATS),
+        default="text",
+        help="Output format",
+    )(f)
+    f = click.option(
+        "--full", is_flag=True, help="Include command and last_error text"
+    )(f)
+    f = click.option("--fields", default=None, help="Comma-separated columns")(f)
+    f = click.option(
+        "--after", default=None, help="Resume after this job id (keyset cursor)"
+    )(f)
+    f = click.option("--limit", type=int, default=None, help="Max rows to print")(f)
+    return f
+
+
+def _pick_fields(fields, full, default):
+    if fields:
+        return tuple(x.strip() for x in fields.split(",") if x.strip())
+    if full:
+        return default + tuple(f for f in ("command", "last_error") if f not in default)
+    return default
+
+
+def _stream_listing(rows, fields, fmt, limit):
+    # rows are streamed straight to stdout; memory stays flat for any size
+    last = None
+
+    def _track(it):
+        nonlocal last
+        for row in it:
+            last = row
+            yield row
+
+    n = write_records(_track(rows), fields, sys.stdout, fmt)
+    if limit and n == limit and last is not None and "id" in fields:
+        click.echo(f"more: --after {last[fields.index('id')]}", err=True)
+
+
 @cli.command("list")
-@click.option("--state", default=None, help="pending|processing|completed|failed")
-def list_cmd(state):
+@click.option(
+    "--state",
+    default=None,
+    help="pending|waiting|processing|completed|failed|cancelled",
+)
+@_listing_options
+def list_cmd(state, limit, after, fields, full, fmt):
+    fields = _pick_fields(fields, full, DEFAULT_JOB_FIELDS)
     s = get_session()
-    for j in list_jobs(s, state):
-        click.echo(
-            f"{j.id} | {j.command} | {j.status} | attempts={j.attempts} | next_run_at={j.next_run_at}"
-        )
+    try:
+        rows = iter_jobs(s, state, after=after, limit=limit, fields=fields)
+        _stream_listing(rows, fields, fmt, limit)
+    except ValueError as e:
+        click.echo(str(e), err=True)
+        raise SystemExit(1)
+    finally:
+        s.close()
+
+
+# Logs
+@cli.command("logs")
+@click.argument("job_id")
+@click.option("-f", "--follow", is_flag=True, help="Keep streaming while the job runs")
+@click.option("-n", "--lines", default=50, help="Lines of history to show first")
+def logs_cmd(job_id, follow, lines):
+    path = log_path(job_id)
+    out = sys.stdout.buffer
+    if not os.path.exists(path) and not follow:
+        click.echo(f"No log for job {job_id}")
+        raise SystemExit(1)
+    fp = None
+    if os.path.exists(path):
+        fp = open(path, "rb")
+        fp.seek(0, os.SEEK_END)
+        out.write(read_tail(path, lines))
+        out.flush()
+    if follow:
+        _follow_log(job_id, path, fp, out)
+    elif fp:
+        fp.close()
+
+
+def _rotated(path, fp):
+    try:
+        return os.stat(path).st_ino != os.fstat(fp.fileno()).st_ino
+    except OSError:
+        return False
+
+
+def _follow_log(job_id, path, fp, out, interval=0.25):
+    s = get_session()
+    last_check = 0.0
+    try:
+        while True:
+            if fp is None and os.path.exists(path):
+                fp = open(path, "rb")
+            chunk = fp.read(64 * 1024) if fp else b""
+            if chunk:
+                out.write(chunk)
+                out.flush()
+                continue
+            if fp and _rotated(path, fp):
+                # the worker rotated the file underneath us: follow the new one
+                fp.close()
+                fp = open(path, "rb")
+                continue
+            now = time.monotonic()
+            if now - last_check >= 1.0:
+                last_check = now
+                status = s.query(Job.status).filter_by(id=job_id).scalar()
+                s.rollback()
+                if status not in ("pending", "processing"):
+                    break
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if fp:
+            fp.close()
+        s.close()
+
+
+@cli.command("result")
+@click.argument("job_id")
+@click.option(
+    "--attempt", type=int, default=None, help="Attempt number (default: the latest)"
+)
+def result_cmd(job_id, attempt):
+    """Show a job attempt's exit code, timings and output tails."""
+    s = get_session()
+    try:
+        found = read_result(s, job_id, attempt)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    finally:
+        s.close()
+    if found is None:
+        which = f"attempt {attempt} of job" if attempt is not None else "job"
+        click.echo(f"No result recorded for {which} {job_id}")
+        raise SystemExit(1)
+    started, finished = found["started_at"], found["finished_at"]
+    took = ""
+    if started and finished:
+        took = f" ({(finished - started).total_seconds():.3f}s)"
+    click.echo(
+        f"job {job_id} attempt {found['attempt']}: exit_code={found['exit_code']} "
+        f"worker={found['worker']}"
+    )
+    click.echo(
+        f"started={started.isoformat() if started else '-'} "
+        f"finished={finished.isoformat() if finished else '-'}{took}"
+    )
+    for name in ("stdout", "stderr"):
+        if found[name]:
+            click.echo(f"--- {name} (tail) ---")
+            click.echo(found[name].rstrip("\n"))
 
 
 # DLQ
@@ -116,14 +804,23 @@ def dlq():
 
 
 @dlq.command("list")
-def dlq_list_cmd():
+@_listing_options
+def dlq_list_cmd(limit, after, fields, full, fmt):
+    fields = _pick_fields(fields, full, DEFAULT_DEAD_JOB_FIELDS)
     s = get_session()
-    for d in list_dead_jobs(s):
-        click.echo(f"{d.id} | {d.command} | {d.last_error} | failed_at={d.failed_at}")
+    try:
+        rows = iter_dead_jobs(s, after=after, limit=limit, fields=fields)
+        _stream_listing(rows, fields, fmt, limit)
+    except ValueError as e:
+        click.echo(str(e), err=True)
+        raise SystemExit(1)
+    finally:
+        s.close()
 
 @dlq.command("retry")
 @click.argument("job_id")
 def dlq_retry_cmd(job_id):
+    _require_direct("dlq retry")
     s = get_session()
     ok = retry_dead_job(job_id, s)
     if ok:
@@ -149,5 +846,510 @@ def config_get_cmd(key):
     val = get_config(key)
     click.echo(val if val is not None else "")
 
+# Compaction
+@cli.command("gc")
+@click.option(
+    "--older-than",
+    default="7d",
+    callback=_duration,
+    help="Archive completed jobs idle this long (e.g. 12h, 7d)",
+)
+@click.option(
+    "--keep-history",
+    default=None,
+    callback=_duration,
+    help="Delete archived jobs older than this",
+)
+@click.option(
+    "--max-history", type=int, default=None, help="Keep at most N archived jobs"
+)
+@click.option("--batch-size", default=500, help="Rows per transaction")
+@click.option("--no-vacuum", is_flag=True, help="Skip incremental vacuum")
+@click.option(
+    "--vacuum-full",
+    is_flag=True,
+    help="One-off full VACUUM that enables incremental vacuum on an old job.db",
+)
+@click.option(
+    "--every",
+    default=None,
+    callback=_duration,
+    help="Keep running, one pass per interval",
+)
+def gc_cmd(
+    older_than, keep_history, max_history, batch_size, no_vacuum, vacuum_full, every
+):
+    """Archive completed jobs into job_history and reclaim space."""
+    s = get_session()
+    try:
+        if vacuum_full:
+            click.echo("Running full VACUUM (workers will wait for it)...")
+            enable_incremental_vacuum(s)
+        while True:
+            started = time.perf_counter()
+            report = run_gc(
+                s,
+                older_than,
+                keep_history=keep_history,
+                max_history=max_history,
+                batch_size=batch_size,
+                vacuum=not no_vacuum,
+            )
+            click.echo(
+                f"archived={report['archived']} purged={report['purged']} "
+                f"attempts_purged={report['attempts_purged']} "
+                f"results_purged={report['results_purged']} "
+                f"keys_pruned={report['keys_pruned']} "
+                f"metrics_folded={report['metrics_folded']} "
+                f"pages_freed={report['pages_freed']} "
+                f"reclaimed={report['reclaimed_bytes']} bytes "
+                f"({report['bytes_before']} -> {report['bytes_after']}) "
+                f"in {time.perf_counter() - started:.2f}s"
+            )
+            if every is None:
+                break
+            time.sleep(every.total_seconds())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        s.close()
+
+
+@cli.command("reap")
+@click.option(
+    "--every",
+    default=None,
+    callback=_duration,
+    help="Keep running, one pass per interval",
+)
+def reap_cmd(every):
+    """Return jobs whose worker died (lease expired) to the queue."""
+    _require_direct("reap (the broker reaps its own leases)")
+    s = get_session()
+    try:
+        while True:
+            reaped = reap_expired_leases(s, get_int("max_retries", 3))
+            click.echo(f"requeued={reaped['requeued']} dead={reaped['dead']}")
+            if every is None:
+                break
+            time.sleep(every.total_seconds())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        s.close()
+
+
+# Schedules
+@cli.group("schedules")
+def schedules_group():
+    """Recurring (cron) jobs"""
+    pass
+
+
+@schedules_group.command("add")
+@click.argument("schedule_id")
+@click.option(
+    "--cron",
+    "expr",
+    required=True,
+    help="When to fire, in UTC: 'min hour day month weekday' or @hourly/@daily/...",
+)
+@click.option("--command", default=None, help="Command each fire runs")
+@click.option(
+    "--callable", "target", default=None, help="Python function instead (pkg.mod:func)"
+)
+@click.option("--args", "call_args", default=None, help="JSON arguments for --callable")
+@click.option("--max-retries", type=int, default=None, help="Per-job max retries")
+@click.option(
+    "--catch-up",
+    type=click.Choice(CATCH_UP_POLICIES),
+    default="latest",
+    help="Fires missed while no scheduler ran: none, the latest one, or all",
+)
+@click.option("--replace", is_flag=True, help="Redefine an existing schedule")
+def schedules_add(
+    schedule_id, expr, command, target, call_args, max_retries, catch_up, replace
+):
+    """Create a schedule; each fire enqueues job SCHEDULE_ID@YYYYMMDDHHMM."""
+    if bool(command) == bool(target):
+        raise click.UsageError("Give one of --command or --callable")
+    s = get_session()
+    try:
+        schedule = add_schedule(
+            s,
+            schedule_id,
+            expr,
+            target or command,
+            kind="callable" if target else "shell",
+            args=call_args,
+            max_retries=max_retries,
+            catch_up=catch_up,
+            replace=replace,
+        )
+        click.echo(
+            f"Schedule {schedule_id} added; next fire "
+            f"{schedule.next_fire_at.isoformat()}Z"
+        )
+    except ValueError as e:
+        click.echo(str(e), err=True)
+        raise SystemExit(1)
+    finally:
+        s.close()
+
+
+@schedules_group.command("list")
+@click.option(
+    "--format",
+    "fmt",
+    type=click.Choice(OUTPUT_FORMATS),
+    default="text",
+    help="Output format",
+)
+def schedules_list(fmt):
+    """Schedules, soonest fire first."""
+    s = get_session()
+    try:
+        write_records(iter_schedules(s), SCHEDULE_FIELDS, sys.stdout, fmt)
+    finally:
+        s.close()
+
+
+@schedules_group.command("remove")
+@click.argument("schedule_id")
+def schedules_remove(schedule_id):
+    s = get_session()
+    try:
+        click.echo("removed" if remove_schedule(s, schedule_id) else "not found")
+    finally:
+        s.close()
+
+
+@schedules_group.command("run")
+@click.option(
+    "--refresh",
+    type=float,
+    default=DEFAULT_REFRESH,
+    help="Seconds between re-reads of the schedules table",
+)
+def schedules_run(refresh):
+    """Run the scheduler in the foreground until Ctrl+C/SIGTERM."""
+    stop = Event()
+
+    def _stop(signum, frame):
+        stop.set()
+
+    signal.signal(signal.SIGINT, _stop)
+    try:
+        signal.signal(signal.SIGTERM, _stop)
+    except Exception:
+        pass
+    s = get_session()
+    scheduler = Scheduler(s, max(refresh, 1.0))
+    click.echo(f"[scheduler {os.getpid()}] running")
+    try:
+        scheduler.run(stop)
+    finally:
+        s.close()
+    click.echo(f"[scheduler {os.getpid()}] stopped.")
+
+
+# Broker
+@cli.group("broker")
+def broker_group():
+    """Optional broker daemon that owns the queue in memory"""
+    pass
+
+
+@broker_group.command("run")
+@click.option(
+    "--snapshot-interval",
+    type=float,
+    default=None,
+    help=f"Seconds between write-backs to job.db (default {DEFAULT_SNAPSHOT_INTERVAL})",
+)
+@click.option(
+    "--no-fsync", is_flag=True, help="Skip fsync on the journal (faster, not durable)"
+)
+@click.option(
+    "--force", is_flag=True, help="Start even though workers are running on SQLite"
+)
+def broker_run(snapshot_interval, no_fsync, force):
+    """Run the broker in the foreground until SIGTERM/Ctrl+C."""
+    s = get_session()
+    try:
+        stale_after, _ = _worker_thresholds()
+        live = count_live_workers(s, stale_after)
+    finally:
+        s.close()
+    if live and not force:
+        # they keep writing job.db directly; only new workers attach
+        click.echo(
+            f"{live} worker(s) are running against job.db; stop them first "
+            "(or use --force).",
+            err=True,
+        )
+        raise SystemExit(1)
+    if snapshot_interval is None:
+        snapshot_interval = get_float(
+            "broker_snapshot_interval", DEFAULT_SNAPSHOT_INTERVAL
+        )
+    try:
+        run_broker(
+            fsync=not no_fsync,
+            snapshot_interval=max(snapshot_interval, 0.1),
+            default_max_retries=get_int("max_retries", 3),
+        )
+    except BrokerError as e:
+        click.echo(str(e), err=True)
+        raise SystemExit(1)
+
+
+@broker_group.command("status")
+def broker_status():
+    """Whether the broker is running, and what it holds."""
+    state = broker_state()
+    if state != "up":
+        click.echo(state)
+        return
+    client = connect()
+    try:
+        stats = client.stats()
+    finally:
+        client.close()
+    click.echo(f"up socket={BROKER_SOCKET}")
+    for name, value in stats.items():
+        click.echo(f"{name}: {value}")
+
+
+@broker_group.command("stop")
+@click.option(
+    "--timeout",
+    type=float,
+    default=60.0,
+    show_default=True,
+    help="Seconds to wait for the final write-back",
+)
+def broker_stop(timeout):
+    """Stop the broker after a final write-back to job.db."""
+    client = connect()
+    if client is None:
+        click.echo("broker not running")
+        return
+    try:
+        client.shutdown()
+    finally:
+        client.close()
+    # the socket goes before the final snapshot, so "crashed" shows briefly
+    deadline = time.monotonic() + timeout
+    while (state := broker_state()) != "down":
+        if time.monotonic() >= deadline:
+            click.echo(
+                f"broker did not finish stopping within {timeout:g}s ({state}); "
+                "`queuectl broker run` replays any journal left behind",
+                err=True,
+            )
+            raise SystemExit(1)
+        time.sleep(0.1)
+    click.echo("broker stopped")
+
+
+# Metrics
+def _render_metrics():
+    s = get_session()
+    try:
+        stale_after, dead_after = _worker_thresholds()
+        workers = dict.fromkeys(("live", "stale", "dead"), 0)
+        for row in list_workers(s, stale_after, dead_after):
+            workers[row.state] += 1
+        jobs = summarize_jobs(s)
+        jobs.pop("total")
+        waiting = backlog(s)
+        gauges = {
+            "jobs": ("Jobs by state", jobs),
+            "workers": ("Registered workers by heartbeat state", workers),
+            "oldest_pending_wait_seconds": (
+                "How long the oldest runnable job has been waiting",
+                {None: waiting["oldest_wait"]},
+            ),
+        }
+    finally:
+        s.close()
+    return render_prometheus(collect(), gauges)
+
+
+@cli.command("metrics")
+@click.option(
+    "--serve",
+    "port",
+    type=int,
+    default=None,
+    help="Serve /metrics over HTTP on this port instead of printing once",
+)
+@click.option("--host", default="127.0.0.1", help="Address to bind with --serve")
+@click.option(
+    "--reset", is_flag=True, help=f"Delete the per-worker files in {METRICS_DIR}"
+)
+def metrics_cmd(port, host, reset):
+    """Queue and worker metrics in Prometheus text format."""
+    if reset:
+        removed = 0
+        for name in os.listdir(METRICS_DIR) if os.path.isdir(METRICS_DIR) else ():
+            os.remove(os.path.join(METRICS_DIR, name))
+            removed += 1
+        click.echo(f"removed={removed}", err=True)
+        return
+    if port is None:
+        click.echo(_render_metrics(), nl=False)
+        return
+    click.echo(f"Serving metrics on http://{host}:{port}/metrics", err=True)
+    try:
+        serve(_render_metrics, host, port)
+    except KeyboardInterrupt:
+        pass
+
+
+# Benchmarks
+def _int_list(ctx, param, value):
+    if value is None:
+        return None
+    try:
+        return tuple(int(x) for x in value.split(",") if x.strip())
+    except ValueError:
+        raise click.BadParameter("expected comma-separated integers")
+
+
+@cli.command("bench")
+@click.option("--only", default=None, help="Comma-separated: enqueue,claim,e2e,status")
+@click.option("--quick", is_flag=True, help="Smaller inputs for a fast smoke run")
+@click.option(
+    "--sizes",
+    default=None,
+    callback=_int_list,
+    help="Table sizes for claim latency (e.g. 1000,10000,1000000)",
+)
+@click.option(
+    "--workers",
+    default=None,
+    callback=_int_list,
+    help="Worker counts for end-to-end throughput (e.g. 1,2,4)",
+)
+@click.option("--jobs", type=int, default=None, help="Jobs per end-to-end run")
+@click.option(
+    "--kind",
+    type=click.Choice(["callable", "shell"]),
+    default="callable",
+    help="No-op job type for end-to-end runs",
+)
+@click.option(
+    "--output",
+    "-o",
+    type=click.Path(dir_okay=False),
+    default=None,
+    help="Write the results JSON here (default: stdout)",
+)
+@click.option(
+    "--baseline",
+    type=click.File("r"),
+    default=None,
+    help="Saved results JSON to compare against",
+)
+@click.option(
+    "--threshold",
+    default=0.2,
+    help="Relative slowdown that counts as a regression (0.2 = 20%)",
+)
+def bench_cmd(only, quick, sizes, workers, jobs, kind, output, baseline, threshold):
+    """Run the benchmark suite against a temp database."""
+    params = {"e2e": {"kind": kind}}
+    if sizes:
+        params["claim"] = {"sizes": sizes}
+    if workers:
+        params["e2e"]["workers"] = workers
+    if jobs:
+        params["e2e"]["jobs"] = jobs
+
+    def progress(name, results, elapsed):
+        click.echo(f"[bench] {name} ({elapsed:.1f}s)", err=True)
+        for metric, r in results.items():
+            click.echo(f"  {metric}: {r['value']:,.3f} {r['unit']}", err=True)
+
+    try:
+        report = run_suite(
+            only=[n.strip() for n in only.split(",")] if only else None,
+            quick=quick,
+            params=params,
+            progress=progress,
+        )
+    except (ValueError, RuntimeError) as e:
+        raise click.ClickException(str(e))
+
+    text = json.dumps(report, indent=2)
+    if output:
+        with open(output, "w") as f:
+            f.write(text + "\n")
+    else:
+        click.echo(text)
+
+    if baseline is not None:
+        rows = compare(report, json.load(baseline), threshold)
+        for r in rows:
+            flag = "REGRESSION" if r["regressed"] else "ok"
+            click.echo(
+                f"{r['name']}: {r['baseline']:,.3f} -> {r['current']:,.3f} "
+                f"{r['unit']} ({r['change']:+.1%}) {flag}",
+                err=True,
+            )
+        if any(r["regressed"] for r in rows):
+            raise SystemExit(1)
+
+
+# Database
+@cli.group("db")
+def db_group():
+    """Database maintenance commands"""
+    pass
+
+
+def _report_db_settings():
+    wanted = load_profile()
+    active = read_pragmas(engine)
+    with engine.connect() as conn:
+        version = get_schema_version(conn)
+    click.echo(f"database: {DATABASE_PATH}")
+    click.echo(f"sqlite: {sqlite3.sqlite_version}  schema_version: {version}")
+    for name, value in active.items():
+        target = wanted.get(name)
+        drift = str(value).lower() != _normalize_pragma(name, target)
+        click.echo(f"{name}: {value}" + (f"  (profile: {target})" if drift else ""))
+
+
+_PRAGMA_ENUMS = {
+    "auto_vacuum": {"none": "0", "full": "1", "incremental": "2"},
+    "synchronous": {"off": "0", "normal": "1", "full": "2", "extra": "3"},
+    "temp_store": {"default": "0", "file": "1", "memory": "2"},
+}
+
+
+def _normalize_pragma(name, value):
+    value = str(value).lower()
+    return _PRAGMA_ENUMS.get(name, {}).get(value, value)
+
+
+@db_group.command("check")
+def db_check_cmd():
+    """Show the SQLite settings in effect for this database."""
+    _report_db_settings()
+
+
+@db_group.command("tune")
+def db_tune_cmd():
+    """Persist WAL mode, checkpoint, refresh planner statistics and report."""
+    with engine.begin() as conn:
+        conn.exec_driver_sql("PRAGMA journal_mode=WAL")
+        conn.exec_driver_sql("PRAGMA wal_checkpoint(TRUNCATE)")
+        conn.exec_driver_sql("PRAGMA optimize")
+    _report_db_settings()
+
+
 if __name__ == "__main__":
     cli()
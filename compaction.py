@@ -0,0 +1,224 @@
+# Retention / compaction: moves old completed jobs out of the hot jobs table
+# into job_history, trims history, and hands freed pages back to the OS.
+# Every step works in bounded batches, one short transaction each, so workers
+# are never locked out for long.
+import os
+import time
+from datetime import datetime
+
+from sqlalchemy import DateTime, delete, func, insert, literal, select
+
+from flam.db.models import Job, JobAttempt, JobHistory, JobResult
+from flam.idempotency import key_settings, prune_keys
+from flam.joblog import remove_logs
+from flam.metrics import fold_exited
+from flam.results import prune_result_files
+
+
+def _archived_columns():
+    jobs = Job.__table__.c
+    return [
+        c.name
+        for c in JobHistory.__table__.columns
+        if c.name in jobs and c.name != "seq"
+    ]
+
+
+def archive_completed_jobs(session, older_than, batch_size=500, pause=0.0):
+    """
+    Move completed jobs last updated more than `older_than` ago into
+    job_history, and delete their logs. Returns the number of rows moved.
+    """
+    cutoff = datetime.utcnow() - older_than
+    jobs, hist = Job.__table__, JobHistory.__table__
+    names = _archived_columns()
+    moved = 0
+    while True:
+        ids = list(
+            session.scalars(
+                select(jobs.c.id)
+                .where(jobs.c.status == "completed", jobs.c.updated_at < cutoff)
+                .limit(batch_size)
+            )
+        )
+        if not ids:
+            break
+        done = (jobs.c.id.in_(ids), jobs.c.status == "completed")
+        src = select(
+            *[jobs.c[n] for n in names], literal(datetime.utcnow(), DateTime)
+        ).where(*done)
+        session.execute(insert(hist).from_select(names + ["archived_at"], src))
+        moved += session.execute(delete(jobs).where(*done)).rowcount
+        session.commit()
+        remove_logs(ids)
+        if len(ids) < batch_size:
+            break
+        if pause:
+            time.sleep(pause)
+    return moved
+
+
+def purge_history(session, keep=None, max_rows=None, batch_size=500, pause=0.0):
+    """
+    Enforce history retention: drop rows archived longer than `keep` ago,
+    then the oldest rows beyond `max_rows`. Returns the number deleted.
+    """
+    hist = JobHistory.__table__
+    purged = 0
+
+    def _delete_batch(where, order=None, limit=batch_size):
+        q = select(hist.c.seq).where(*where).limit(limit)
+        if order is not None:
+            q = q.order_by(order)
+        seqs = list(session.scalars(q))
+        if seqs:
+            session.execute(delete(hist).where(hist.c.seq.in_(seqs)))
+            session.commit()
+            if pause:
+                time.sleep(pause)
+        return len(seqs)
+
+    if keep is not None:
+        cutoff = datetime.utcnow() - keep
+        while True:
+            n = _delete_batch([hist.c.archived_at < cutoff])
+            purged += n
+            if n < batch_size:
+                break
+
+    if max_rows is not None:
+        excess = session.scalar(select(func.count()).select_from(hist)) - max_rows
+        while excess > 0:
+            n = _delete_batch([], order=hist.c.seq, limit=min(batch_size, excess))
+            if not n:
+                break
+            purged += n
+            excess -= n
+    return purged
+
+
+def _purge_finished(session, table, cutoff, batch_size, pause):
+    purged = 0
+    while True:
+        seqs = list(
+            session.scalars(
+                select(table.c.seq)
+                .where(table.c.finished_at < cutoff)
+                .limit(batch_size)
+            )
+        )
+        if seqs:
+            session.execute(delete(table).where(table.c.seq.in_(seqs)))
+            session.commit()
+            purged += len(seqs)
+        if len(seqs) < batch_size:
+            break
+        if pause:
+            time.sleep(pause)
+    return purged
+
+
+def purge_attempts(session, keep, batch_size=500, pause=0.0):
+    """
+    Drop per-attempt records that finished more than `keep` ago. Returns the
+    number deleted.
+    """
+    cutoff = datetime.utcnow() - keep
+    return _purge_finished(session, JobAttempt.__table__, cutoff, batch_size, pause)
+
+
+def purge_results(session, keep, batch_size=500, pause=0.0):
+    """
+    Drop attempt outputs older than `keep`, then the result files no row
+    refers to any more. Returns the number of rows deleted.
+    """
+    cutoff = datetime.utcnow() - keep
+    purged = _purge_finished(session, JobResult.__table__, cutoff, batch_size, pause)
+    prune_result_files(session)
+    return purged
+
+
+def incremental_vacuum(session, pages=0):
+    """
+    Release free pages back to the filesystem (all of them when pages=0).
+    Only possible when the database uses auto_vacuum=INCREMENTAL; returns the
+    number of pages freed.
+    """
+    session.commit()
+    with session.get_bind().connect() as conn:
+        if conn.exec_driver_sql("PRAGMA auto_vacuum").scalar() != 2:
+            return 0
+        before = conn.exec_driver_sql("PRAGMA freelist_count").scalar()
+        # a plain execute() only steps this pragma once (one page);
+        # executescript runs it to completion
+        conn.connection.executescript(f"PRAGMA incremental_vacuum({int(pages)});")
+        after = conn.exec_driver_sql("PRAGMA freelist_count").scalar()
+    return before - after
+
+
+def enable_incremental_vacuum(session):
+    """
+    Switch an existing database to auto_vacuum=INCREMENTAL. Requires one full
+    VACUUM, which rewrites the file and holds the lock for its duration.
+    """
+    session.commit()
+    with session.get_bind().connect() as conn:
+        conn.exec_driver_sql("PRAGMA auto_vacuum=INCREMENTAL")
+        conn.exec_driver_sql("VACUUM")
+
+
+def _db_bytes(path):
+    total = 0
+    for p in (path, f"{path}-wal"):
+        try:
+            total += os.path.getsize(p)
+        except (OSError, TypeError):
+            pass
+    return total
+
+
+def run_gc(
+    session,
+    older_than,
+    keep_history=None,
+    max_history=None,
+    batch_size=500,
+    vacuum=True,
+    pause=0.0,
+):
+    """
+    One compaction pass. Returns a report of rows moved/deleted and bytes
+    reclaimed on disk.
+    """
+    path = session.get_bind().url.database
+    bytes_before = _db_bytes(path)
+    report = {
+        "archived": archive_completed_jobs(session, older_than, batch_size, pause),
+        "purged": purge_history(session, keep_history, max_history, batch_size, pause),
+        "attempts_purged": 0,
+        "results_purged": 0,
+        "keys_pruned": 0,
+        "pages_freed": 0,
+    }
+    if keep_history is not None:
+        # attempt records follow the same age limit as history
+        report["attempts_purged"] = purge_attempts(
+            session, keep_history, batch_size, pause
+        )
+        report["results_purged"] = purge_results(
+            session, keep_history, batch_size, pause
+        )
+    _, max_keys = key_settings()
+    report["keys_pruned"] = prune_keys(session, datetime.utcnow(), max_keys)
+    session.commit()
+    report["metrics_folded"] = fold_exited()
+    if vacuum:
+        report["pages_freed"] = incremental_vacuum(session)
+        with session.get_bind().connect() as conn:
+            if conn.exec_driver_sql("PRAGMA journal_mode").scalar() == "wal":
+                # let the WAL shrink too, so the reclaimed bytes show up on disk
+                conn.exec_driver_sql("PRAGMA wal_checkpoint(TRUNCATE)").fetchall()
+    report["bytes_before"] = bytes_before
+    report["bytes_after"] = _db_bytes(path)
+    report["reclaimed_bytes"] = max(bytes_before - report["bytes_after"], 0)
+    return report
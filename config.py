@@ -1,28 +1,117 @@
-from flam.db.base import get_session
+import os
+import threading
+import time
+
+from flam.db import base
 from flam.db.models import Config
 
+# How stale a cached value may get before we ask SQLite whether the config
+# table could have changed. Workers see `queuectl config set` within this delay.
+REFRESH_INTERVAL = float(os.environ.get("QUEUECTL_CONFIG_REFRESH", "1.0"))
+
+
+class ConfigCache:
+    """
+    Process-local copy of the whole config table.
+    Reads come from memory. At most once per refresh_interval the cache runs
+    PRAGMA data_version on its own connection (no table access); the value only
+    moves when another connection committed, and only then is the table re-read.
+    """
+
+    def __init__(self, bind=None, refresh_interval=REFRESH_INTERVAL):
+        self._bind = bind
+        self.refresh_interval = refresh_interval
+        self._values = None
+        self._data_version = None
+        self._checked_at = 0.0
+        self._conn = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _connection(self):
+        if self._conn is None or self._pid != os.getpid():
+            # a connection inherited across fork belongs to the parent
+            self._conn = (self._bind or base.engine).connect()
+            self._pid = os.getpid()
+        return self._conn
+
+    def _refresh(self, force=False):
+        conn = self._connection()
+        version = conn.exec_driver_sql("PRAGMA data_version").scalar()
+        # work on a local: invalidate() may reset self._values at any time
+        values = self._values
+        if force or values is None or version != self._data_version:
+            rows = conn.exec_driver_sql("SELECT key, value FROM config").all()
+            values = {k: v for k, v in rows}
+            self._values = values
+            self._data_version = version
+        conn.rollback()
+        self._checked_at = time.monotonic()
+        return values
+
+    def _current(self):
+        values = self._values
+        if (
+            values is None
+            or time.monotonic() - self._checked_at >= self.refresh_interval
+        ):
+            with self._lock:
+                values = self._refresh()
+        return values
+
+    def invalidate(self):
+        """Force a reload on the next read (used after local writes)."""
+        self._values = None
+
+    def get(self, key, default=None):
+        return self._current().get(key, default)
+
+    def snapshot(self):
+        return dict(self._current())
+
+    def close(self):
+        if self._conn is not None and self._pid == os.getpid():
+            self._conn.close()
+        self._conn = None
+        self._values = None
+
+
+_cache = ConfigCache()
+
+
 #This code stores and retrieves simple configuration settings (key-value pairs) from a database. It allows saving values, and later retrieving them as string, integer, or float safely
 def set_config(key, value):
-    s = get_session()
-    row = s.query(Config).filter_by(key=key).first()
-    if row:
-        row.value = str(value)
-    else:
-        s.add(Config(key=key, value=str(value)))
-    s.commit()
+    s = base.get_session()
+    try:
+        row = s.query(Config).filter_by(key=key).first()
+        if row:
+            row.value = str(value)
+        else:
+            s.add(Config(key=key, value=str(value)))
+        s.commit()
+    finally:
+        s.close()
+    _cache.invalidate()
 
 
 def get_config(key, default=None):
-    s = get_session()
-    row = s.query(Config).filter_by(key=key).first()
-    return row.value if row else default
+    return _cache.get(key, default)
+
+
+def config_snapshot():
+    """All config values as a plain dict (a copy; safe to keep)."""
+    return _cache.snapshot()
+
+
+def get_str(key, default=None):
+    return get_config(key, default)
 
 
 def get_int(key, default):
     v = get_config(key)
     try:
         return int(v) if v is not None else default
-    except:
+    except (TypeError, ValueError):
         return default
 
 
@@ -30,5 +119,17 @@ def get_float(key, default):
     v = get_config(key)
     try:
         return float(v) if v is not None else default
-    except:
+    except (TypeError, ValueError):
+        return default
+
+
+def get_bool(key, default):
+    v = get_config(key)
+    if v is None:
         return default
+    v = v.strip().lower()
+    if v in ("1", "true", "yes", "on"):
+        return True
+    if v in ("0", "false", "no", "off"):
+        return False
+    return default
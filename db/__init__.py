@@ -3,4 +3,5 @@
 Simple re-exports for DB helpers.
 """
 
-from .base import Base, engine, get_session
+from .base import Base, engine, get_session, create_sqlite_engine, read_pragmas
+from .migrations import init_db, SCHEMA_VERSION
@@ -1,14 +1,104 @@
 import os
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import declarative_base, sessionmaker
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 PROJECT_ROOT = os.path.abspath(os.path.join(BASE_DIR, "..", ".."))
-DATABASE_PATH = os.path.join(PROJECT_ROOT, "job.db")
+DEFAULT_DATABASE_PATH = os.path.join(PROJECT_ROOT, "job.db")
+
+# QUEUECTL_DB points every process (CLI, workers) at the same database file.
+DATABASE_PATH = os.path.abspath(
+    os.path.expanduser(os.environ.get("QUEUECTL_DB") or DEFAULT_DATABASE_PATH)
+)
 
 DATABASE_URL = f"sqlite:///{DATABASE_PATH}"
 
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
+
+def beside_db(name):
+    """
+    Path `name` next to the database file. Runtime files that every process
+    sharing a job.db must agree on live there, whatever the cwd.
+    """
+    return os.path.join(os.path.dirname(DATABASE_PATH), name)
+
+# Pragmas applied to every new SQLite connection. WAL lets `status`/`list`
+# read while workers write; busy_timeout makes writers wait for the lock
+# instead of failing with "database is locked". Any entry can be overridden
+# with QUEUECTL_SQLITE_<NAME>, e.g. QUEUECTL_SQLITE_BUSY_TIMEOUT=10000.
+SQLITE_PROFILE = {
+    # only takes effect on a new database (or after `queuectl gc --vacuum-full`);
+    # lets `queuectl gc` return freed pages to the OS without a full VACUUM
+    "auto_vacuum": "INCREMENTAL",
+    "journal_mode": "WAL",
+    "busy_timeout": 5000,  # ms
+    "synchronous": "NORMAL",
+    "mmap_size": 256 * 1024 * 1024,  # bytes
+    "cache_size": -16000,  # negative = KiB, ~16 MB per connection
+    "temp_store": "MEMORY",
+}
+
+# Each process only needs a handful of connections (main loop + helpers).
+POOL_SIZE = int(os.environ.get("QUEUECTL_DB_POOL_SIZE", "4"))
+POOL_OVERFLOW = int(os.environ.get("QUEUECTL_DB_POOL_OVERFLOW", "4"))
+
+
+def load_profile(overrides=None):
+    profile = dict(SQLITE_PROFILE)
+    for name in SQLITE_PROFILE:
+        env = os.environ.get(f"QUEUECTL_SQLITE_{name.upper()}")
+        if env:
+            profile[name] = env
+    profile.update(overrides or {})
+    return profile
+
+
+def _apply_pragmas(dbapi_conn, profile):
+    cur = dbapi_conn.cursor()
+    try:
+        for name, value in profile.items():
+            cur.execute(f"PRAGMA {name}={value}")
+    finally:
+        cur.close()
+
+
+def create_sqlite_engine(url, profile=None):
+    """
+    Build an engine that applies the SQLite pragma profile on connect.
+    """
+    profile = load_profile(profile)
+    kwargs = {}
+    if ":memory:" not in url and url.rstrip("/") != "sqlite:":
+        kwargs.update(pool_size=POOL_SIZE, max_overflow=POOL_OVERFLOW)
+    eng = create_engine(
+        url,
+        connect_args={
+            "check_same_thread": False,
+            # driver-level wait, matching busy_timeout
+            "timeout": int(profile.get("busy_timeout", 5000)) / 1000.0,
+        },
+        **kwargs,
+    )
+
+    @event.listens_for(eng, "connect")
+    def _on_connect(dbapi_conn, connection_record):
+        _apply_pragmas(dbapi_conn, profile)
+
+    if hasattr(os, "register_at_fork"):
+        # forked workers must not reuse the parent's pooled connections
+        os.register_at_fork(after_in_child=lambda: eng.dispose(close=False))
+    return eng
+
+
+def read_pragmas(bind, names=None):
+    """
+    Report the settings actually in effect on a connection from `bind`.
+    """
+    names = names or list(SQLITE_PROFILE)
+    with bind.connect() as conn:
+        return {n: conn.exec_driver_sql(f"PRAGMA {n}").scalar() for n in names}
+
+
+engine = create_sqlite_engine(DATABASE_URL)
 SessionLocal = sessionmaker(bind=engine, expire_on_commit=False)
 
 Base = declarative_base()
@@ -0,0 +1,196 @@
+"""
+Lightweight schema versioning for job.db.
+
+The schema version lives in SQLite's PRAGMA user_version. New tables come from
+the models via create_all; everything an existing database needs on top of that
+(indexes, new columns, backfills) is an idempotent step in MIGRATIONS, applied
+in order from the stored version up to SCHEMA_VERSION.
+"""
+
+from .base import Base, engine
+from . import models
+
+
+def _create_index(conn, table, name):
+    for ix in table.indexes:
+        if ix.name == name:
+            ix.create(conn, checkfirst=True)
+            return
+    raise KeyError(name)
+
+
+def _add_column(conn, table, name):
+    existing = {r[1] for r in conn.exec_driver_sql(f"PRAGMA table_info({table.name})")}
+    if name in existing:
+        return
+    column = table.c[name]
+    ddl = column.type.compile(dialect=conn.dialect)
+    conn.exec_driver_sql(f"ALTER TABLE {table.name} ADD COLUMN {name} {ddl}")
+
+
+def _v1_claim_indexes(conn):
+    _create_index(conn, models.Job.__table__, "ix_jobs_claim")
+    _create_index(conn, models.Job.__table__, "ix_jobs_created_at")
+    _create_index(conn, models.DeadJob.__table__, "ix_dead_jobs_failed_at")
+    conn.exec_driver_sql("ANALYZE")
+
+
+def _v2_next_run_index(conn):
+    _create_index(conn, models.Job.__table__, "ix_jobs_next_run")
+
+
+# Triggers keep job_counts in step with every write path, including raw SQL
+# and bulk inserts. Rows are created on first use (INSERT OR IGNORE).
+_COUNT_TRIGGERS = {
+    "trg_jobs_count_insert": """
+        AFTER INSERT ON jobs BEGIN
+            INSERT OR IGNORE INTO job_counts (name, count) VALUES (NEW.status, 0);
+            UPDATE job_counts SET count = count + 1 WHERE name = NEW.status;
+        END""",
+    "trg_jobs_count_delete": """
+        AFTER DELETE ON jobs BEGIN
+            UPDATE job_counts SET count = count - 1 WHERE name = OLD.status;
+        END""",
+    "trg_jobs_count_update": """
+        AFTER UPDATE OF status ON jobs WHEN OLD.status IS NOT NEW.status BEGIN
+            UPDATE job_counts SET count = count - 1 WHERE name = OLD.status;
+            INSERT OR IGNORE INTO job_counts (name, count) VALUES (NEW.status, 0);
+            UPDATE job_counts SET count = count + 1 WHERE name = NEW.status;
+        END""",
+    "trg_dead_jobs_count_insert": """
+        AFTER INSERT ON dead_jobs BEGIN
+            INSERT OR IGNORE INTO job_counts (name, count) VALUES ('dead', 0);
+            UPDATE job_counts SET count = count + 1 WHERE name = 'dead';
+        END""",
+    "trg_dead_jobs_count_delete": """
+        AFTER DELETE ON dead_jobs BEGIN
+            UPDATE job_counts SET count = count - 1 WHERE name = 'dead';
+        END""",
+}
+
+
+def recount(conn):
+    """Rebuild job_counts from the tables (repair path; full scan)."""
+    conn.exec_driver_sql("DELETE FROM job_counts")
+    conn.exec_driver_sql(
+        "INSERT INTO job_counts (name, count) "
+        "SELECT status, count(*) FROM jobs WHERE status IS NOT NULL GROUP BY status"
+    )
+    conn.exec_driver_sql(
+        "INSERT INTO job_counts (name, count) SELECT 'dead', count(*) FROM dead_jobs"
+    )
+
+
+def _v3_job_counts(conn):
+    for name, body in _COUNT_TRIGGERS.items():
+        conn.exec_driver_sql(f"CREATE TRIGGER IF NOT EXISTS {name} {body}")
+    recount(conn)
+
+
+def _v4_claim_leases(conn):
+    jobs = models.Job.__table__
+    _add_column(conn, jobs, "lease_owner")
+    _add_column(conn, jobs, "lease_expires_at")
+    _create_index(conn, jobs, "ix_jobs_lease")
+    # Jobs already running under pre-lease workers get a grace period rather
+    # than being reclaimed the moment the first reaper runs.
+    conn.exec_driver_sql(
+        "UPDATE jobs SET lease_expires_at = datetime('now', '+1 hour') "
+        "WHERE status = 'processing' AND lease_expires_at IS NULL"
+    )
+
+
+def _v5_job_kinds(conn):
+    for model in (models.Job, models.JobHistory, models.DeadJob):
+        _add_column(conn, model.__table__, "kind")
+        _add_column(conn, model.__table__, "args")
+
+
+def _v6_job_deps(conn):
+    _add_column(conn, models.Job.__table__, "unmet_deps")
+    conn.exec_driver_sql("UPDATE jobs SET unmet_deps = 0 WHERE unmet_deps IS NULL")
+
+
+# Same idea per (queue, status), for the per-queue backlog in `status`.
+_QUEUE_COUNT_TRIGGERS = {
+    "trg_jobs_queue_count_insert": """
+        AFTER INSERT ON jobs BEGIN
+            INSERT OR IGNORE INTO queue_counts (queue, status, count)
+                VALUES (NEW.queue, NEW.status, 0);
+            UPDATE queue_counts SET count = count + 1
+                WHERE queue = NEW.queue AND status = NEW.status;
+        END""",
+    "trg_jobs_queue_count_delete": """
+        AFTER DELETE ON jobs BEGIN
+            UPDATE queue_counts SET count = count - 1
+                WHERE queue = OLD.queue AND status = OLD.status;
+        END""",
+    "trg_jobs_queue_count_update": """
+        AFTER UPDATE OF status, queue ON jobs
+        WHEN OLD.status IS NOT NEW.status OR OLD.queue IS NOT NEW.queue BEGIN
+            UPDATE queue_counts SET count = count - 1
+                WHERE queue = OLD.queue AND status = OLD.status;
+            INSERT OR IGNORE INTO queue_counts (queue, status, count)
+                VALUES (NEW.queue, NEW.status, 0);
+            UPDATE queue_counts SET count = count + 1
+                WHERE queue = NEW.queue AND status = NEW.status;
+        END""",
+}
+
+
+def recount_queues(conn):
+    """Rebuild queue_counts from the jobs table (repair path; full scan)."""
+    conn.exec_driver_sql("DELETE FROM queue_counts")
+    conn.exec_driver_sql(
+        "INSERT INTO queue_counts (queue, status, count) "
+        "SELECT queue, status, count(*) FROM jobs "
+        "WHERE queue IS NOT NULL AND status IS NOT NULL GROUP BY queue, status"
+    )
+
+
+def _v7_queues(conn):
+    for model in (models.Job, models.JobHistory, models.DeadJob):
+        _add_column(conn, model.__table__, "queue")
+        _add_column(conn, model.__table__, "priority")
+    conn.exec_driver_sql(
+        "UPDATE jobs SET queue = coalesce(queue, 'default'), "
+        "priority = coalesce(priority, 0) WHERE queue IS NULL OR priority IS NULL"
+    )
+    _create_index(conn, models.Job.__table__, "ix_jobs_priority")
+    _create_index(conn, models.Job.__table__, "ix_jobs_queue_claim")
+    for name, body in _QUEUE_COUNT_TRIGGERS.items():
+        conn.exec_driver_sql(f"CREATE TRIGGER IF NOT EXISTS {name} {body}")
+    recount_queues(conn)
+
+
+MIGRATIONS = [
+    _v1_claim_indexes,
+    _v2_next_run_index,
+    _v3_job_counts,
+    _v4_claim_leases,
+    _v5_job_kinds,
+    _v6_job_deps,
+    _v7_queues,
+]
+
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def get_schema_version(conn):
+    return conn.exec_driver_sql("PRAGMA user_version").scalar()
+
+
+def init_db(bind=None):
+    """
+    Create missing tables and upgrade an existing database in place.
+    Returns the schema version after upgrading.
+    """
+    bind = bind or engine
+    Base.metadata.create_all(bind=bind)
+    with bind.begin() as conn:
+        current = get_schema_version(conn)
+        for version in range(current + 1, SCHEMA_VERSION + 1):
+            MIGRATIONS[version - 1](conn)
+            conn.exec_driver_sql(f"PRAGMA user_version = {version}")
+            current = version
+    return current
@@ -1,4 +1,5 @@
-from sqlalchemy import Column, Integer, Text, String
+from sqlalchemy import Column, Index, Integer, LargeBinary, Text, String
+from sqlalchemy.orm import deferred
 from sqlalchemy.types import DateTime
 from datetime import datetime
 from .base import Base
@@ -8,8 +9,13 @@ class Job(Base):
 
     id = Column(String, primary_key=True)
     command = Column(Text, nullable=False)
+    # "shell" runs `command` through the shell; "callable" calls the Python
+    # function named by `command` ("pkg.module:func") with JSON `args`
+    kind = Column(String, default="shell")
+    args = Column(Text, nullable=True)
 
-    # pending, processing, completed, failed
+    # waiting (dependencies unfinished), pending, processing, completed,
+    # failed, cancelled (a dependency failed)
     status = Column(String, default="pending")
     attempts = Column(Integer, default=0)
     max_retries = Column(Integer, default=3)
@@ -18,21 +24,273 @@ class Job(Base):
     # when the job becomes eligible to run again
     next_run_at = Column(DateTime, nullable=True)
 
+    # named queue (workers pick theirs with --queues) and priority within
+    # it: higher runs first, FIFO by created_at among equals
+    queue = Column(String, default="default")
+    priority = Column(Integer, default=0)
+
+    # dependencies (job_deps rows) not completed yet; the job is "waiting"
+    # until this reaches zero
+    unmet_deps = Column(Integer, default=0)
+
+    # claim lease: the worker ("host:pid") holding a processing job, and when
+    # its hold lapses unless renewed; expired jobs are reclaimed by the reaper
+    lease_owner = Column(String, nullable=True)
+    lease_expires_at = Column(DateTime, nullable=True)
+
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
+    __table_args__ = (
+        # claim / list --state: equality on status, walk in created_at order,
+        # next_run_at checked from the index without touching the row
+        Index("ix_jobs_claim", "status", "created_at", "next_run_at"),
+        # list without --state
+        Index("ix_jobs_created_at", "created_at"),
+        # earliest scheduled retry, so idle workers can sleep until it is due
+        Index("ix_jobs_next_run", "status", "next_run_at"),
+        # reaper: processing jobs whose lease has lapsed
+        Index("ix_jobs_lease", "status", "lease_expires_at"),
+        # claim from any queue / from one queue: the highest priority, then
+        # the oldest, is the first entry of the index range
+        Index(
+            "ix_jobs_priority", "status", priority.desc(), "created_at", "next_run_at"
+        ),
+        Index(
+            "ix_jobs_queue_claim",
+            "queue",
+            "status",
+            priority.desc(),
+            "created_at",
+            "next_run_at",
+        ),
+    )
+
+
+class JobHistory(Base):
+    """
+    Archived (completed) jobs moved out of the hot jobs table by `queuectl gc`.
+    Job ids may be reused after archival, so rows get their own key.
+    """
+
+    __tablename__ = "job_history"
+
+    seq = Column(Integer, primary_key=True, autoincrement=True)
+    id = Column(String, nullable=False)
+    command = Column(Text, nullable=False)
+    kind = Column(String)
+    args = Column(Text, nullable=True)
+    status = Column(String)
+    attempts = Column(Integer)
+    max_retries = Column(Integer)
+    last_error = Column(Text, nullable=True)
+    next_run_at = Column(DateTime, nullable=True)
+    queue = Column(String, nullable=True)
+    priority = Column(Integer, nullable=True)
+    created_at = Column(DateTime)
+    updated_at = Column(DateTime)
+    archived_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        Index("ix_job_history_id", "id"),
+        Index("ix_job_history_archived_at", "archived_at"),
+    )
+
 
 class DeadJob(Base):
     __tablename__ = "dead_jobs"
 
     id = Column(String, primary_key=True)
     command = Column(Text)
+    kind = Column(String, nullable=True)
+    args = Column(Text, nullable=True)
+    # restored by `dlq retry`
+    queue = Column(String, nullable=True)
+    priority = Column(Integer, nullable=True)
     last_error = Column(Text, nullable=True)
     failed_at = Column(DateTime, default=datetime.utcnow)
 
+    __table_args__ = (Index("ix_dead_jobs_failed_at", "failed_at"),)
+
 
 class Config(Base):
     __tablename__ = "config"
 
     key = Column(String, primary_key=True)
     value = Column(String, nullable=False)
+
+
+class JobCount(Base):
+    """
+    Per-status row counts for jobs (plus "dead" for the DLQ), kept current by
+    SQLite triggers so `status` never has to scan the jobs table.
+    """
+
+    __tablename__ = "job_counts"
+
+    name = Column(String, primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+
+
+class QueueCount(Base):
+    """
+    Job counts per (queue, status), kept current by triggers like job_counts
+    so `status` can show each queue's backlog without scanning jobs.
+    """
+
+    __tablename__ = "queue_counts"
+
+    queue = Column(String, primary_key=True)
+    status = Column(String, primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+
+
+class Worker(Base):
+    """
+    One row per worker process, refreshed by the worker's heartbeat thread
+    every few seconds (never per job). `queuectl workers` reads it.
+    """
+
+    __tablename__ = "workers"
+
+    # "host:pid", the same name the worker uses as lease owner
+    id = Column(String, primary_key=True)
+    pid = Column(Integer, nullable=False)
+    host = Column(String, nullable=False)
+    queue = Column(String, nullable=True)
+    started_at = Column(DateTime, default=datetime.utcnow)
+    last_seen = Column(DateTime, default=datetime.utcnow)
+    current_job = Column(String, nullable=True)
+    jobs_done = Column(Integer, nullable=False, default=0)
+
+    __table_args__ = (Index("ix_workers_last_seen", "last_seen"),)
+
+
+class JobAttempt(Base):
+    """
+    One row per execution attempt, written by the worker in the same commit
+    that records the attempt's outcome.
+    """
+
+    __tablename__ = "job_attempts"
+
+    seq = Column(Integer, primary_key=True, autoincrement=True)
+    job_id = Column(String, nullable=False)
+    attempt = Column(Integer, nullable=False)
+    worker = Column(String, nullable=True)
+    started_at = Column(DateTime)
+    finished_at = Column(DateTime)
+    exit_code = Column(Integer)
+
+    __table_args__ = (
+        Index("ix_job_attempts_job", "job_id", "attempt"),
+        # retention (`gc --keep-history`) trims by age
+        Index("ix_job_attempts_finished_at", "finished_at"),
+    )
+
+
+class BrokerCheckpoint(Base):
+    """
+    Single row: the last broker journal segment whose changes are written
+    to the tables above. Restarts replay only newer segments.
+    """
+
+    __tablename__ = "broker_checkpoint"
+
+    id = Column(Integer, primary_key=True)
+    segment = Column(Integer, nullable=False, default=0)
+    written_at = Column(DateTime, default=datetime.utcnow)
+
+
+class Schedule(Base):
+    """
+    A recurring job. Each time `cron` (UTC) fires, one job is created from
+    `command`/`kind`/`args`; `next_fire_at` is the next fire still to run.
+    """
+
+    __tablename__ = "schedules"
+
+    id = Column(String, primary_key=True)
+    cron = Column(String, nullable=False)
+    command = Column(Text, nullable=False)
+    kind = Column(String, default="shell")
+    args = Column(Text, nullable=True)
+    max_retries = Column(Integer, nullable=True)
+    # missed fires (scheduler down): skip, latest or all
+    catch_up = Column(String, nullable=False, default="latest")
+    next_fire_at = Column(DateTime, nullable=False)
+    last_fire_at = Column(DateTime, nullable=True)
+    # bumped on every advance; schedulers compare-and-set on it
+    revision = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (Index("ix_schedules_next_fire_at", "next_fire_at"),)
+
+
+class JobDep(Base):
+    """
+    An unfinished dependency: `child_id` waits for `parent_id` to complete.
+    Rows are removed as soon as the parent completes or fails.
+    """
+
+    __tablename__ = "job_deps"
+
+    parent_id = Column(String, primary_key=True)
+    child_id = Column(String, primary_key=True)
+
+    __table_args__ = (Index("ix_job_deps_child", "child_id"),)
+
+
+class IdempotencyKey(Base):
+    """
+    An idempotency (or content) key and the job holding it until
+    `expires_at`. Once that job completes, the row doubles as its cached
+    result for later enqueues with the same key.
+    """
+
+    __tablename__ = "idempotency_keys"
+
+    key = Column(String, primary_key=True)
+    job_id = Column(String, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    expires_at = Column(DateTime, nullable=False)
+    # last enqueue that used the key; the least recently used go first
+    # when the table is over idempotency_max_keys
+    used_at = Column(DateTime, default=datetime.utcnow)
+    completed_at = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        Index("ix_idempotency_keys_job_id", "job_id"),
+        Index("ix_idempotency_keys_expires_at", "expires_at"),
+        Index("ix_idempotency_keys_used_at", "used_at"),
+    )
+
+
+class JobResult(Base):
+    """
+    The output of one attempt: compressed stdout/stderr tails, written with
+    its job_attempts row (which has the exit code and timings). The blobs
+    are deferred, so only `queuectl result` loads them; a blob over
+    result_inline_bytes lives in a content-addressed file instead (`*_ref`).
+    """
+
+    __tablename__ = "job_results"
+
+    seq = Column(Integer, primary_key=True, autoincrement=True)
+    job_id = Column(String, nullable=False)
+    attempt = Column(Integer, nullable=False)
+    finished_at = Column(DateTime)
+    codec = Column(String, nullable=False, default="zlib")
+    # uncompressed sizes
+    stdout_bytes = Column(Integer, default=0)
+    stderr_bytes = Column(Integer, default=0)
+    stdout = deferred(Column(LargeBinary, nullable=True), group="output")
+    stderr = deferred(Column(LargeBinary, nullable=True), group="output")
+    stdout_ref = Column(String, nullable=True)
+    stderr_ref = Column(String, nullable=True)
+
+    __table_args__ = (
+        Index("ix_job_results_job", "job_id", "attempt"),
+        # retention (`gc --keep-history`) trims by age, with job_attempts
+        Index("ix_job_results_finished_at", "finished_at"),
+    )
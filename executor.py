@@ -1,13 +1,69 @@
-
+import asyncio
 import subprocess
+import threading
+
+from flam.joblog import JobLog
+
+_CHUNK = 64 * 1024
+
 
-def run_command(cmd):
+def _pump(pipe, stream, log):
+    # Copy one child pipe into the log chunk by chunk; memory stays bounded
+    # no matter how much the child writes.
+    try:
+        for chunk in iter(lambda: pipe.read1(_CHUNK), b""):
+            log.write(stream, chunk)
+    finally:
+        pipe.close()
+
+
+def run_command(cmd, log=None):
+    """
+    Run `cmd` through the shell, streaming its output into `log` (a JobLog).
+    Returns (returncode, stdout_tail, stderr_tail) as text; the tails are
+    bounded by the log's tail_bytes.
+    """
+    log = log or JobLog()
     proc = subprocess.Popen(
         cmd,
         shell=True,
         stdout=subprocess.PIPE,
         stderr=subprocess.PIPE,
-        text=True,  # <--- IMPORTANT
     )
-    stdout, stderr = proc.communicate()
-    return proc.returncode, stdout, stderr
+    readers = [
+        threading.Thread(target=_pump, args=(proc.stdout, "stdout", log), daemon=True),
+        threading.Thread(target=_pump, args=(proc.stderr, "stderr", log), daemon=True),
+    ]
+    for t in readers:
+        t.start()
+    proc.wait()
+    for t in readers:
+        t.join()
+    return proc.returncode, log.tail("stdout"), log.tail("stderr")
+
+
+async def _pump_async(reader, stream, log):
+    while True:
+        chunk = await reader.read(_CHUNK)
+        if not chunk:
+            break
+        log.write(stream, chunk)
+
+
+async def run_command_async(cmd, log=None):
+    """
+    asyncio twin of run_command: lets one worker drive many children at once.
+    Returns the same (returncode, stdout_tail, stderr_tail) tuple of text.
+    """
+    log = log or JobLog()
+    proc = await asyncio.create_subprocess_shell(
+        cmd,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+    )
+    await asyncio.gather(
+        _pump_async(proc.stdout, "stdout", log),
+        _pump_async(proc.stderr, "stderr", log),
+    )
+    await proc.wait()
+    return proc.returncode, log.tail("stdout"), log.tail("stderr")
@@ -0,0 +1,155 @@
+# Idempotency keys. An enqueue that carries a key (given by the caller, or
+# derived from the job's content) does the work at most once per key and TTL
+# window: while the job holding the key is live, later enqueues coalesce onto
+# it, and once it has completed they get its cached result instead. Keys live
+# in job.db next to the jobs, so claiming one commits with the job insert.
+import hashlib
+import json
+from datetime import timedelta
+
+from sqlalchemy import delete, func, select, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from flam.config import get_float, get_int
+from flam.db.models import IdempotencyKey, Job
+
+DEFAULT_TTL = 24 * 3600.0  # seconds, counted from the key's first enqueue
+DEFAULT_MAX_KEYS = 100_000
+LIVE_STATES = ("waiting", "pending", "processing")
+
+
+def content_key(kind, command, args=None):
+    """A key naming the work itself: the same kind, command and args."""
+    payload = json.dumps([kind or "shell", command, args])
+    return "sha256:" + hashlib.sha256(payload.encode()).hexdigest()
+
+
+def key_settings(ttl=None):
+    """
+    (ttl seconds, max keys): `ttl` (seconds or a timedelta) or config
+    idempotency_ttl, and config idempotency_max_keys. Read them before the
+    write transaction: a cold config cache opens a connection of its own.
+    """
+    if ttl is None:
+        ttl = get_float("idempotency_ttl", DEFAULT_TTL)
+    elif isinstance(ttl, timedelta):
+        ttl = ttl.total_seconds()
+    if ttl <= 0:
+        raise ValueError("Idempotency TTL must be positive")
+    return ttl, get_int("idempotency_max_keys", DEFAULT_MAX_KEYS)
+
+
+def lookup_keys(session, keys, now):
+    """
+    The holders of `keys`: {key: {"job_id", "created_at", "completed_at",
+    "state"}}. state is "completed" (a cached result), the live status of
+    the holding job (coalesce onto it), or None when the key has expired or
+    its job failed or is gone, and the key may be taken over.
+    """
+    keys = list(keys)
+    if not keys:
+        return {}
+    k = IdempotencyKey
+    rows = session.execute(
+        select(k.key, k.job_id, k.created_at, k.expires_at, k.completed_at, Job.status)
+        .outerjoin(Job, Job.id == k.job_id)
+        .where(k.key.in_(keys))
+    ).all()
+    found = {}
+    for key, job_id, created_at, expires_at, completed_at, status in rows:
+        if expires_at <= now:
+            state = None
+        elif completed_at is not None or status == "completed":
+            state = "completed"
+        elif status in LIVE_STATES:
+            state = status
+        else:
+            state = None
+        found[key] = {
+            "job_id": job_id,
+            "created_at": created_at,
+            "completed_at": completed_at,
+            "state": state,
+        }
+    return found
+
+
+def claim_keys(session, claims, now, ttl):
+    """
+    Point each key in `claims` ({key: (job_id, holder)}, holder from
+    lookup_keys or None) at its new job, in the caller's transaction. A
+    stale key is taken over only if it is unchanged since the lookup.
+    Returns False if another enqueue got to a key first; the caller then
+    rolls back and looks again.
+    """
+    table = IdempotencyKey.__table__
+    expires = now + timedelta(seconds=ttl)
+    fresh = {"created_at": now, "expires_at": expires, "used_at": now}
+    new = [
+        dict(fresh, key=key, job_id=job_id)
+        for key, (job_id, holder) in claims.items()
+        if holder is None
+    ]
+    if new:
+        stmt = sqlite_insert(table).on_conflict_do_nothing()
+        if session.execute(stmt, new).rowcount != len(new):
+            return False
+    for key, (job_id, holder) in claims.items():
+        if holder is None:
+            continue
+        taken = session.execute(
+            update(table)
+            .where(
+                table.c.key == key,
+                table.c.job_id == holder["job_id"],
+                table.c.created_at == holder["created_at"],
+            )
+            .values(dict(fresh, job_id=job_id, completed_at=None))
+        ).rowcount
+        if not taken:
+            return False
+    return True
+
+
+def touch_keys(session, keys, now):
+    """Mark `keys` as just used (LRU order)."""
+    table = IdempotencyKey.__table__
+    session.execute(
+        update(table).where(table.c.key.in_(list(keys))).values(used_at=now)
+    )
+
+
+def complete_keys(session, job_ids, now):
+    """
+    Record that `job_ids` completed, in the transaction that marks them
+    completed: their keys now hold a cached result.
+    """
+    job_ids = list(job_ids)
+    if not job_ids:
+        return
+    table = IdempotencyKey.__table__
+    session.execute(
+        update(table)
+        .where(table.c.job_id.in_(job_ids), table.c.completed_at.is_(None))
+        .values(completed_at=now)
+    )
+
+
+def prune_keys(session, now, max_keys=None):
+    """
+    Drop expired keys, then (given `max_keys`) the least recently used ones
+    beyond it, in the caller's transaction. Returns the number dropped. The
+    expiry pass is an index range; the size cap counts the table, so single
+    enqueues leave it to bulk chunks and gc.
+    """
+    table = IdempotencyKey.__table__
+    dropped = session.execute(delete(table).where(table.c.expires_at <= now)).rowcount
+    if max_keys is None:
+        return dropped
+    excess = session.scalar(select(func.count()).select_from(table)) - max_keys
+    if excess > 0:
+        oldest = select(table.c.key).order_by(table.c.used_at).limit(excess)
+        dropped += session.execute(
+            delete(table).where(table.c.key.in_(oldest.scalar_subquery()))
+        ).rowcount
+    return dropped
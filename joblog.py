@@ -0,0 +1,158 @@
+# Per-job output logs: child stdout/stderr is streamed to logs/<job>.log next to
+# job.db as it is produced, with size-capped rotation. Only a bounded tail of
+# each stream is kept in memory (and later in the database). The logs go when
+# their job is deleted or archived by gc.
+import gzip
+import hashlib
+import os
+import re
+import shutil
+import threading
+
+from flam.db.base import beside_db
+
+LOG_DIR = beside_db("logs")
+DEFAULT_MAX_BYTES = 10 * 1024 * 1024
+DEFAULT_BACKUPS = 3
+DEFAULT_TAIL_BYTES = 8 * 1024
+
+_UNSAFE = re.compile(r"[^A-Za-z0-9._-]")
+
+
+def log_path(job_id, log_dir=LOG_DIR):
+    safe = _UNSAFE.sub("_", job_id)
+    if safe != job_id:
+        # keep sanitized names from colliding
+        safe += "-" + hashlib.sha1(job_id.encode()).hexdigest()[:8]
+    return os.path.join(log_dir, f"{safe}.log")
+
+
+_ROTATED = re.compile(r"\.\d+(\.gz)?$")
+
+
+def remove_logs(job_ids, log_dir=LOG_DIR):
+    """
+    Delete the logs of `job_ids`, rotated segments included. Returns the
+    number of files removed.
+    """
+    names = {os.path.basename(log_path(job_id, log_dir)) for job_id in job_ids}
+    if not names or not os.path.isdir(log_dir):
+        return 0
+    removed = 0
+    for name in os.listdir(log_dir):
+        if _ROTATED.sub("", name) in names:
+            try:
+                os.remove(os.path.join(log_dir, name))
+                removed += 1
+            except FileNotFoundError:
+                pass
+    return removed
+
+
+class JobLog:
+    """
+    Sink for one job attempt's output. Writes go straight to the log file
+    (when `path` is set) and into per-stream tail buffers capped at
+    `tail_bytes`; when the file reaches `max_bytes` it is rotated to
+    .1, .2, ... (gzip-compressed if `compress`), keeping `backups` segments.
+    Safe to write from several reader threads.
+    """
+
+    def __init__(
+        self,
+        path=None,
+        max_bytes=DEFAULT_MAX_BYTES,
+        backups=DEFAULT_BACKUPS,
+        compress=False,
+        tail_bytes=DEFAULT_TAIL_BYTES,
+    ):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.compress = compress
+        self.tail_bytes = tail_bytes
+        self._tails = {"stdout": bytearray(), "stderr": bytearray()}
+        self._lock = threading.Lock()
+        self._fp = None
+        self._size = 0
+        if path:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            self._fp = open(path, "ab")
+            self._size = self._fp.tell()
+
+    def header(self, text):
+        """Write a marker line to the file only (not part of the tails)."""
+        if self._fp is not None:
+            with self._lock:
+                self._write_file(f"--- {text} ---\n".encode())
+                self._fp.flush()
+
+    def write(self, stream, data):
+        if not data:
+            return
+        with self._lock:
+            tail = self._tails[stream]
+            tail += data[-self.tail_bytes :]
+            if len(tail) > self.tail_bytes:
+                del tail[: len(tail) - self.tail_bytes]
+            if self._fp is not None:
+                self._write_file(data)
+                # readers (`queuectl logs -f`) see output as it happens
+                self._fp.flush()
+
+    def _write_file(self, data):
+        self._fp.write(data)
+        self._size += len(data)
+        if self.max_bytes and self._size >= self.max_bytes:
+            self._rotate()
+
+    def _rotate(self):
+        self._fp.close()
+        if self.backups > 0:
+            for i in range(self.backups, 0, -1):
+                for suffix in ("", ".gz"):
+                    src = f"{self.path}.{i}{suffix}"
+                    if not os.path.exists(src):
+                        continue
+                    if i == self.backups:
+                        os.remove(src)
+                    else:
+                        os.replace(src, f"{self.path}.{i + 1}{suffix}")
+            if self.compress:
+                with open(self.path, "rb") as src:
+                    with gzip.open(f"{self.path}.1.gz", "wb") as dst:
+                        shutil.copyfileobj(src, dst)
+                os.remove(self.path)
+            else:
+                os.replace(self.path, f"{self.path}.1")
+        self._fp = open(self.path, "wb")
+        self._size = 0
+
+    def tail(self, stream):
+        with self._lock:
+            return bytes(self._tails[stream]).decode(errors="replace")
+
+    def close(self):
+        with self._lock:
+            if self._fp is not None:
+                self._fp.close()
+                self._fp = None
+
+
+def read_tail(path, lines=20, block_size=8192):
+    """
+    Last `lines` lines of a file, read backwards in blocks so huge logs are
+    not loaded into memory. Returns bytes.
+    """
+    if lines <= 0:
+        return b""
+    with open(path, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        pos = f.tell()
+        data = b""
+        while pos > 0 and data.count(b"\n") <= lines:
+            step = min(block_size, pos)
+            pos -= step
+            f.seek(pos)
+            data = f.read(step) + data
+    return b"".join(data.splitlines(keepends=True)[-lines:])
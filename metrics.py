@@ -0,0 +1,274 @@
+# In-process metrics for workers: histograms and counters kept in memory,
+# written every heartbeat to metrics/<worker>.<start>.json beside job.db, and
+# merged across all workers into Prometheus text format by `queuectl metrics`.
+import glob
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from flam.db.base import beside_db
+
+METRICS_DIR = beside_db("metrics")
+PREFIX = "queuectl_"
+# the summed snapshots of exited workers, folded in by `fold_exited`
+EXITED_FILE = "exited.json"
+# a worker flushes every heartbeat; a file this quiet belongs to one that exited
+EXITED_AFTER = 3600.0
+
+# seconds; spans sub-millisecond DB calls up to hour-long jobs
+DEFAULT_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+    300.0,
+    900.0,
+    3600.0,
+)
+
+HISTOGRAMS = {
+    "claim_latency_seconds": "Time to claim a batch of jobs (one UPDATE ... RETURNING)",
+    "queue_wait_seconds": "Time a job waited between becoming runnable and starting",
+    "execution_seconds": "Wall time of one job attempt",
+    "db_commit_seconds": "Time to record an attempt's outcome (statement + commit)",
+}
+
+COUNTERS = {
+    "jobs_claimed_total": "Jobs claimed by workers",
+    "jobs_completed_total": "Attempts that succeeded",
+    "jobs_failed_total": "Attempts that failed",
+    "jobs_retried_total": "Failed attempts scheduled for retry",
+    "jobs_dead_total": "Jobs moved to the dead-letter queue",
+}
+
+
+class Histogram:
+    """Cumulative-bucket histogram, Prometheus style."""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.count += 1
+        self.sum += value
+
+    def snapshot(self):
+        return {
+            "buckets": list(self.buckets),
+            "counts": list(self.counts),
+            "count": self.count,
+            "sum": self.sum,
+        }
+
+
+class Metrics:
+    """
+    One process's histograms and counters. Updates are a lock plus a few
+    integer adds; nothing touches the disk until `flush`.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self._lock = threading.Lock()
+        self.histograms = {name: Histogram(buckets) for name in HISTOGRAMS}
+        self.counters = dict.fromkeys(COUNTERS, 0)
+
+    def observe(self, name, value):
+        with self._lock:
+            self.histograms[name].observe(value)
+
+    def inc(self, name, n=1):
+        with self._lock:
+            self.counters[name] += n
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "histograms": {n: h.snapshot() for n, h in self.histograms.items()},
+                "counters": dict(self.counters),
+            }
+
+    def flush(self, path):
+        """Atomically replace `path` with the current snapshot."""
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp = f"{path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.snapshot(), f)
+        os.replace(tmp, path)
+
+
+def metrics_path(worker_id, started, metrics_dir=METRICS_DIR):
+    """
+    The snapshot file of the worker process `worker_id` started at
+    `started` (epoch seconds). The start time keeps a reused pid from
+    overwriting an exited worker's counts.
+    """
+    safe = "".join(c if c.isalnum() or c in "._-" else "_" for c in worker_id)
+    return os.path.join(metrics_dir, f"{safe}.{int(started * 1000)}.json")
+
+
+def _read(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _merge(merged, snap):
+    for name, n in snap.get("counters", {}).items():
+        merged["counters"][name] = merged["counters"].get(name, 0) + n
+    for name, h in snap.get("histograms", {}).items():
+        into = merged["histograms"].get(name)
+        if into is None or into["buckets"] != h["buckets"]:
+            if into is not None:
+                continue  # bucket layout changed; keep the first layout
+            merged["histograms"][name] = {
+                "buckets": list(h["buckets"]),
+                "counts": list(h["counts"]),
+                "count": h["count"],
+                "sum": h["sum"],
+            }
+            continue
+        into["counts"] = [a + b for a, b in zip(into["counts"], h["counts"])]
+        into["count"] += h["count"]
+        into["sum"] += h["sum"]
+
+
+def collect(metrics_dir=METRICS_DIR):
+    """
+    Merge every worker's snapshot file, plus the folded total of exited
+    workers, so counters stay monotonic across restarts.
+    """
+    merged = {"histograms": {}, "counters": dict.fromkeys(COUNTERS, 0), "workers": 0}
+    for path in sorted(glob.glob(os.path.join(metrics_dir, "*.json"))):
+        snap = _read(path)
+        if snap is None:
+            continue
+        if os.path.basename(path) != EXITED_FILE:
+            merged["workers"] += 1
+        _merge(merged, snap)
+    return merged
+
+
+def fold_exited(metrics_dir=METRICS_DIR, max_age=EXITED_AFTER):
+    """
+    Add the files of workers that have not flushed for `max_age` seconds to
+    the exited-workers total and remove them; `collect` sums the same.
+    Returns the number of files folded.
+    """
+    total = os.path.join(metrics_dir, EXITED_FILE)
+    cutoff = time.time() - max_age
+    old = []
+    for path in glob.glob(os.path.join(metrics_dir, "*.json")):
+        if path == total:
+            continue
+        try:
+            if os.path.getmtime(path) < cutoff:
+                old.append(path)
+        except FileNotFoundError:
+            pass
+    if not old:
+        return 0
+    merged = {"histograms": {}, "counters": dict.fromkeys(COUNTERS, 0)}
+    for path in [total] + old:
+        snap = _read(path)
+        if snap is not None:
+            _merge(merged, snap)
+    tmp = f"{total}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(merged, f)
+    os.replace(tmp, total)
+    for path in old:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+    return len(old)
+
+
+def _num(v):
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+
+def render_prometheus(snapshot, gauges=None):
+    """
+    Prometheus text exposition for a merged snapshot, plus optional
+    `gauges`: {name: (help, {state: value})}; a None state is unlabelled.
+    """
+    lines = []
+    for name, help_text in COUNTERS.items():
+        metric = PREFIX + name
+        lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} counter"]
+        lines.append(f"{metric} {snapshot['counters'].get(name, 0)}")
+    for name, help_text in HISTOGRAMS.items():
+        h = snapshot["histograms"].get(name)
+        if h is None:
+            continue
+        metric = PREFIX + name
+        lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} histogram"]
+        running = 0
+        for bound, n in zip(h["buckets"], h["counts"]):
+            running += n
+            lines.append(f'{metric}_bucket{{le="{_num(float(bound))}"}} {running}')
+        lines.append(f'{metric}_bucket{{le="+Inf"}} {h["count"]}')
+        lines.append(f"{metric}_sum {_num(float(h['sum']))}")
+        lines.append(f"{metric}_count {h['count']}")
+    for name, (help_text, values) in (gauges or {}).items():
+        metric = PREFIX + name
+        lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} gauge"]
+        for label, v in values.items():
+            labels = "" if label is None else f'{{state="{label}"}}'
+            lines.append(f"{metric}{labels} {_num(v)}")
+    return "\n".join(lines) + "\n"
+
+
+def serve(render, host="127.0.0.1", port=9464):
+    """
+    Serve `render()` at /metrics until interrupted. Every scrape renders
+    afresh, so it always reflects the latest worker flushes.
+    """
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] not in ("/", "/metrics"):
+                self.send_error(404)
+                return
+            try:
+                body = render().encode()
+            except Exception as e:
+                self.send_error(500, explain=repr(e))
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, fmt, *args):
+            pass  # one line per scrape is noise
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
@@ -0,0 +1,133 @@
+# Local wakeup channel so idle workers react to new work immediately instead of
+# polling. Each idle worker binds a Unix datagram socket under wake/ next to
+# job.db; enqueue/retry paths send a one-byte datagram to every socket there.
+# Where AF_UNIX datagrams are unavailable (Windows) the channel degrades to
+# sleeping.
+import os
+import select
+import socket
+import time
+
+from flam.db.base import beside_db
+
+WAKE_DIR = beside_db("wake")
+
+_HAS_UNIX_DGRAM = hasattr(socket, "AF_UNIX") and os.name != "nt"
+
+
+class WakeChannel:
+    def __init__(self, wake_dir=WAKE_DIR):
+        self.path = os.path.join(wake_dir, f"worker-{os.getpid()}.sock")
+        self.sock = None
+        self._loop = None
+        if not _HAS_UNIX_DGRAM:
+            return
+        try:
+            os.makedirs(wake_dir, exist_ok=True)
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            sock.bind(self.path)
+            sock.setblocking(False)
+            self.sock = sock
+        except OSError:
+            self.sock = None
+
+    def _drain(self):
+        woke = False
+        try:
+            while True:
+                self.sock.recv(64)
+                woke = True
+        except (BlockingIOError, OSError):
+            pass
+        return woke
+
+    def wait(self, timeout):
+        """
+        Sleep up to `timeout` seconds, returning early (True) when woken.
+        """
+        timeout = max(timeout, 0.0)
+        if self.sock is None:
+            time.sleep(timeout)
+            return False
+        ready, _, _ = select.select([self.sock], [], [], timeout)
+        return bool(ready) and self._drain()
+
+    def attach(self, loop, callback):
+        """
+        Call `callback` from the asyncio loop whenever a wakeup arrives.
+        Returns False when the loop or platform cannot watch the socket.
+        """
+        if self.sock is None:
+            return False
+
+        def _on_readable():
+            if self._drain():
+                callback()
+
+        try:
+            loop.add_reader(self.sock.fileno(), _on_readable)
+        except (NotImplementedError, RuntimeError):
+            return False
+        self._loop = loop
+        return True
+
+    def poke(self):
+        """Wake this channel's own waiter (e.g. from a signal handler)."""
+        if self.sock is None:
+            return
+        try:
+            self.sock.sendto(b"!", self.path)
+        except OSError:
+            pass
+
+    def close(self):
+        if self.sock is None:
+            return
+        if self._loop is not None and not self._loop.is_closed():
+            self._loop.remove_reader(self.sock.fileno())
+        self._loop = None
+        self.sock.close()
+        self.sock = None
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+def wake_workers(wake_dir=WAKE_DIR):
+    """
+    Nudge every idle worker. Best effort: never raises, and removes sockets
+    left behind by workers that died without cleaning up.
+    """
+    if not _HAS_UNIX_DGRAM or not os.path.isdir(wake_dir):
+        return 0
+    sent = 0
+    try:
+        names = os.listdir(wake_dir)
+    except OSError:
+        return 0
+    sender = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    sender.setblocking(False)
+    try:
+        for name in names:
+            if not name.endswith(".sock"):
+                continue
+            path = os.path.join(wake_dir, name)
+            try:
+                sender.sendto(b"!", path)
+                sent += 1
+            except BlockingIOError:
+                # receiver's buffer is full: a wakeup is already pending
+                sent += 1
+            except (ConnectionRefusedError, FileNotFoundError):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            except OSError:
+                pass
+    finally:
+        sender.close()
+    return sent
@@ -0,0 +1,221 @@
+# Python-callable jobs ("pkg.module:func" plus JSON args) run inside a small
+# pool of long-lived child processes instead of a fresh shell + interpreter per
+# job. Children import target modules once and keep them; each child is
+# recycled after a number of jobs or once its RSS grows too large.
+import contextlib
+import importlib
+import json
+import multiprocessing
+import os
+import queue
+import signal
+import sys
+import threading
+import traceback
+
+from flam.joblog import JobLog
+
+DEFAULT_MAX_JOBS = 1000
+DEFAULT_MAX_RSS_MB = 512
+
+# exit code reported when the child process died mid-job
+CHILD_DIED = -9
+
+
+def split_target(target):
+    """'pkg.module:func' -> ('pkg.module', 'func'); raises ValueError."""
+    module, sep, attr = (target or "").partition(":")
+    if not sep or not module or not attr:
+        raise ValueError(f"Callable must look like 'pkg.module:func', got {target!r}")
+    return module, attr
+
+
+def encode_args(args):
+    """Normalise enqueue-time args to the JSON text stored on the job."""
+    if args is None or args == "":
+        return None
+    if isinstance(args, str):
+        json.loads(args)  # validate; raises ValueError
+        return args
+    return json.dumps(args)
+
+
+def call_with_args(func, args):
+    """An object becomes keyword arguments, a list positional ones."""
+    if args is None:
+        return func()
+    if isinstance(args, dict):
+        return func(**args)
+    if isinstance(args, list):
+        return func(*args)
+    return func(args)
+
+
+class _StreamToLog:
+    def __init__(self, log, stream):
+        self._log = log
+        self._stream = stream
+
+    def write(self, text):
+        self._log.write(self._stream, text.encode(errors="replace"))
+        return len(text)
+
+    def flush(self):
+        pass
+
+
+def _rss_mb():
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, IndexError, AttributeError):
+        pass
+    try:
+        import resource
+
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # kilobytes on Linux, bytes on macOS
+        return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+    except ImportError:
+        return 0.0
+
+
+def _child_main(conn, preload, max_jobs, max_rss_mb):
+    # the parent worker decides when to stop; a terminal Ctrl+C must not
+    # interrupt a running job here
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    for name in preload:
+        try:
+            importlib.import_module(name)
+        except Exception as e:
+            print(f"[pyexec {os.getpid()}] preload {name} failed: {e!r}")
+    resolved = {}
+    done = 0
+    while True:
+        try:
+            msg = conn.recv()
+        except EOFError:
+            return
+        if msg[0] == "stop":
+            return
+        _, target, args, log_kwargs, header = msg
+        log = JobLog(**log_kwargs)
+        log.header(header)
+        exit_code = 0
+        try:
+            func = resolved.get(target)
+            if func is None:
+                module, attr = split_target(target)
+                func = importlib.import_module(module)
+                for part in attr.split("."):
+                    func = getattr(func, part)
+                resolved[target] = func
+            out, err = _StreamToLog(log, "stdout"), _StreamToLog(log, "stderr")
+            with contextlib.redirect_stdout(out), contextlib.redirect_stderr(err):
+                call_with_args(func, json.loads(args) if args else None)
+        except SystemExit as e:
+            exit_code = e.code if isinstance(e.code, int) else int(e.code is not None)
+        except BaseException:
+            exit_code = 1
+            log.write("stderr", traceback.format_exc().encode(errors="replace"))
+        finally:
+            log.close()
+        done += 1
+        recycle = done >= max_jobs or (max_rss_mb and _rss_mb() > max_rss_mb)
+        conn.send((exit_code, log.tail("stdout"), log.tail("stderr"), bool(recycle)))
+        if recycle:
+            return
+
+
+class _Child:
+    def __init__(self, ctx, preload, max_jobs, max_rss_mb):
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(
+            target=_child_main,
+            args=(child_conn, preload, max_jobs, max_rss_mb),
+            daemon=True,
+        )
+        self.process.start()
+        child_conn.close()
+
+    def stop(self, timeout=5.0):
+        try:
+            self.conn.send(("stop",))
+        except (OSError, ValueError):
+            pass
+        self.process.join(timeout)
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join()
+        self.conn.close()
+
+
+class CallablePool:
+    """
+    `size` pre-started child processes that run callable jobs one at a time
+    each. Children are spawned (not forked) so they never inherit the
+    worker's threads or database connections, and are replaced as soon as
+    they retire. `run` blocks until a child is free; it is thread-safe, so
+    the asyncio worker calls it from an executor.
+    """
+
+    def __init__(
+        self,
+        size=1,
+        preload=(),
+        max_jobs=DEFAULT_MAX_JOBS,
+        max_rss_mb=DEFAULT_MAX_RSS_MB,
+    ):
+        self._ctx = multiprocessing.get_context("spawn")
+        self._args = (tuple(preload), max(max_jobs, 1), max_rss_mb)
+        self._idle = queue.Queue()
+        self._children = set()
+        self._lock = threading.Lock()
+        self._closed = False
+        for _ in range(max(size, 1)):
+            self._idle.put(self._spawn())
+
+    def _spawn(self):
+        child = _Child(self._ctx, *self._args)
+        with self._lock:
+            self._children.add(child)
+        return child
+
+    def _retire(self, child):
+        with self._lock:
+            self._children.discard(child)
+        child.stop()
+        if not self._closed:
+            self._idle.put(self._spawn())
+
+    def run(self, target, args, log_kwargs, header):
+        """Returns (exit_code, stdout_tail, stderr_tail) like run_command."""
+        child = self._idle.get()
+        while not child.process.is_alive():
+            # died while idle (e.g. OOM-killed); don't charge the job for it
+            self._retire(child)
+            child = self._idle.get()
+        try:
+            child.conn.send(("run", target, args, log_kwargs, header))
+            exit_code, stdout, stderr, recycle = child.conn.recv()
+        except (EOFError, OSError):
+            self._retire(child)
+            return CHILD_DIED, "", "callable process died while running the job"
+        if recycle:
+            self._retire(child)
+        else:
+            self._idle.put(child)
+        return exit_code, stdout, stderr
+
+    def pids(self):
+        with self._lock:
+            return sorted(c.process.pid for c in self._children)
+
+    def close(self):
+        self._closed = True
+        with self._lock:
+            children = list(self._children)
+            self._children.clear()
+        for child in children:
+            child.stop()
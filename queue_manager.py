@@ -1,33 +1,637 @@
-from datetime import datetime
-from sqlalchemy import and_, or_
-from flam.db.models import Job, DeadJob
+import os
+import socket
+from datetime import datetime, timedelta
+from itertools import islice
+from sqlalchemy import (
+    DateTime,
+    and_,
+    delete,
+    exists,
+    func,
+    insert,
+    literal,
+    or_,
+    select,
+    tuple_,
+    update,
+)
+from flam.config import get_str
+from flam.db.models import (
+    Job,
+    DeadJob,
+    JobAttempt,
+    JobCount,
+    JobDep,
+    JobHistory,
+    JobResult,
+    QueueCount,
+)
+from flam.db.migrations import recount, recount_queues
+from flam.idempotency import (
+    claim_keys,
+    complete_keys,
+    content_key,
+    key_settings,
+    lookup_keys,
+    prune_keys,
+    touch_keys,
+)
+from flam.joblog import remove_logs
+from flam.notify import wake_workers
+from flam.pyexec import encode_args, split_target
+from flam.results import result_settings, split_results
+from flam.timeutil import parse_duration, parse_timestamp
+from flam.tracing import traced
 
 
-def enqueue(job_id, command, session, replace=False, max_retries=None):
+JOB_KINDS = ("shell", "callable")
+
+
+def _check_kind(kind, command, args):
+    if kind not in JOB_KINDS:
+        raise ValueError(f"kind must be one of {JOB_KINDS}")
+    if kind == "callable":
+        split_target(command)
+    elif args not in (None, ""):
+        raise ValueError("args are only supported for callable jobs")
+    return encode_args(args)
+
+
+DEFAULT_QUEUE = "default"
+
+
+def _check_queue(queue, priority):
+    """Normalized (queue, priority); None or "" means the defaults."""
+    queue = str(queue).strip() if queue not in (None, "") else DEFAULT_QUEUE
+    if not queue or "," in queue or ":" in queue:
+        raise ValueError(f"Bad queue name {queue!r}")
+    try:
+        priority = int(priority) if priority not in (None, "") else 0
+    except (TypeError, ValueError):
+        raise ValueError(f"priority must be an integer, not {priority!r}") from None
+    return queue, priority
+
+
+def parse_queues(spec):
+    """
+    "high:5,default:1" -> [("high", 5), ("default", 1)]. A queue without a
+    weight gets 1.
+    """
+    queues = {}
+    for part in spec.split(","):
+        name, sep, weight = part.partition(":")
+        name = name.strip()
+        if not name:
+            raise ValueError(f"Bad queue list {spec!r}")
+        try:
+            weight = int(weight) if sep else 1
+        except ValueError:
+            raise ValueError(f"Bad weight for queue '{name}': {weight!r}") from None
+        if weight < 1:
+            raise ValueError(f"Weight for queue '{name}' must be >= 1")
+        if name in queues:
+            raise ValueError(f"Queue '{name}' listed twice")
+        queues[name] = weight
+    return list(queues.items())
+
+
+class FairQueues:
+    """
+    Weighted fair choice between named queues, by smooth weighted
+    round-robin: with high:5,default:1, five of every six claim slots go to
+    "high", interleaved with the sixth rather than in a burst. A queue
+    with nothing runnable passes its slots on (see claim_jobs).
+    """
+
+    def __init__(self, queues):
+        self.weights = dict(queues)
+        self._total = sum(self.weights.values())
+        self._current = {name: 0 for name in self.weights}
+
+    def plan(self, slots):
+        """Quotas for `slots` claim slots: {queue: n}, every queue listed."""
+        quotas = {}
+        for _ in range(slots):
+            for name, weight in self.weights.items():
+                self._current[name] += weight
+            best = max(self._current, key=self._current.get)
+            self._current[best] -= self._total
+            quotas[best] = quotas.get(best, 0) + 1
+        for name in self.weights:
+            quotas.setdefault(name, 0)
+        return quotas
+
+
+def enqueue(
+    job_id,
+    command,
+    session,
+    replace=False,
+    max_retries=None,
+    kind="shell",
+    args=None,
+    run_at=None,
+    after=None,
+    queue=None,
+    priority=None,
+    idempotency_key=None,
+    dedupe=False,
+    key_ttl=None,
+):
     """
     Add a job to the queue.
     If replace=True and a job with the same id exists, delete & re-add it.
+    kind="callable" jobs name a Python function ("pkg.module:func") in
+    `command` and take JSON-serialisable `args`. A `run_at` time (UTC)
+    delays the job until then; `after` lists job ids that must complete
+    first. `queue` and `priority` default to "default" and 0.
+
+    With an `idempotency_key` (or `dedupe`, which derives one from kind,
+    command and args) the job is only added if no job holds that key within
+    `key_ttl` (see flam.idempotency). Returns {"id", "outcome"}: outcome is
+    "enqueued", "coalesced" (onto the live job holding the key, whose id is
+    returned) or "cached" (that job already completed, at "completed_at").
     """
+    args = _check_kind(kind, command, args)
+    queue, priority = _check_queue(queue, priority)
+    if dedupe and idempotency_key is None:
+        idempotency_key = content_key(kind, command, args)
+    if idempotency_key is not None:
+        ttl, _ = key_settings(key_ttl)
+        now = datetime.utcnow()
+        holder = _claim_key(session, idempotency_key, job_id, now, ttl)
+        if holder is not None:
+            print(f"[ENQUEUE] Job {job_id} deduplicated onto {holder['id']}.")
+            return holder
     existing = session.query(Job).filter_by(id=job_id).first()
     if existing:
         if not replace:
+            session.rollback()
             raise ValueError(f"Job '{job_id}' already exists.")
         session.delete(existing)
-        session.commit()
+        session.execute(delete(JobDep).where(JobDep.child_id == job_id))
+        session.flush()
 
     job = Job(
         id=job_id,
         command=command,
+        kind=kind,
+        args=args,
+        queue=queue,
+        priority=priority,
         status="pending",
         attempts=0,
         last_error=None,
-        next_run_at=None,
+        next_run_at=parse_timestamp(run_at) if run_at is not None else None,
         created_at=datetime.utcnow(),
         max_retries=max_retries,
     )
     session.add(job)
+    parents = parse_after(after)
+    if parents:
+        session.flush()
+        try:
+            add_dependencies(session, job_id, parents)
+        except ValueError:
+            session.rollback()
+            raise
+    if idempotency_key is not None:
+        prune_keys(session, now)
     session.commit()
+    wake_workers()
     print(f"[ENQUEUE] Job {job_id} added.")
+    return {"id": job_id, "outcome": "enqueued"}
+
+
+def _claim_key(session, key, job_id, now, ttl):
+    """
+    Take `key` for the new job `job_id` (uncommitted), or return the
+    outcome for the job already holding it (committed).
+    """
+    for _ in range(3):
+        holder = lookup_keys(session, [key], now).get(key)
+        if holder is not None and holder["state"] is not None:
+            touch_keys(session, [key], now)
+            session.commit()
+            if holder["state"] == "completed":
+                return {
+                    "id": holder["job_id"],
+                    "outcome": "cached",
+                    "completed_at": holder["completed_at"],
+                }
+            return {"id": holder["job_id"], "outcome": "coalesced"}
+        if claim_keys(session, {key: (job_id, holder)}, now, ttl):
+            return None
+        session.rollback()  # another enqueue took the key; look again
+    raise ValueError(f"Idempotency key {key!r} is contended; try again")
+
+
+def parse_after(value):
+    """'a,b' or ['a', 'b'] -> ['a', 'b'], without blanks or repeats."""
+    if value in (None, ""):
+        return []
+    if isinstance(value, str):
+        value = value.split(",")
+    return list(dict.fromkeys(str(v).strip() for v in value if str(v).strip()))
+
+
+def _descendants(session, job_id):
+    found, frontier = set(), [job_id]
+    while frontier:
+        children = session.scalars(
+            select(JobDep.child_id).where(JobDep.parent_id.in_(frontier))
+        ).all()
+        frontier = [c for c in children if c not in found]
+        found.update(frontier)
+    return found
+
+
+def add_dependencies(session, job_id, parents):
+    """
+    Make the just-inserted job `job_id` wait for `parents`. Runs in the
+    transaction that inserted it, after the insert, so the write lock is
+    already held and no parent can complete unseen. Completed (or archived)
+    parents count as met. Raises ValueError for an unknown or failed parent
+    or a cycle. Returns the number of unmet dependencies.
+    """
+    if job_id in parents:
+        raise ValueError(f"Job '{job_id}' cannot depend on itself")
+    status = dict(
+        session.execute(select(Job.id, Job.status).where(Job.id.in_(parents))).all()
+    )
+    for parent in parents:
+        if parent in status:
+            continue
+        if session.scalar(select(exists().where(DeadJob.id == parent))):
+            status[parent] = "dead"
+        elif session.scalar(select(exists().where(JobHistory.id == parent))):
+            status[parent] = "completed"
+        else:
+            raise ValueError(f"Job '{job_id}': unknown dependency '{parent}'")
+    for parent in parents:
+        if status[parent] in ("dead", "cancelled"):
+            raise ValueError(f"Job '{job_id}': dependency '{parent}' has failed")
+    unmet = [p for p in parents if status[p] != "completed"]
+    if not unmet:
+        return 0
+    cycle = sorted(set(unmet) & _descendants(session, job_id))
+    if cycle:
+        raise ValueError(f"Job '{job_id}': depending on '{cycle[0]}' makes a cycle")
+    session.execute(
+        insert(JobDep.__table__),
+        [{"parent_id": p, "child_id": job_id} for p in unmet],
+    )
+    session.execute(
+        update(Job.__table__)
+        .where(Job.__table__.c.id == job_id)
+        .values(status="waiting", unmet_deps=len(unmet))
+    )
+    return len(unmet)
+
+
+def resolve_dependents(session, parent_ids):
+    """
+    Count the just-completed `parent_ids` off their children's unmet_deps
+    and drop those edges, inside the caller's transaction. Children left
+    with none become pending. Returns the ids of the children made ready.
+    """
+    parent_ids = list(parent_ids)
+    if not parent_ids:
+        return []
+    jobs, deps = Job.__table__, JobDep.__table__
+    edges = session.execute(
+        select(deps.c.child_id, func.count())
+        .where(deps.c.parent_id.in_(parent_ids))
+        .group_by(deps.c.child_id)
+    ).all()
+    if not edges:
+        return []
+    session.execute(delete(deps).where(deps.c.parent_id.in_(parent_ids)))
+    by_count = {}
+    for child, n in edges:
+        by_count.setdefault(n, []).append(child)
+    for n, children in by_count.items():
+        session.execute(
+            update(jobs)
+            .where(jobs.c.id.in_(children))
+            .values(unmet_deps=jobs.c.unmet_deps - n)
+        )
+    ready = session.scalars(
+        select(jobs.c.id).where(
+            jobs.c.id.in_([child for child, _ in edges]),
+            jobs.c.status == "waiting",
+            jobs.c.unmet_deps <= 0,
+        )
+    ).all()
+    if ready:
+        session.execute(
+            update(jobs)
+            .where(jobs.c.id.in_(ready))
+            .values(status="pending", unmet_deps=0, updated_at=datetime.utcnow())
+        )
+    return ready
+
+
+DEPENDENCY_FAILURE_POLICIES = ("dlq", "cancel")
+
+# dead_jobs columns filled from a select over jobs (plus error and time)
+_DEAD_FROM_JOB = [
+    "id",
+    "command",
+    "kind",
+    "args",
+    "queue",
+    "priority",
+    "last_error",
+    "failed_at",
+]
+
+
+def _bury_where(session, where, error, now):
+    """
+    Move the jobs matching `where` to the DLQ with `error`, replacing any
+    DLQ entry under the same id, in the caller's transaction. Returns the
+    ids moved.
+    """
+    jobs, dead = Job.__table__, DeadJob.__table__
+    ids = session.scalars(select(jobs.c.id).where(where)).all()
+    if not ids:
+        return []
+    session.execute(delete(dead).where(dead.c.id.in_(ids)))
+    src = select(
+        jobs.c.id,
+        jobs.c.command,
+        jobs.c.kind,
+        jobs.c.args,
+        jobs.c.queue,
+        jobs.c.priority,
+        literal(error),
+        literal(now, DateTime),
+    ).where(where)
+    session.execute(insert(dead).from_select(_DEAD_FROM_JOB, src))
+    session.execute(delete(jobs).where(where))
+    return ids
+
+
+def dependency_failure_policy():
+    """
+    What happens to the dependents of a failed job (config
+    `dependency_failure`). Read it before opening the write transaction: a
+    cold config cache opens a connection of its own.
+    """
+    policy = get_str("dependency_failure", "dlq")
+    return policy if policy in DEPENDENCY_FAILURE_POLICIES else "dlq"
+
+
+def fail_dependents(session, parent_ids, policy):
+    """
+    The `parent_ids` will never complete: move their waiting descendants to
+    the DLQ ("dlq") or mark them cancelled ("cancel"), inside the caller's
+    transaction. Returns the ids of the jobs affected.
+    """
+    jobs, deps = Job.__table__, JobDep.__table__
+    cause = {}  # child -> the parent it failed through
+    frontier = list(parent_ids)
+    while frontier:
+        edges = session.execute(
+            select(deps.c.parent_id, deps.c.child_id).where(
+                deps.c.parent_id.in_(frontier)
+            )
+        ).all()
+        frontier = []
+        for parent, child in edges:
+            if child not in cause:
+                cause[child] = parent
+                frontier.append(child)
+    if not cause:
+        return []
+    ids = list(cause)
+    session.execute(
+        delete(deps).where(
+            or_(deps.c.parent_id.in_(list(parent_ids) + ids), deps.c.child_id.in_(ids))
+        )
+    )
+    by_parent = {}
+    for child, parent in cause.items():
+        by_parent.setdefault(parent, []).append(child)
+    now = datetime.utcnow()
+    for parent, children in by_parent.items():
+        error = f"dependency '{parent}' failed"
+        waiting = and_(jobs.c.id.in_(children), jobs.c.status == "waiting")
+        if policy == "cancel":
+            session.execute(
+                update(jobs)
+                .where(waiting)
+                .values(
+                    status="cancelled", last_error=error, unmet_deps=0, updated_at=now
+                )
+            )
+            continue
+        _bury_where(session, waiting, error, now)
+    return ids
+
+
+CONFLICT_POLICIES = ("skip", "replace", "fail")
+
+
+def _run_at(rec, created_at):
+    """next_run_at for a record's optional 'run_at' time or 'delay'."""
+    if rec.get("run_at") not in (None, ""):
+        return parse_timestamp(rec["run_at"])
+    delay = rec.get("delay")
+    if delay in (None, ""):
+        return None
+    if not isinstance(delay, timedelta):
+        delay = parse_duration(delay)
+    return created_at + delay
+
+
+def _job_row(rec, created_at):
+    job_id = rec.get("id")
+    # {"callable": "pkg.mod:func"} is shorthand for kind=callable
+    command = rec.get("command") or rec.get("callable")
+    if job_id in (None, "") or command in (None, ""):
+        raise ValueError(f"Job record needs 'id' and 'command': {rec!r}")
+    kind = rec.get("kind") or ("callable" if rec.get("callable") else "shell")
+    try:
+        args = _check_kind(kind, command, rec.get("args"))
+        next_run_at = _run_at(rec, created_at)
+        queue, priority = _check_queue(rec.get("queue"), rec.get("priority"))
+    except ValueError as e:
+        raise ValueError(f"Job '{job_id}': {e}")
+    max_retries = rec.get("max_retries")
+    return {
+        "id": str(job_id),
+        "command": command,
+        "kind": kind,
+        "args": args,
+        "queue": queue,
+        "priority": priority,
+        "status": "pending",
+        "attempts": 0,
+        "max_retries": int(max_retries) if max_retries not in (None, "") else None,
+        "last_error": None,
+        "next_run_at": next_run_at,
+        "created_at": created_at,
+        "updated_at": created_at,
+    }
+
+
+def chunk_rows(chunk, on_conflict, stats, last_ts=None):
+    """
+    Validated job rows for one chunk of records, keyed by id, with
+    duplicates inside the chunk resolved per `on_conflict`; the records
+    dropped count as skipped in `stats`, as no stored job was replaced.
+    created_at is strictly increasing from `last_ts` so file order
+    stays FIFO order. Returns (rows, last_ts).
+    """
+    rows = {}
+    for rec in chunk:
+        ts = datetime.utcnow()
+        if last_ts is not None and ts <= last_ts:
+            ts = last_ts + timedelta(microseconds=1)
+        last_ts = ts
+        row = _job_row(rec, ts)
+        if row["id"] in rows:
+            if on_conflict == "fail":
+                raise ValueError(f"Job '{row['id']}' appears more than once.")
+            stats["skipped"] += 1
+            if on_conflict == "skip":
+                continue
+        rows[row["id"]] = row
+    return rows, last_ts
+
+
+def enqueue_many(records, session, batch_size=1000, on_conflict="fail"):
+    """
+    Stream job records (dicts with 'id', 'command', optional 'max_retries',
+    'kind', 'args', 'run_at' or 'delay', 'after', 'queue', 'priority' and
+    'idempotency_key' or 'dedupe', or 'callable' in place of 'command') into
+    the queue using one executemany INSERT and one commit per chunk.
+
+    Duplicate ids are resolved per chunk with a single set-based lookup:
+      skip    - keep the existing job, drop the new record
+      replace - delete the existing job and insert the new one
+      fail    - raise ValueError; chunks already written stay committed
+    Records whose idempotency key is already held are dropped as well.
+    Returns counts: {"inserted", "replaced", "skipped"}.
+    """
+    if on_conflict not in CONFLICT_POLICIES:
+        raise ValueError(f"on_conflict must be one of {CONFLICT_POLICIES}")
+    if batch_size < 1:
+        raise ValueError("batch_size must be >= 1")
+    keys = None  # (ttl, max keys), read once the first keyed record shows up
+
+    stats = {"inserted": 0, "replaced": 0, "skipped": 0}
+    table = Job.__table__
+    it = iter(records)
+    last_ts = None
+
+    while True:
+        chunk = list(islice(it, batch_size))
+        if not chunk:
+            break
+
+        try:
+            rows, last_ts = chunk_rows(chunk, on_conflict, stats, last_ts)
+        except ValueError:
+            session.rollback()
+            raise
+        # the record behind each row: the first of an id under skip, else the last
+        kept = {}
+        for rec in chunk:
+            if on_conflict != "skip" or str(rec["id"]) not in kept:
+                kept[str(rec["id"])] = rec
+        existing = set(session.scalars(select(Job.id).where(Job.id.in_(list(rows)))))
+        if existing:
+            if on_conflict == "fail":
+                session.rollback()
+                dup = ", ".join(sorted(existing)[:5])
+                raise ValueError(f"Job(s) already exist: {dup}")
+            if on_conflict == "skip":
+                for job_id in existing:
+                    del rows[job_id]
+                stats["skipped"] += len(existing)
+
+        # keys are claimed only for the rows that will be inserted
+        keyed = _record_keys(kept.values(), rows)
+        if keyed:
+            keys = keys or key_settings()
+            stats["skipped"] += _dedupe_rows(session, rows, keyed, *keys)
+
+        if on_conflict == "replace":
+            existing &= set(rows)
+            if existing:
+                session.execute(delete(table).where(table.c.id.in_(list(existing))))
+                session.execute(
+                    delete(JobDep).where(JobDep.child_id.in_(list(existing)))
+                )
+                stats["replaced"] += len(existing)
+
+        if rows:
+            session.execute(table.insert(), list(rows.values()))
+        try:
+            for job_id in rows:
+                parents = parse_after(kept[job_id].get("after"))
+                if parents:
+                    add_dependencies(session, job_id, parents)
+        except ValueError:
+            session.rollback()
+            raise
+        if keyed:
+            prune_keys(session, datetime.utcnow(), keys[1])
+        session.commit()
+        stats["inserted"] += len(rows) - (len(existing) if on_conflict == "replace" else 0)
+        if rows:
+            wake_workers()
+
+    return stats
+
+
+_TRUE = ("1", "true", "yes", "on")
+
+
+def _record_keys(records, rows):
+    """{job id: idempotency key} for the records' rows that carry one."""
+    keyed = {}
+    for rec in records:
+        job_id = str(rec["id"])
+        row = rows.get(job_id)
+        if row is None:
+            continue
+        key = rec.get("idempotency_key")
+        if key in (None, "") and str(rec.get("dedupe", "")).lower() in _TRUE:
+            key = content_key(row["kind"], row["command"], row["args"])
+        if key not in (None, ""):
+            keyed[job_id] = str(key)
+    return keyed
+
+
+def _dedupe_rows(session, rows, keyed, ttl, max_keys):
+    """
+    Drop the rows whose key another job already holds (or an earlier row of
+    the chunk claimed) and claim the rest, uncommitted. Returns the number
+    dropped.
+    """
+    for _ in range(3):
+        now = datetime.utcnow()
+        held = lookup_keys(session, set(keyed.values()), now)
+        drop, claims = [], {}
+        for job_id, key in keyed.items():
+            holder = held.get(key)
+            if key in claims or (holder is not None and holder["state"] is not None):
+                drop.append(job_id)
+            else:
+                claims[key] = (job_id, holder)
+        used = {keyed[job_id] for job_id in drop} - set(claims)
+        if used:
+            touch_keys(session, used, now)
+        if claim_keys(session, claims, now, ttl):
+            for job_id in drop:
+                del rows[job_id]
+            return len(drop)
+        session.rollback()  # another enqueue took a key; look again
+    raise ValueError("Idempotency keys are contended; try again")
 
 
 def delete_job(job_id, session):
@@ -37,8 +641,13 @@ def delete_job(job_id, session):
     j = session.query(Job).filter_by(id=job_id).first()
     if not j:
         return False
+    policy = dependency_failure_policy()
     session.delete(j)
+    session.execute(delete(JobDep).where(JobDep.child_id == job_id))
+    # its dependents can no longer run
+    fail_dependents(session, [job_id], policy)
     session.commit()
+    remove_logs([job_id])
     return True
 
 
@@ -49,33 +658,189 @@ def list_jobs(session, state=None):
     return q.order_by(Job.created_at.asc()).all()
 
 
+# Columns `list` can project. command/last_error can be large, so they are
+# only loaded when asked for.
+JOB_FIELDS = (
+    "id",
+    "status",
+    "attempts",
+    "max_retries",
+    "queue",
+    "priority",
+    "next_run_at",
+    "created_at",
+    "updated_at",
+    "kind",
+    "command",
+    "args",
+    "last_error",
+)
+DEFAULT_JOB_FIELDS = ("id", "status", "attempts", "next_run_at", "created_at")
+DEAD_JOB_FIELDS = (
+    "id",
+    "failed_at",
+    "queue",
+    "priority",
+    "kind",
+    "command",
+    "args",
+    "last_error",
+)
+DEFAULT_DEAD_JOB_FIELDS = ("id", "failed_at")
+ATTEMPT_FIELDS = ("attempt", "worker", "started_at", "finished_at", "exit_code")
+
+
+def _columns(model, fields, allowed):
+    unknown = [f for f in fields if f not in allowed]
+    if unknown:
+        raise ValueError(f"Unknown field(s): {', '.join(unknown)}")
+    return [getattr(model, f) for f in fields]
+
+
+def iter_jobs(
+    session,
+    state=None,
+    after=None,
+    limit=None,
+    fields=DEFAULT_JOB_FIELDS,
+    chunk_size=1000,
+):
+    """
+    Stream jobs in (created_at, id) order as rows holding only `fields`.
+    `after` is a keyset cursor (a job id): the listing resumes right after
+    that job without OFFSET scans. Rows are fetched `chunk_size` at a time.
+    """
+    q = select(*_columns(Job, fields, JOB_FIELDS)).order_by(
+        Job.created_at.asc(), Job.id.asc()
+    )
+    if state:
+        q = q.where(Job.status == state)
+    if after is not None:
+        anchor = session.query(Job.created_at).filter_by(id=after).scalar()
+        if anchor is None:
+            raise ValueError(f"Unknown cursor job '{after}'")
+        q = q.where(tuple_(Job.created_at, Job.id) > tuple_(anchor, after))
+    if limit:
+        q = q.limit(limit)
+    yield from session.execute(q.execution_options(yield_per=chunk_size))
+
+
+def iter_dead_jobs(
+    session, after=None, limit=None, fields=DEFAULT_DEAD_JOB_FIELDS, chunk_size=1000
+):
+    """
+    Stream DLQ entries newest first, with the same keyset cursor semantics
+    as iter_jobs.
+    """
+    q = select(*_columns(DeadJob, fields, DEAD_JOB_FIELDS)).order_by(
+        DeadJob.failed_at.desc(), DeadJob.id.desc()
+    )
+    if after is not None:
+        anchor = session.query(DeadJob.failed_at).filter_by(id=after).scalar()
+        if anchor is None:
+            raise ValueError(f"Unknown cursor job '{after}'")
+        q = q.where(tuple_(DeadJob.failed_at, DeadJob.id) < tuple_(anchor, after))
+    if limit:
+        q = q.limit(limit)
+    yield from session.execute(q.execution_options(yield_per=chunk_size))
+
+
+def iter_attempts(session, job_id):
+    """A job's recorded attempts, oldest first."""
+    q = (
+        select(*_columns(JobAttempt, ATTEMPT_FIELDS, ATTEMPT_FIELDS))
+        .where(JobAttempt.job_id == job_id)
+        .order_by(JobAttempt.attempt, JobAttempt.seq)
+    )
+    yield from session.execute(q)
+
+
 def summarize_jobs(session):
-    return {
-        "total": session.query(Job).count(),
-        "pending": session.query(Job).filter(Job.status == "pending").count(),
-        "processing": session.query(Job).filter(Job.status == "processing").count(),
-        "completed": session.query(Job).filter(Job.status == "completed").count(),
-        "failed": session.query(Job).filter(Job.status == "failed").count(),
-    }
+    """
+    Job counts per status plus DLQ size, read from the trigger-maintained
+    job_counts table: cost does not grow with the number of jobs.
+    """
+    counts = dict(session.query(JobCount.name, JobCount.count).all())
+    session.commit()
+    dead = counts.pop("dead", 0)
+    summary = {"total": sum(counts.values())}
+    for state in ("pending", "processing", "completed", "failed"):
+        summary[state] = counts.pop(state, 0)
+    for state, n in sorted(counts.items()):
+        if n:
+            summary[state] = n
+    summary["dead"] = dead
+    return summary
+
+
+def summarize_queues(session, states=("pending", "waiting", "processing")):
+    """
+    Backlog per queue: {queue: {state: n}} for the given states, read from
+    the trigger-maintained queue_counts table. Queues with none are left out.
+    """
+    rows = session.execute(
+        select(QueueCount.queue, QueueCount.status, QueueCount.count)
+        .where(QueueCount.status.in_(states), QueueCount.count > 0)
+        .order_by(QueueCount.queue)
+    ).all()
+    session.commit()
+    backlog = {}
+    for queue, state, n in rows:
+        backlog.setdefault(queue, {})[state] = n
+    return backlog
+
+
+def recount_jobs(session):
+    """
+    Repair job_counts and queue_counts from a full recount (e.g. after
+    manual DB edits).
+    """
+    recount(session.connection())
+    recount_queues(session.connection())
+    session.commit()
+    return summarize_jobs(session)
 
 
 def list_dead_jobs(session):
     return session.query(DeadJob).order_by(DeadJob.failed_at.desc()).all()
 
-def move_to_dead(job, session):
+@traced("queue.move_to_dead")
+def move_to_dead(job, session, error=None, owner=None):
     """
     Move a failed job (exhausted retries) into DeadJob and remove from Job.
+    With `owner`, only while that worker still holds the job's lease;
+    returns False if the lease was lost (the job belongs to someone else now).
     """
+    policy = dependency_failure_policy()
+    if owner is not None:
+        gone = session.execute(
+            delete(Job)
+            .where(_leased_by(job.id, owner))
+            .execution_options(synchronize_session="fetch")
+        ).rowcount
+        if not gone:
+            session.rollback()
+            return False
+    else:
+        session.delete(job)
+    # a job re-enqueued after an earlier death replaces that DLQ entry
+    session.execute(delete(DeadJob).where(DeadJob.id == job.id))
     session.add(
         DeadJob(
             id=job.id,
             command=job.command,
-            last_error=job.last_error,
+            kind=job.kind,
+            args=job.args,
+            queue=job.queue,
+            priority=job.priority,
+            last_error=error if error is not None else job.last_error,
             failed_at=datetime.utcnow(),
         )
     )
-    session.delete(job)
+    fail_dependents(session, [job.id], policy)
     session.commit()
+    return True
+
 
 def retry_dead_job(job_id, session):
     dj = session.query(DeadJob).filter_by(id=job_id).first()
@@ -85,6 +850,10 @@ def retry_dead_job(job_id, session):
         Job(
             id=dj.id,
             command=dj.command,
+            kind=dj.kind or "shell",
+            args=dj.args,
+            queue=dj.queue or DEFAULT_QUEUE,
+            priority=dj.priority or 0,
             status="pending",
             attempts=0,
             last_error=None,
@@ -94,37 +863,348 @@ def retry_dead_job(job_id, session):
     )
     session.delete(dj)
     session.commit()
+    wake_workers()
     return True
 
 
-def claim_next_job(session):
+# How long a claim holds without renewal. Running workers renew well before
+# expiry; a job whose worker died is reclaimed once its lease lapses.
+DEFAULT_LEASE_SECONDS = 60
+LEASE_EXPIRED_ERROR = "lease expired: worker lost while running the job"
+
+
+def worker_identity():
+    """Lease owner name for this process ("host:pid")."""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _leased_by(job_id, owner):
+    where = [Job.id == job_id, Job.status == "processing"]
+    if owner is not None:
+        where.append(Job.lease_owner == owner)
+    return and_(*where)
+
+
+def _runnable_filter(now):
+    return and_(
+        Job.status == "pending",
+        or_(Job.next_run_at == None, Job.next_run_at <= now),
+    )
+
+
+@traced("queue.claim_jobs")
+def claim_jobs(
+    session,
+    limit=1,
+    owner=None,
+    lease_seconds=DEFAULT_LEASE_SECONDS,
+    queues=None,
+):
     """
-    Atomically claim the next runnable job.
+    Atomically claim up to `limit` runnable jobs, highest priority first,
+    then oldest first.
     Runnable: status='pending' AND (next_run_at is null OR next_run_at <= now)
+    Each claimed job is leased to `owner` for `lease_seconds`.
+    `queues` ({queue: quota}, e.g. from FairQueues.plan) limits the claim
+    to those queues, taking up to each quota from each; slots a queue cannot
+    fill go to the others, in order. Each queue is one index range scan.
+    Uses a single UPDATE ... RETURNING per queue where the dialect supports
+    it (SQLite 3.35+), otherwise falls back to claiming one row at a time.
+    Returns the claimed jobs, highest priority and oldest first.
     """
+    if limit < 1:
+        return []
     now = datetime.utcnow()
-    candidate = (
+    lease = {
+        "status": "processing",
+        "updated_at": now,
+        "lease_owner": owner,
+        "lease_expires_at": now + timedelta(seconds=lease_seconds),
+    }
+    if not queues:
+        jobs = _claim_from(session, None, limit, lease, now)
+    else:
+        jobs, drained = [], set()
+        for queue, quota in queues.items():
+            quota = min(quota, limit - len(jobs))
+            if quota > 0:
+                got = _claim_from(session, queue, quota, lease, now)
+                jobs.extend(got)
+                if len(got) < quota:
+                    drained.add(queue)
+        for queue in queues:
+            if len(jobs) >= limit:
+                break
+            if queue not in drained:
+                jobs.extend(_claim_from(session, queue, limit - len(jobs), lease, now))
+    session.commit()
+    jobs.sort(key=lambda j: (-(j.priority or 0), j.created_at or now, j.id))
+    return jobs
+
+
+def _runnable_ids(queue, limit, now):
+    """The ids `_claim_from` takes: runnable jobs (of `queue`) in claim order."""
+    where = [_runnable_filter(now)]
+    if queue is not None:
+        where.append(Job.queue == queue)
+    return (
+        select(Job.id)
+        .where(*where)
+        .order_by(Job.priority.desc(), Job.created_at.asc())
+        .limit(limit)
+    )
+
+
+def _claim_update(runnable_ids, lease):
+    """One UPDATE ... RETURNING that leases the `runnable_ids` still pending."""
+    return (
+        update(Job)
+        .where(and_(Job.id.in_(runnable_ids.scalar_subquery()), Job.status == "pending"))
+        .values(**lease)
+        .returning(Job)
+        .execution_options(synchronize_session=False, populate_existing=True)
+    )
+
+
+def _claim_from(session, queue, limit, lease, now):
+    runnable_ids = _runnable_ids(queue, limit, now)
+
+    if session.get_bind().dialect.update_returning:
+        return list(session.scalars(_claim_update(runnable_ids, lease)))
+
+    jobs = []
+    for job_id in session.scalars(runnable_ids).all():
+        updated = (
+            session.query(Job)
+            .filter(and_(Job.id == job_id, Job.status == "pending"))
+            .update(lease, synchronize_session=False)
+        )
+        if updated == 1:
+            jobs.append(job_id)
+    if not jobs:
+        return []
+    return session.query(Job).filter(Job.id.in_(jobs)).populate_existing().all()
+
+
+@traced("queue.release_jobs")
+def release_jobs(jobs, session):
+    """
+    Hand claimed-but-unstarted jobs back to the queue (e.g. on shutdown).
+    """
+    ids = [j.id for j in jobs]
+    if not ids:
+        return 0
+    released = (
         session.query(Job)
-        .filter(
-            and_(
-                Job.status == "pending",
-                or_(Job.next_run_at == None, Job.next_run_at <= now),
-            )
+        .filter(and_(Job.id.in_(ids), Job.status == "processing"))
+        .update(
+            {Job.status: "pending", Job.lease_owner: None, Job.lease_expires_at: None},
+            synchronize_session=False,
         )
-        .order_by(Job.created_at.asc())
-        .first()
     )
+    session.commit()
+    if released:
+        wake_workers()
+    return released
 
-    if not candidate:
-        return None
 
-    updated = (
+def attempt_row(
+    job, worker, started_at, finished_at, exit_code, stdout=None, stderr=None
+):
+    row = {
+        "job_id": job.id,
+        "attempt": (job.attempts or 0) + 1,
+        "worker": worker,
+        "started_at": started_at,
+        "finished_at": finished_at,
+        "exit_code": exit_code,
+    }
+    # output tails ride along until split_results files them in job_results
+    if stdout or stderr:
+        row.update(stdout=stdout, stderr=stderr)
+    return row
+
+
+def record_attempt(
+    job, session, worker, started_at, finished_at, exit_code, stdout=None, stderr=None
+):
+    """
+    Stage one attempt row, plus its result row when it printed anything.
+    They are committed (or rolled back) together with the outcome by
+    complete_job, schedule_retry or move_to_dead.
+    """
+    row = attempt_row(job, worker, started_at, finished_at, exit_code, stdout, stderr)
+    codec, inline_bytes = result_settings()
+    (attempt,), results = split_results(
+        [row], session.get_bind().url.database, codec, inline_bytes
+    )
+    session.add(JobAttempt(**attempt))
+    session.add_all(JobResult(**result) for result in results)
+
+
+@traced("queue.complete_job")
+def complete_job(job, session, owner=None):
+    """
+    Mark a claimed job completed. With `owner`, only while that worker still
+    holds the lease; returns False if it was lost in the meantime.
+    """
+    done = session.execute(
+        update(Job)
+        .where(_leased_by(job.id, owner))
+        .values(
+            status="completed",
+            last_error=None,
+            next_run_at=None,
+            lease_owner=None,
+            lease_expires_at=None,
+        )
+        .execution_options(synchronize_session="fetch")
+    ).rowcount
+    if not done:
+        session.rollback()
+        return False
+    # in the same transaction, so a child never sees a half-finished parent
+    # and a duplicate enqueue never finds the job done but not its key
+    ready = resolve_dependents(session, [job.id])
+    complete_keys(session, [job.id], datetime.utcnow())
+    session.commit()
+    if ready:
+        wake_workers()
+    return True
+
+
+@traced("queue.schedule_retry")
+def schedule_retry(job, session, attempts, error, run_at, owner=None):
+    """
+    Put a failed claimed job back to pending until `run_at`. Same lease
+    rule as complete_job.
+    """
+    done = session.execute(
+        update(Job)
+        .where(_leased_by(job.id, owner))
+        .values(
+            status="pending",
+            attempts=attempts,
+            last_error=error,
+            next_run_at=run_at,
+            lease_owner=None,
+            lease_expires_at=None,
+        )
+        .execution_options(synchronize_session="fetch")
+    ).rowcount
+    if not done:
+        session.rollback()
+        return False
+    session.commit()
+    return True
+
+
+@traced("queue.renew_leases")
+def renew_leases(session, owner, lease_seconds=DEFAULT_LEASE_SECONDS):
+    """
+    Extend every lease `owner` holds in one statement. Returns the number of
+    jobs renewed.
+    """
+    expires = datetime.utcnow() + timedelta(seconds=lease_seconds)
+    renewed = (
         session.query(Job)
-        .filter(and_(Job.id == candidate.id, Job.status == "pending"))
-        .update({Job.status: "processing"}, synchronize_session=False)
+        .filter(and_(Job.status == "processing", Job.lease_owner == owner))
+        .update({Job.lease_expires_at: expires}, synchronize_session=False)
     )
     session.commit()
+    return renewed
+
 
-    if updated == 1:
-        return session.query(Job).filter_by(id=candidate.id).first()
-    return None
+@traced("queue.reap_expired_leases")
+def reap_expired_leases(session, default_max_retries=3):
+    """
+    Reclaim processing jobs whose lease lapsed (their worker died). Each
+    counts as a failed attempt: jobs with retries left go back to pending in
+    one set-based UPDATE over ix_jobs_lease, exhausted ones go to the DLQ.
+    Returns {"requeued": n, "dead": n}.
+    """
+    policy = dependency_failure_policy()
+    now = datetime.utcnow()
+    jobs = Job.__table__
+    attempts = func.coalesce(jobs.c.attempts, 0) + 1
+    expired = and_(jobs.c.status == "processing", jobs.c.lease_expires_at < now)
+    exhausted = and_(
+        expired,
+        attempts >= func.coalesce(jobs.c.max_retries, default_max_retries),
+    )
+
+    # a DLQ entry under the same id (an older failure) is replaced
+    buried_ids = _bury_where(session, exhausted, LEASE_EXPIRED_ERROR, now)
+    fail_dependents(session, buried_ids, policy)
+    requeued = session.execute(
+        update(jobs)
+        .where(expired)
+        .values(
+            status="pending",
+            attempts=attempts,
+            last_error=LEASE_EXPIRED_ERROR,
+            next_run_at=None,
+            lease_owner=None,
+            lease_expires_at=None,
+            updated_at=now,
+        )
+    ).rowcount
+    session.commit()
+    if requeued:
+        wake_workers()
+    return {"requeued": requeued, "dead": len(buried_ids)}
+
+
+def backlog(session):
+    """
+    Pending job count (from job_counts), how many of them are runnable now,
+    and how long the oldest runnable job has been waiting, in seconds. Jobs
+    not due yet (retry backoff, run_at) are counted off an index range, so
+    the cost follows the delayed jobs, not the whole backlog.
+    """
+    now = datetime.utcnow()
+    pending = session.scalar(select(JobCount.count).where(JobCount.name == "pending"))
+    delayed = session.scalar(
+        select(func.count())
+        .select_from(Job)
+        .where(Job.status == "pending", Job.next_run_at > now)
+    )
+    oldest = session.execute(
+        select(Job.created_at, Job.next_run_at)
+        .where(_runnable_filter(now))
+        .order_by(Job.created_at.asc())
+        .limit(1)
+    ).first()
+    wait = 0.0
+    if oldest is not None:
+        # a retry has only been waiting since it became due
+        since = oldest.next_run_at or oldest.created_at
+        wait = max((now - since.replace(tzinfo=None)).total_seconds(), 0.0)
+    pending = pending or 0
+    return {
+        "pending": pending,
+        "runnable": max(pending - delayed, 0),
+        "oldest_wait": wait,
+    }
+
+
+def next_run_due(session):
+    """
+    Earliest next_run_at among pending jobs that are not runnable yet,
+    or None. Lets idle workers sleep exactly until a retry becomes due.
+    """
+    now = datetime.utcnow()
+    return (
+        session.query(func.min(Job.next_run_at))
+        .filter(and_(Job.status == "pending", Job.next_run_at > now))
+        .scalar()
+    )
+
+
+def claim_next_job(session, owner=None, lease_seconds=DEFAULT_LEASE_SECONDS):
+    """
+    Atomically claim the next runnable job.
+    Runnable: status='pending' AND (next_run_at is null OR next_run_at <= now)
+    """
+    jobs = claim_jobs(session, limit=1, owner=owner, lease_seconds=lease_seconds)
+    return jobs[0] if jobs else None
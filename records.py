@@ -0,0 +1,86 @@
+# Readers and writers for job records (JSON Lines, JSON or CSV), streamed one
+# record at a time in both directions.
+import csv
+import json
+from datetime import datetime
+
+FORMATS = ("jsonl", "csv")
+OUTPUT_FORMATS = ("text", "json", "jsonl", "csv")
+
+
+def detect_format(name, default="jsonl"):
+    """
+    Guess the record format from a file name ('-' / stdin falls back to default).
+    """
+    name = (name or "").lower()
+    if name.endswith(".csv"):
+        return "csv"
+    if name.endswith(".jsonl") or name.endswith(".ndjson") or name.endswith(".json"):
+        return "jsonl"
+    return default
+
+
+def read_records(fp, fmt="jsonl"):
+    """
+    Yield dicts from an open text stream without loading the whole file.
+    Blank lines are ignored in JSONL input.
+    """
+    if fmt == "csv":
+        for row in csv.DictReader(fp):
+            yield row
+        return
+    if fmt != "jsonl":
+        raise ValueError(f"Unknown record format '{fmt}'")
+    for lineno, line in enumerate(fp, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            rec = json.loads(line)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"line {lineno}: invalid JSON ({e.msg})")
+        if not isinstance(rec, dict):
+            raise ValueError(f"line {lineno}: expected a JSON object")
+        yield rec
+
+
+def _plain(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def write_records(rows, fields, out, fmt="jsonl"):
+    """
+    Write rows (tuples ordered like `fields`) to a text stream as they
+    arrive; nothing is buffered beyond the current row. Returns the count.
+    """
+    n = 0
+    if fmt == "csv":
+        w = csv.writer(out)
+        w.writerow(fields)
+        for row in rows:
+            w.writerow(["" if v is None else _plain(v) for v in row])
+            n += 1
+        return n
+    if fmt == "json":
+        out.write("[")
+        for row in rows:
+            out.write(",\n" if n else "\n")
+            out.write(json.dumps({f: _plain(v) for f, v in zip(fields, row)}))
+            n += 1
+        out.write("\n]\n" if n else "]\n")
+        return n
+    if fmt == "jsonl":
+        for row in rows:
+            out.write(json.dumps({f: _plain(v) for f, v in zip(fields, row)}) + "\n")
+            n += 1
+        return n
+    if fmt == "text":
+        bare = ("id", "command", "status", "last_error")
+        for row in rows:
+            parts = [str(v) if f in bare else f"{f}={v}" for f, v in zip(fields, row)]
+            out.write(" | ".join(parts) + "\n")
+            n += 1
+        return n
+    raise ValueError(f"Unknown output format '{fmt}'")
@@ -0,0 +1,110 @@
+# Worker registry: each worker keeps one row in the workers table up to date
+# from its background heartbeat thread, so liveness is a single indexed query
+# instead of a directory scan, and the per-job path never writes heartbeats.
+import os
+import socket
+from datetime import datetime, timedelta
+
+from sqlalchemy import case, delete, func, literal, select, update
+
+from flam.db.models import Worker
+
+HEARTBEAT_INTERVAL = 5.0
+# a worker that missed this many heartbeats is reported as stale
+STALE_BEATS = 3
+
+WORKER_FIELDS = (
+    "id",
+    "state",
+    "pid",
+    "host",
+    "queue",
+    "started_at",
+    "last_seen",
+    "current_job",
+    "jobs_done",
+)
+
+
+def register_worker(session, worker_id, queue=None):
+    """Create (or take over, if the pid was reused) this worker's row."""
+    host, _, pid = worker_id.rpartition(":")
+    now = datetime.utcnow()
+    session.merge(
+        Worker(
+            id=worker_id,
+            pid=int(pid) if pid.isdigit() else os.getpid(),
+            host=host or socket.gethostname(),
+            queue=queue,
+            started_at=now,
+            last_seen=now,
+            current_job=None,
+            jobs_done=0,
+        )
+    )
+    session.commit()
+
+
+def beat(session, worker_id, current_job=None, jobs_done=0):
+    """Refresh last_seen and progress. Returns False if the row is gone."""
+    seen = session.execute(
+        update(Worker)
+        .where(Worker.id == worker_id)
+        .values(
+            last_seen=datetime.utcnow(),
+            current_job=current_job,
+            jobs_done=jobs_done,
+        )
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    session.commit()
+    return bool(seen)
+
+
+def unregister_worker(session, worker_id):
+    session.execute(delete(Worker).where(Worker.id == worker_id))
+    session.commit()
+
+
+def _state(now, stale_after, dead_after):
+    return case(
+        (Worker.last_seen >= now - stale_after, literal("live")),
+        (Worker.last_seen >= now - dead_after, literal("stale")),
+        else_=literal("dead"),
+    )
+
+
+def list_workers(session, stale_after, dead_after):
+    """
+    All registered workers, oldest first, from one query. Rows are ordered
+    like WORKER_FIELDS; state is "live", "stale" once heartbeats stop
+    arriving, or "dead" past `dead_after` (timedeltas, like `stale_after`).
+    """
+    now = datetime.utcnow()
+    state = _state(now, stale_after, dead_after).label("state")
+    cols = [state if f == "state" else Worker.__table__.c[f] for f in WORKER_FIELDS]
+    query = select(*cols).order_by(Worker.started_at, Worker.id)
+    return session.execute(query).all()
+
+
+def count_live_workers(session, stale_after):
+    since = datetime.utcnow() - stale_after
+    return session.scalar(
+        select(func.count()).select_from(Worker).where(Worker.last_seen >= since)
+    )
+
+
+def prune_workers(session, dead_after):
+    """Forget workers not seen for `dead_after`. Returns rows removed."""
+    cutoff = datetime.utcnow() - dead_after
+    pruned = session.execute(delete(Worker).where(Worker.last_seen < cutoff)).rowcount
+    session.commit()
+    return pruned
+
+
+def thresholds(heartbeat_interval, lease_seconds):
+    """(stale_after, dead_after) for a heartbeat interval and lease TTL."""
+    stale_after = timedelta(seconds=heartbeat_interval * STALE_BEATS)
+    # past the lease TTL its jobs are up for reaping, so call it dead
+    dead_after = max(timedelta(seconds=lease_seconds), stale_after)
+    return stale_after, dead_after
@@ -0,0 +1,188 @@
+# Job results: the stdout/stderr tails of every attempt, compressed, in
+# job_results next to the attempt's job_attempts row (exit code, timings).
+# zlib is always available; result_codec=zstd uses the optional `zstandard`
+# package. A compressed blob over result_inline_bytes is written to a
+# content-addressed file under results/ beside job.db, so the table stays
+# small and identical outputs are stored once.
+import hashlib
+import os
+import time
+import zlib
+
+from sqlalchemy import select
+from sqlalchemy.orm import undefer_group
+
+from flam.config import get_int, get_str
+from flam.db.models import JobAttempt, JobResult
+
+try:
+    import zstandard
+except ImportError:  # optional: zlib covers every install
+    zstandard = None
+
+DEFAULT_CODEC = "zlib"
+DEFAULT_INLINE_BYTES = 16 * 1024  # compressed
+RESULT_DIR = "results"
+STREAMS = ("stdout", "stderr")
+
+
+def result_settings():
+    """
+    (codec, inline bytes) from config result_codec and result_inline_bytes.
+    zstd falls back to zlib when zstandard is not installed.
+    """
+    codec = get_str("result_codec", DEFAULT_CODEC)
+    if codec != "zstd" or zstandard is None:
+        codec = "zlib"
+    return codec, get_int("result_inline_bytes", DEFAULT_INLINE_BYTES)
+
+
+def compress(codec, data):
+    if codec == "zstd":
+        return zstandard.ZstdCompressor().compress(data)
+    return zlib.compress(data)
+
+
+def decompress(codec, blob):
+    if codec == "zstd":
+        if zstandard is None:
+            raise ValueError("This result is zstd-compressed; install zstandard")
+        return zstandard.ZstdDecompressor().decompress(blob)
+    return zlib.decompress(blob)
+
+
+def result_dir(db_path):
+    return os.path.join(os.path.dirname(os.path.abspath(db_path)), RESULT_DIR)
+
+
+def _blob_path(directory, ref):
+    return os.path.join(directory, ref[:2], ref)
+
+
+def store_blob(directory, blob):
+    """Write `blob` under its sha256 (once) and return that digest."""
+    ref = hashlib.sha256(blob).hexdigest()
+    path = _blob_path(directory, ref)
+    try:
+        # fresh again, so gc does not take it for an orphan (see below)
+        os.utime(path)
+    except FileNotFoundError:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(blob)
+        os.replace(tmp, path)
+    return ref
+
+
+def split_results(attempts, db_path, codec=DEFAULT_CODEC, inline_bytes=None):
+    """
+    Split attempt rows that carry "stdout"/"stderr" tails into (job_attempts
+    rows, job_results rows), compressing the tails. Attempts that printed
+    nothing get no result row. The input rows are left as they are.
+    """
+    if inline_bytes is None:
+        inline_bytes = DEFAULT_INLINE_BYTES
+    plain, results = [], []
+    for row in attempts:
+        row = dict(row)
+        outputs = {name: row.pop(name, None) or "" for name in STREAMS}
+        plain.append(row)
+        if not any(outputs.values()):
+            continue
+        result = {
+            "job_id": row["job_id"],
+            "attempt": row["attempt"],
+            "finished_at": row.get("finished_at"),
+            "codec": codec,
+        }
+        for name, text in outputs.items():
+            data = text.encode("utf-8", "replace")
+            blob = compress(codec, data) if data else None
+            ref = None
+            if blob is not None and len(blob) > inline_bytes:
+                ref, blob = store_blob(result_dir(db_path), blob), None
+            result.update({name: blob, f"{name}_bytes": len(data), f"{name}_ref": ref})
+        results.append(result)
+    return plain, results
+
+
+def _read_stream(result, name, directory):
+    blob, ref = getattr(result, name), getattr(result, f"{name}_ref")
+    if ref is not None:
+        try:
+            with open(_blob_path(directory, ref), "rb") as f:
+                blob = f.read()
+        except FileNotFoundError:
+            return f"<output file {ref} is missing>"
+    if not blob:
+        return ""
+    return decompress(result.codec, blob).decode("utf-8", "replace")
+
+
+def read_result(session, job_id, attempt=None):
+    """
+    The latest attempt of `job_id` (or attempt number `attempt`): a dict
+    with the attempt's job_attempts fields and its decompressed "stdout" and
+    "stderr" tails, or None if there is no record of it.
+    """
+    tried = select(JobAttempt).where(JobAttempt.job_id == job_id)
+    if attempt is not None:
+        tried = tried.where(JobAttempt.attempt == attempt)
+    row = session.scalars(tried.order_by(JobAttempt.seq.desc()).limit(1)).first()
+    outputs = (
+        select(JobResult)
+        .options(undefer_group("output"))
+        .where(JobResult.job_id == job_id)
+    )
+    if row is not None:
+        outputs = outputs.where(JobResult.attempt == row.attempt)
+    elif attempt is not None:
+        outputs = outputs.where(JobResult.attempt == attempt)
+    result = session.scalars(outputs.order_by(JobResult.seq.desc()).limit(1)).first()
+    if row is None and result is None:
+        return None
+    found = {
+        "job_id": job_id,
+        "attempt": row.attempt if row is not None else result.attempt,
+        "worker": row.worker if row is not None else None,
+        "started_at": row.started_at if row is not None else None,
+        "finished_at": row.finished_at if row is not None else result.finished_at,
+        "exit_code": row.exit_code if row is not None else None,
+        "codec": None,
+    }
+    directory = result_dir(session.get_bind().url.database)
+    for name in STREAMS:
+        found[name] = "" if result is None else _read_stream(result, name, directory)
+    if result is not None:
+        found["codec"] = result.codec
+    return found
+
+
+def prune_result_files(session, min_age=3600.0):
+    """
+    Remove result files no job_results row points at, skipping any younger
+    than `min_age` seconds (a worker may not have committed its row yet).
+    Returns the number removed.
+    """
+    directory = result_dir(session.get_bind().url.database)
+    if not os.path.isdir(directory):
+        return 0
+    refs = set()
+    for name in STREAMS:
+        column = getattr(JobResult, f"{name}_ref")
+        refs.update(session.scalars(select(column).where(column.is_not(None))))
+    cutoff = time.time() - min_age
+    removed = 0
+    for root, _, files in os.walk(directory):
+        for name in files:
+            path = os.path.join(root, name)
+            if name in refs:
+                continue
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+                    removed += 1
+            except FileNotFoundError:
+                pass
+    return removed
@@ -0,0 +1,376 @@
+# Recurring jobs. A schedule is a cron expression (UTC) plus a job template in
+# the schedules table; `queuectl schedules run` keeps a min-heap of the next
+# fire times, sleeps until the earliest is due and then creates the due jobs
+# in one batched insert. Several schedulers may run at once: each schedule
+# advances with a compare-and-set on its revision in the same transaction as
+# its jobs, and job ids are derived from the fire time.
+import heapq
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, select, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from flam.broker import broker_state, connect
+from flam.db.models import Job, Schedule
+from flam.notify import wake_workers
+from flam.queue_manager import chunk_rows
+
+CATCH_UP_POLICIES = ("skip", "latest", "all")
+# under "all", missed fires materialized per schedule per pass; the rest follow
+CATCH_UP_LIMIT = 100
+# under "skip", a fire this late still counts as on time
+SKIP_GRACE = timedelta(seconds=60)
+DEFAULT_REFRESH = 30.0
+
+SCHEDULE_FIELDS = (
+    "id",
+    "cron",
+    "catch_up",
+    "next_fire_at",
+    "last_fire_at",
+    "kind",
+    "command",
+)
+
+_MACROS = {
+    "@yearly": "0 0 1 1 *",
+    "@annually": "0 0 1 1 *",
+    "@monthly": "0 0 1 * *",
+    "@weekly": "0 0 * * 0",
+    "@daily": "0 0 * * *",
+    "@midnight": "0 0 * * *",
+    "@hourly": "0 * * * *",
+}
+_MONTHS = "jan feb mar apr may jun jul aug sep oct nov dec".split()
+_DAYS = "sun mon tue wed thu fri sat".split()
+# name, lowest, highest, symbolic names (index + offset)
+_FIELDS = (
+    ("minute", 0, 59, None),
+    ("hour", 0, 23, None),
+    ("day of month", 1, 31, None),
+    ("month", 1, 12, (_MONTHS, 1)),
+    ("day of week", 0, 7, (_DAYS, 0)),  # 0 and 7 are Sunday
+)
+
+
+def _value(text, name, names):
+    if names is not None and text.lower() in names[0]:
+        return names[0].index(text.lower()) + names[1]
+    try:
+        return int(text)
+    except ValueError:
+        raise ValueError(f"Invalid {name} '{text}' in cron expression")
+
+
+def _parse_field(text, name, lo, hi, names):
+    values = set()
+    for part in text.split(","):
+        span, slash, step = part.partition("/")
+        try:
+            step = int(step) if slash else 1
+        except ValueError:
+            step = 0
+        if step < 1:
+            raise ValueError(f"Invalid step in cron {name} field '{part}'")
+        if span == "*":
+            first, last = lo, hi
+        elif "-" in span:
+            a, b = span.split("-", 1)
+            first, last = _value(a, name, names), _value(b, name, names)
+        else:
+            first = _value(span, name, names)
+            last = hi if slash else first
+        if not lo <= first <= last <= hi:
+            raise ValueError(f"Cron {name} field '{part}' is out of range {lo}-{hi}")
+        values.update(range(first, last + 1, step))
+    return frozenset(values)
+
+
+class Cron:
+    """
+    A standard five-field cron expression (minute hour day-of-month month
+    day-of-week) with lists, ranges, steps, month/day names and the @daily
+    style macros. When both day fields are restricted a day matching either
+    one fires, as in Vixie cron.
+    """
+
+    def __init__(self, expr):
+        self.expr = expr
+        fields = _MACROS.get(expr.strip().lower(), expr).split()
+        if len(fields) != 5:
+            raise ValueError(
+                f"Cron expression '{expr}' needs 5 fields "
+                "(minute hour day-of-month month day-of-week)"
+            )
+        parsed = [_parse_field(f, *spec) for f, spec in zip(fields, _FIELDS)]
+        self.minutes, self.hours, self.days, self.months, weekdays = parsed
+        self.weekdays = frozenset(d % 7 for d in weekdays)
+        self._any_day = fields[2].startswith("*")
+        self._any_weekday = fields[4].startswith("*")
+
+    def _day_matches(self, t):
+        day = t.day in self.days
+        weekday = (t.weekday() + 1) % 7 in self.weekdays
+        if self._any_day or self._any_weekday:
+            return day and weekday
+        return day or weekday
+
+    def next_after(self, t):
+        """The first fire time strictly after `t` (naive UTC, whole minutes)."""
+        t = t.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = t.year + 5
+        while t.year <= limit:
+            if t.month not in self.months:
+                t = datetime(t.year + t.month // 12, t.month % 12 + 1, 1)
+            elif not self._day_matches(t):
+                t = datetime(t.year, t.month, t.day) + timedelta(days=1)
+            elif t.hour not in self.hours:
+                t = t.replace(minute=0) + timedelta(hours=1)
+            elif t.minute not in self.minutes:
+                t += timedelta(minutes=1)
+            else:
+                return t
+        raise ValueError(f"Cron expression '{self.expr}' never fires")
+
+
+def due_fires(cron, next_fire_at, now, catch_up):
+    """
+    The fire times to materialize at `now` for a schedule whose next fire
+    is `next_fire_at`, plus its following next fire. Missed fires: "all"
+    runs each of them (at most CATCH_UP_LIMIT per pass), "latest" only the
+    most recent, "skip" none unless it is within SKIP_GRACE of now.
+    """
+    fires = []
+    t = next_fire_at
+    while t <= now:
+        if catch_up == "all":
+            if len(fires) >= CATCH_UP_LIMIT:
+                break
+            fires.append(t)
+        else:
+            fires = [t]
+        t = cron.next_after(t)
+    if catch_up == "skip":
+        fires = [f for f in fires if now - f <= SKIP_GRACE]
+    return fires, t
+
+
+def fire_job_id(schedule_id, fire):
+    return f"{schedule_id}@{fire:%Y%m%d%H%M}"
+
+
+def add_schedule(
+    session,
+    schedule_id,
+    cron,
+    command,
+    kind="shell",
+    args=None,
+    max_retries=None,
+    catch_up="latest",
+    replace=False,
+):
+    """
+    Create (or with replace=True, redefine) a schedule. Its first fire is
+    the next cron time after now. Raises ValueError for a bad definition.
+    """
+    if catch_up not in CATCH_UP_POLICIES:
+        raise ValueError(f"catch_up must be one of {CATCH_UP_POLICIES}")
+    next_fire_at = Cron(cron).next_after(datetime.utcnow())
+    # validate the job template exactly as enqueue would
+    record = {"id": schedule_id, "command": command, "kind": kind, "args": args}
+    stats = {"inserted": 0, "replaced": 0, "skipped": 0}
+    row = chunk_rows([record], "fail", stats)[0][schedule_id]
+    existing = session.get(Schedule, schedule_id)
+    if existing is not None:
+        if not replace:
+            raise ValueError(f"Schedule '{schedule_id}' already exists.")
+        session.delete(existing)
+        session.flush()
+    schedule = Schedule(
+        id=schedule_id,
+        cron=cron,
+        command=row["command"],
+        kind=row["kind"],
+        args=row["args"],
+        max_retries=max_retries,
+        catch_up=catch_up,
+        next_fire_at=next_fire_at,
+    )
+    session.add(schedule)
+    session.commit()
+    return schedule
+
+
+def remove_schedule(session, schedule_id):
+    removed = session.execute(
+        delete(Schedule).where(Schedule.id == schedule_id)
+    ).rowcount
+    session.commit()
+    return bool(removed)
+
+
+def iter_schedules(session):
+    q = select(*[Schedule.__table__.c[f] for f in SCHEDULE_FIELDS]).order_by(
+        Schedule.next_fire_at
+    )
+    yield from session.execute(q)
+
+
+def materialize_due(session, now=None, client=None, limit=500):
+    """
+    Create the jobs of every schedule due at `now` (up to `limit`
+    schedules) and advance those schedules, all in one transaction. With a
+    broker `client` the jobs are enqueued through it instead of the jobs
+    table. Returns (jobs created, {schedule id: new next_fire_at}) for the
+    schedules this call advanced; a schedule another scheduler advanced
+    first is left out.
+    """
+    now = now or datetime.utcnow()
+    due = session.execute(
+        select(Schedule)
+        .where(Schedule.next_fire_at <= now)
+        .order_by(Schedule.next_fire_at)
+        .limit(limit)
+        .execution_options(populate_existing=True)
+    ).scalars()
+    records = []
+    advanced = {}
+    for schedule in due.all():
+        try:
+            fires, following = due_fires(
+                Cron(schedule.cron), schedule.next_fire_at, now, schedule.catch_up
+            )
+        except ValueError as e:
+            print(f"[scheduler] schedule '{schedule.id}' skipped: {e}")
+            continue
+        won = session.execute(
+            update(Schedule)
+            .where(Schedule.id == schedule.id, Schedule.revision == schedule.revision)
+            .values(
+                next_fire_at=following,
+                last_fire_at=fires[-1] if fires else schedule.last_fire_at,
+                revision=schedule.revision + 1,
+            )
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        if not won:
+            continue
+        advanced[schedule.id] = following
+        records += [
+            {
+                "id": fire_job_id(schedule.id, fire),
+                "command": schedule.command,
+                "kind": schedule.kind,
+                "args": schedule.args,
+                "max_retries": schedule.max_retries,
+                "run_at": fire,
+            }
+            for fire in fires
+        ]
+    created = 0
+    try:
+        if records and client is not None:
+            created = client.enqueue_many(records, on_conflict="skip")["inserted"]
+        elif records:
+            stats = {"inserted": 0, "replaced": 0, "skipped": 0}
+            rows, _ = chunk_rows(records, "skip", stats)
+            stmt = sqlite_insert(Job.__table__).on_conflict_do_nothing(
+                index_elements=["id"]
+            )
+            created = session.execute(stmt, list(rows.values())).rowcount
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    if created and client is None:
+        wake_workers()
+    return created, advanced
+
+
+def _broker_client():
+    # A crashed broker reloads pending rows from the table when it restarts,
+    # so only a running one needs the jobs sent to it.
+    return connect() if broker_state() == "up" else None
+
+
+class Scheduler:
+    """
+    A min-heap of (next_fire_at, schedule id). `run` sleeps until the
+    earliest entry is due, materializes everything due in one batch and
+    pushes the advanced schedules back. The heap is rebuilt from the table
+    every `refresh` seconds, which picks up schedules added or removed
+    elsewhere.
+    """
+
+    def __init__(self, session, refresh=DEFAULT_REFRESH, client_factory=_broker_client):
+        self.session = session
+        self.refresh = refresh
+        self.client_factory = client_factory  # -> broker client or None
+        self._heap = []
+
+    def reload(self):
+        rows = self.session.execute(select(Schedule.next_fire_at, Schedule.id)).all()
+        self.session.rollback()  # end the read; see other schedulers' writes
+        self._heap = [tuple(row) for row in rows]
+        heapq.heapify(self._heap)
+
+    def next_due(self):
+        return self._heap[0][0] if self._heap else None
+
+    def run_due(self, now=None):
+        """Materialize whatever is due; returns the number of jobs created."""
+        now = now or datetime.utcnow()
+        popped = set()
+        while self._heap and self._heap[0][0] <= now:
+            popped.add(heapq.heappop(self._heap)[1])
+        if not popped:
+            return 0
+        client = self.client_factory() if self.client_factory else None
+        try:
+            created, advanced = materialize_due(self.session, now, client)
+        except Exception:
+            # back on the heap; tried again next pass
+            for schedule_id in popped:
+                heapq.heappush(self._heap, (now, schedule_id))
+            raise
+        finally:
+            if client is not None:
+                client.close()
+        for schedule_id, next_fire_at in advanced.items():
+            heapq.heappush(self._heap, (next_fire_at, schedule_id))
+        lost = popped - set(advanced)
+        if lost:
+            # advanced (or removed) by someone else meanwhile
+            q = select(Schedule.next_fire_at, Schedule.id).where(
+                Schedule.id.in_(list(lost))
+            )
+            for row in self.session.execute(q).all():
+                heapq.heappush(self._heap, tuple(row))
+            self.session.rollback()
+        return created
+
+    def run(self, stop):
+        """Run until the `stop` event is set."""
+        self.reload()
+        next_reload = time.monotonic() + self.refresh
+        while not stop.is_set():
+            try:
+                created = self.run_due()
+                if created:
+                    print(f"[scheduler] created {created} job(s)")
+                if time.monotonic() >= next_reload:
+                    next_reload = time.monotonic() + self.refresh
+                    self.reload()
+            except Exception as e:
+                # a busy database must not take the scheduler down
+                self.session.rollback()
+                print(f"[scheduler] pass failed: {e!r}")
+                stop.wait(1.0)
+                continue
+            wait = max(next_reload - time.monotonic(), 0.0)
+            due = self.next_due()
+            if due is not None:
+                wait = min(wait, (due - datetime.utcnow()).total_seconds())
+            stop.wait(max(wait, 0.01))
@@ -0,0 +1,48 @@
+import os
+import tempfile
+
+import pytest
+
+# Point the module-level engine (used by config helpers) at a throwaway
+# database before anything from flam is imported.
+_TMP_DIR = tempfile.mkdtemp(prefix="queuectl-test-")
+os.environ["QUEUECTL_DB"] = os.path.join(_TMP_DIR, "job.db")
+
+
+@pytest.fixture(scope="session", autouse=True)
+def _default_db():
+    from flam.db.base import engine
+    from flam.db.migrations import init_db
+
+    init_db(engine)
+    yield
+    engine.dispose()
+
+
+@pytest.fixture()
+def session(tmp_path, monkeypatch):
+    """
+    A session on the shared test database. Every table is emptied again
+    afterwards, along with the worker's process-wide state.
+    """
+    from flam import worker
+    from flam.config import _cache
+    from flam.db.base import Base, get_session
+    from flam.results import prune_result_files
+
+    # anything still written relative to the cwd lands in the test's tmp dir
+    monkeypatch.chdir(tmp_path)
+    s = get_session()
+    yield s
+    s.rollback()
+    for table in reversed(Base.metadata.sorted_tables):
+        s.execute(table.delete())
+    s.commit()
+    prune_result_files(s, min_age=0)
+    s.close()
+    _cache.invalidate()
+    worker._broker = None
+    worker._shutdown.clear()
+    if worker._pool is not None:
+        worker._pool.close()
+        worker._pool = None
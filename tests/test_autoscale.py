@@ -0,0 +1,94 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from flam.autoscale import Autoscaler
+from flam.queue_manager import backlog, enqueue
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def _simulate(scaler, clock, workers, pending, arrivals, seconds, rate=1.0):
+    """
+    Fluid model of the pool: `arrivals` jobs/s come in, each worker finishes
+    `rate` jobs/s, and the autoscaler is consulted every 2s like the
+    supervisor does. Returns the pool size after each decision.
+    """
+    sizes = []
+    for _ in range(0, seconds, 2):
+        clock.now += 2
+        pending = max(pending + 2 * (arrivals - rate * workers), 0)
+        workers, reason = scaler.decide(workers, pending)
+        sizes.append(workers)
+    return workers, pending, sizes
+
+
+def test_pool_converges_under_simulated_load():
+    print("\n[TEST] Bursty load: the pool grows to match, then shrinks to min")
+    clock = _Clock()
+    scaler = Autoscaler(
+        min_workers=1,
+        max_workers=10,
+        per_worker=10,
+        up_cooldown=4,
+        down_cooldown=20,
+        clock=clock,
+    )
+    # burst: 6 jobs/s against workers that each do 1 job/s
+    workers, pending, sizes = _simulate(scaler, clock, 1, 0, arrivals=6, seconds=600)
+    print("[DEBUG] burst sizes:", sizes[:20], "...", sizes[-5:])
+    assert max(sizes) <= 10
+    # settled: enough workers to keep up, and no flapping at the end
+    assert all(n in (6, 7) for n in sizes[-60:])
+    assert len(set(sizes[-30:])) == 1
+
+    # load stops: backlog drains and the pool steps back down to min
+    workers, pending, sizes = _simulate(
+        scaler, clock, workers, pending, arrivals=0, seconds=600
+    )
+    print("[DEBUG] idle sizes:", sizes[:20], "...", sizes[-5:])
+    assert pending == 0
+    assert workers == 1
+    # one worker retired per cooldown, never below min
+    assert all(a - b in (0, 1) for a, b in zip(sizes, sizes[1:]))
+    assert min(sizes) == 1
+
+
+def test_cooldowns_and_queue_wait():
+    print("\n[TEST] Cooldowns hold the pool; a long queue wait adds a worker")
+    clock = _Clock()
+    scaler = Autoscaler(1, 4, per_worker=10, target_wait=30, clock=clock)
+    assert scaler.decide(1, 25) == (3, "backlog")
+    clock.now += 5
+    assert scaler.decide(3, 100) == (3, "scale-up cooldown")
+    clock.now += 10
+    assert scaler.decide(3, 100) == (4, "backlog")  # capped at max
+    clock.now += 30
+    assert scaler.decide(4, 0) == (4, "scale-down cooldown")
+    clock.now += 60
+    assert scaler.decide(4, 0) == (3, "idle capacity")
+    clock.now += 60
+    # few jobs, but they have been waiting too long
+    assert scaler.decide(1, 2, oldest_wait=45) == (2, "queue wait")
+    with pytest.raises(ValueError):
+        Autoscaler(3, 2)
+
+
+def test_delayed_jobs_do_not_scale_up(session):
+    print("\n[TEST] Jobs that are not due yet need no workers")
+    later = datetime.utcnow() + timedelta(hours=1)
+    for i in range(50):
+        enqueue(f"later{i}", "exit 0", session, run_at=later)
+    load = backlog(session)
+    assert (load["pending"], load["runnable"], load["oldest_wait"]) == (50, 0, 0.0)
+    scaler = Autoscaler(1, 10, per_worker=10, clock=_Clock())
+    assert scaler.decide(1, load["runnable"], load["oldest_wait"]) == (1, "steady")
+
+    enqueue("now", "exit 0", session)
+    assert backlog(session)["runnable"] == 1
@@ -0,0 +1,37 @@
+from flam.benchmarks import compare, run_suite
+
+
+def test_quick_suite_reports_metrics():
+    print("\n[TEST] Benchmarks run on a temp DB and emit JSON-ready metrics")
+    report = run_suite(
+        only=["enqueue", "claim", "status"],
+        params={
+            "enqueue": {"rows": 200},
+            "claim": {"sizes": (100,), "claims": 20},
+            "status": {"rows": 500, "repeat": 3},
+        },
+    )
+    results = report["results"]
+    assert report["meta"]["benchmarks"] == ["enqueue", "claim", "status"]
+    assert results["enqueue.rows_per_sec"]["better"] == "higher"
+    assert results["claim.p50_ms@100"]["unit"] == "ms"
+    assert all(r["value"] > 0 for r in results.values())
+
+
+def test_compare_flags_regressions_by_direction():
+    print("\n[TEST] Rates regress when they drop, latencies when they grow")
+
+    def report(rate, latency):
+        return {
+            "results": {
+                "rate": {"value": rate, "unit": "rows/s", "better": "higher"},
+                "latency": {"value": latency, "unit": "ms", "better": "lower"},
+            }
+        }
+
+    rows = {r["name"]: r for r in compare(report(70, 1.1), report(100, 1.0), 0.2)}
+    assert rows["rate"]["regressed"] and rows["rate"]["change"] == -0.3
+    assert not rows["latency"]["regressed"]
+    rows = {r["name"]: r for r in compare(report(150, 2.0), report(100, 1.0), 0.2)}
+    assert not rows["rate"]["regressed"]
+    assert rows["latency"]["regressed"]
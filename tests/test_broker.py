@@ -0,0 +1,177 @@
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from flam import worker
+from flam.broker import (
+    BROKER_DIR,
+    BROKER_SOCKET,
+    Broker,
+    broker_state,
+    connect,
+    serve,
+)
+from flam.db.models import DeadJob, Job, JobDep
+from flam.queue_manager import (
+    chunk_rows,
+    enqueue,
+    iter_attempts,
+    retry_dead_job,
+    worker_identity,
+)
+
+
+def _rows(*ids, command="exit 0"):
+    records = [{"id": i, "command": command} for i in ids]
+    rows, _ = chunk_rows(records, "fail", {"inserted": 0, "replaced": 0, "skipped": 0})
+    return list(rows.values())
+
+
+def _op(broker, op, **args):
+    return broker.dispatch(dict(args, op=op))
+
+
+def test_broker_claims_in_order_and_snapshots(session):
+    print("\n[TEST] Broker hands out jobs FIFO and writes them back to SQLite")
+    broker = Broker()
+    broker.start()
+    _op(broker, "enqueue", rows=_rows("a", "b", "c"), on_conflict="fail")
+    with pytest.raises(ValueError):
+        _op(broker, "enqueue", rows=_rows("a"), on_conflict="fail")
+
+    first = _op(broker, "claim", limit=1, owner="w", lease_seconds=30)["jobs"]
+    assert [j["id"] for j in first] == ["a"]
+    assert _op(broker, "ack", job_id="a", owner="w")["done"]
+    assert not _op(broker, "ack", job_id="a", owner="w")["done"]
+
+    second = _op(broker, "claim", limit=2, owner="w", lease_seconds=30)["jobs"]
+    assert [j["id"] for j in second] == ["b", "c"]
+    later = datetime.now(timezone.utc) + timedelta(hours=1)
+    _op(broker, "nack", job_id="b", owner="w", attempts=1, error="boom", run_at=later)
+    _op(broker, "bury", job_id="c", owner="w", error="fatal")
+    # b is not due yet
+    assert _op(broker, "claim", limit=1, owner="w", lease_seconds=30)["jobs"] == []
+
+    assert broker.snapshot() == 3
+    assert session.get(Job, "a").status == "completed"
+    b = session.get(Job, "b")
+    assert (b.status, b.attempts, b.last_error) == ("pending", 1, "boom")
+    assert session.get(Job, "c") is None
+    assert session.get(DeadJob, "c").last_error == "fatal"
+    assert "a" not in broker.jobs  # written, so no longer held in memory
+
+    broker.stop()
+    assert broker_state() == "down"
+
+
+def test_broker_replays_journal_after_crash(session):
+    print("\n[TEST] A crashed broker's journal is replayed on the next start")
+    broker = Broker()
+    broker.start()
+    _op(broker, "enqueue", rows=_rows("d", "e"), on_conflict="fail")
+    _op(broker, "claim", limit=1, owner="w", lease_seconds=30)
+    _op(broker, "ack", job_id="d", owner="w")
+    broker.journal.close()  # the process dies: no final snapshot
+    assert session.get(Job, "d") is None
+    assert broker_state() == "crashed"
+
+    recovered = Broker()
+    assert recovered.start() == 4
+    assert recovered.jobs["e"]["status"] == "pending"
+    recovered.stop()
+    session.expire_all()
+    assert session.get(Job, "d").status == "completed"
+    assert session.get(Job, "e").status == "pending"
+    assert os.listdir(BROKER_DIR) == []
+
+
+def test_broker_snapshot_releases_dependents(session):
+    print("\n[TEST] A parent completed in the broker readies its children")
+    enqueue("parent", "exit 0", session)
+    enqueue("child", "exit 0", session, after="parent")
+    broker = Broker()
+    broker.start()
+    assert "child" not in broker.jobs
+    _op(broker, "claim", limit=5, owner="w", lease_seconds=30)
+    _op(broker, "ack", job_id="parent", owner="w")
+    broker.snapshot()
+    claimed = _op(broker, "claim", limit=5, owner="w", lease_seconds=30)["jobs"]
+    assert [j["id"] for j in claimed] == ["child"]
+    broker.stop()
+
+
+def test_broker_replace_drops_old_dependency_edges(session):
+    print("\n[TEST] A job replaced through the broker no longer waits on parents")
+    enqueue("parent", "exit 0", session)
+    enqueue("child", "exit 0", session, after="parent")
+    broker = Broker()
+    broker.start()
+    _op(broker, "enqueue", rows=_rows("child", command="exit 3"), on_conflict="replace")
+    assert broker.jobs["child"]["unmet_deps"] == 0
+    broker.journal.close()  # the replace is only in the journal
+
+    recovered = Broker()
+    recovered.start()
+    recovered.stop()
+    session.expire_all()
+    child = session.get(Job, "child")
+    assert (child.status, child.command, child.unmet_deps) == ("pending", "exit 3", 0)
+    assert session.query(JobDep).filter_by(child_id="child").count() == 0
+
+
+def test_broker_bury_keeps_queue_and_priority(session):
+    print("\n[TEST] A job buried by the broker retries into its own queue")
+    records = [{"id": "q", "command": "exit 1", "queue": "mail", "priority": 5}]
+    rows, _ = chunk_rows(records, "fail", {"inserted": 0, "replaced": 0, "skipped": 0})
+    broker = Broker()
+    broker.start()
+    _op(broker, "enqueue", rows=list(rows.values()), on_conflict="fail")
+    _op(broker, "claim", limit=1, owner="w", lease_seconds=30)
+    _op(broker, "bury", job_id="q", owner="w", error="fatal")
+    broker.stop()
+    dead = session.get(DeadJob, "q")
+    assert (dead.queue, dead.priority) == ("mail", 5)
+    assert retry_dead_job("q", session)
+    job = session.get(Job, "q")
+    assert (job.queue, job.priority) == ("mail", 5)
+
+
+def test_worker_runs_jobs_through_broker(session):
+    print("\n[TEST] Workers claim and ack over the broker's socket")
+    broker = Broker()
+    broker.start()
+    t = threading.Thread(target=serve, args=(broker,), kwargs={"snapshot_interval": 60})
+    t.start()
+    try:
+        deadline = time.monotonic() + 10
+        client = connect()
+        while client is None and time.monotonic() < deadline:
+            time.sleep(0.05)
+            client = connect()
+        assert client is not None
+        stats = client.enqueue_many(
+            [{"id": "ok", "command": "exit 0"}, {"id": "bad", "command": "exit 3"}]
+        )
+        assert stats == {"inserted": 2, "replaced": 0, "skipped": 0}
+        again = client.enqueue_many([{"id": "ok", "command": "x"}], on_conflict="skip")
+        assert again["skipped"] == 1
+
+        worker._broker = client
+        owner = worker_identity()
+        for job in worker._claim(session, 2, owner, 30):
+            worker._run_job(job, session, 3.0)
+        counts = client.stats()["jobs"]
+        assert counts == {"completed": 1, "pending": 1}
+    finally:
+        broker.stopping.set()
+        t.join(10)
+    session.expire_all()
+    assert session.get(Job, "ok").status == "completed"
+    bad = session.get(Job, "bad")
+    assert (bad.status, bad.attempts) == ("pending", 1)
+    assert [a.exit_code for a in iter_attempts(session, "bad")] == [3]
+    assert broker_state() == "down"
+    assert not os.path.exists(BROKER_SOCKET)
@@ -0,0 +1,72 @@
+import os
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy.orm import sessionmaker
+
+from flam.compaction import archive_completed_jobs, purge_history, run_gc
+from flam.db.base import create_sqlite_engine
+from flam.db.migrations import init_db
+from flam.db.models import Job, JobHistory
+from flam.joblog import LOG_DIR, log_path
+from flam.queue_manager import enqueue_many, summarize_jobs
+from flam.timeutil import parse_duration
+
+
+@pytest.fixture()
+def session(tmp_path):
+    engine = create_sqlite_engine(f"sqlite:///{tmp_path / 'gc.db'}")
+    init_db(engine)
+    s = sessionmaker(bind=engine, expire_on_commit=False)()
+    yield s
+    s.close()
+    engine.dispose()
+
+
+def _age_completed(session, n, days):
+    ids = [f"done{i}" for i in range(n)]
+    enqueue_many(({"id": i, "command": "echo " + "x" * 500} for i in ids), session)
+    old = datetime.utcnow() - timedelta(days=days)
+    session.query(Job).filter(Job.id.in_(ids)).update(
+        {Job.status: "completed", Job.updated_at: old}, synchronize_session=False
+    )
+    session.commit()
+
+
+def test_archive_moves_only_old_completed_jobs(session):
+    print("\n[TEST] gc archives old completed jobs in batches")
+    _age_completed(session, 25, days=10)
+    enqueue_many([{"id": "fresh", "command": "echo"}], session)
+    os.makedirs(LOG_DIR, exist_ok=True)
+    for job_id in ("done0", "fresh"):
+        open(log_path(job_id), "w").close()
+    moved = archive_completed_jobs(session, timedelta(days=7), batch_size=10)
+    assert moved == 25
+    # archived jobs take their logs with them
+    assert not os.path.exists(log_path("done0"))
+    assert os.path.exists(log_path("fresh"))
+    os.remove(log_path("fresh"))
+    assert session.query(Job).count() == 1
+    assert session.query(JobHistory).count() == 25
+    assert summarize_jobs(session)["completed"] == 0
+
+
+def test_history_retention_and_bytes_reclaimed(session):
+    print("\n[TEST] Retention trims history and incremental vacuum shrinks the file")
+    _age_completed(session, 2000, days=30)
+    archive_completed_jobs(session, timedelta(days=7))
+    assert purge_history(session, max_rows=500, batch_size=300) == 1500
+    assert session.query(JobHistory).count() == 500
+    report = run_gc(session, timedelta(days=7), keep_history=timedelta(seconds=0))
+    print("[DEBUG] report:", report)
+    assert report["purged"] == 500
+    assert report["pages_freed"] > 0
+    assert report["reclaimed_bytes"] > 0
+
+
+def test_parse_duration():
+    assert parse_duration("7d") == timedelta(days=7)
+    assert parse_duration("1h30m") == timedelta(minutes=90)
+    assert parse_duration("45") == timedelta(seconds=45)
+    with pytest.raises(ValueError):
+        parse_duration("soon")
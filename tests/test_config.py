@@ -0,0 +1,79 @@
+import pytest
+
+from flam.config import (
+    ConfigCache,
+    config_snapshot,
+    get_bool,
+    get_config,
+    get_int,
+    set_config,
+)
+from flam.db.base import create_sqlite_engine
+from flam.db.migrations import init_db
+
+
+@pytest.fixture()
+def engine(tmp_path):
+    eng = create_sqlite_engine(f"sqlite:///{tmp_path / 'config.db'}")
+    init_db(eng)
+    yield eng
+    eng.dispose()
+
+
+def _write(engine, key, value):
+    with engine.begin() as conn:
+        conn.exec_driver_sql(
+            "INSERT INTO config (key, value) VALUES (?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+            (key, value),
+        )
+
+
+def test_cache_picks_up_writes_from_other_connections(engine):
+    print("\n[TEST] data_version change triggers a reload")
+    _write(engine, "max_retries", "3")
+    cache = ConfigCache(bind=engine, refresh_interval=0)
+    assert cache.get("max_retries") == "3"
+    _write(engine, "max_retries", "7")
+    assert cache.get("max_retries") == "7"
+    cache.close()
+
+
+def test_cache_serves_from_memory_within_interval(engine):
+    print("\n[TEST] No DB round-trip until the refresh interval elapses")
+    _write(engine, "backoff_base", "2")
+    cache = ConfigCache(bind=engine, refresh_interval=3600)
+    assert cache.get("backoff_base") == "2"
+    _write(engine, "backoff_base", "5")
+    assert cache.get("backoff_base") == "2"
+    cache.invalidate()
+    assert cache.get("backoff_base") == "5"
+    assert cache.snapshot() == {"backoff_base": "5"}
+    cache.close()
+
+
+def test_cache_read_survives_invalidate_during_refresh(engine):
+    print("\n[TEST] invalidate() racing a refresh never breaks a read")
+
+    class Racing(ConfigCache):
+        def _refresh(self, force=False):
+            values = super()._refresh(force)
+            self.invalidate()  # another thread gets in right after the reload
+            return values
+
+    _write(engine, "backoff_base", "2")
+    cache = Racing(bind=engine, refresh_interval=0)
+    assert cache.get("backoff_base") == "2"
+    cache.close()
+
+
+def test_typed_accessors_and_local_writes():
+    print("\n[TEST] set_config is visible immediately in this process")
+    set_config("poll_fast", "yes")
+    set_config("workers", "4")
+    set_config("workers_bad", "four")
+    assert get_bool("poll_fast", False) is True
+    assert get_int("workers", 1) == 4
+    assert get_int("workers_bad", 1) == 1
+    assert get_config("missing", "dflt") == "dflt"
+    assert config_snapshot()["workers"] == "4"
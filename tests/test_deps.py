@@ -0,0 +1,140 @@
+from datetime import datetime
+
+import pytest
+
+from flam.config import set_config
+from flam.db.models import DeadJob, Job, JobDep
+from flam.queue_manager import (
+    claim_jobs,
+    complete_job,
+    enqueue,
+    enqueue_many,
+    move_to_dead,
+    summarize_jobs,
+)
+
+
+def _claim_ids(session):
+    return sorted(j.id for j in claim_jobs(session, 10, owner="w"))
+
+
+def test_fan_in_waits_for_every_parent(session):
+    print("\n[TEST] A job becomes claimable once all its parents complete")
+    enqueue_many(
+        [
+            {"id": "a", "command": "exit 0"},
+            {"id": "b", "command": "exit 0"},
+            {"id": "c", "command": "exit 0", "after": ["a", "b"]},
+        ],
+        session,
+    )
+    enqueue("d", "exit 0", session, after="c")
+    c = session.get(Job, "c")
+    assert (c.status, c.unmet_deps) == ("waiting", 2)
+    assert summarize_jobs(session)["waiting"] == 2
+
+    claimed = claim_jobs(session, 10, owner="w")
+    assert sorted(j.id for j in claimed) == ["a", "b"]
+    complete_job(claimed[0], session, owner="w")
+    assert _claim_ids(session) == []
+    complete_job(claimed[1], session, owner="w")
+
+    session.expire_all()
+    assert session.get(Job, "c").unmet_deps == 0
+    assert _claim_ids(session) == ["c"]
+    assert session.get(Job, "d").status == "waiting"
+    assert session.query(JobDep).count() == 1
+
+    # a completed parent is already satisfied
+    enqueue("e", "exit 0", session, after="a")
+    assert session.get(Job, "e").status == "pending"
+
+
+@pytest.mark.parametrize("policy,state", [("dlq", None), ("cancel", "cancelled")])
+def test_failed_parent_propagates(session, policy, state):
+    print(f"\n[TEST] A dead parent fails its descendants ({policy})")
+    set_config("dependency_failure", policy)
+    enqueue("p", "exit 1", session)
+    enqueue("q", "exit 0", session)
+    enqueue("child", "exit 0", session, after="p,q")
+    enqueue("grandchild", "exit 0", session, after="child")
+    (p,) = [j for j in claim_jobs(session, 10, owner="w") if j.id == "p"]
+    move_to_dead(p, session, error="boom", owner="w")
+
+    session.expire_all()
+    for job_id in ("child", "grandchild"):
+        job = session.get(Job, job_id)
+        if state is None:
+            assert job is None
+            assert session.get(DeadJob, job_id).last_error.startswith("dependency")
+        else:
+            assert job.status == state
+    assert session.query(JobDep).count() == 0
+    # q is untouched
+    assert session.get(Job, "q").status == "processing"
+
+
+def test_failed_dependent_replaces_an_older_dlq_entry(session):
+    print("\n[TEST] A dependent moved to the DLQ replaces a stale entry")
+    set_config("dependency_failure", "dlq")
+    session.add(DeadJob(id="child", command="old", failed_at=datetime.utcnow()))
+    session.commit()
+    enqueue("p", "exit 1", session)
+    enqueue("child", "exit 0", session, after="p")
+    (p,) = claim_jobs(session, 10, owner="w")
+    move_to_dead(p, session, error="boom", owner="w")
+    session.expire_all()
+    assert session.get(Job, "child") is None
+    dead = session.get(DeadJob, "child")
+    assert (dead.command, dead.last_error) == ("exit 0", "dependency 'p' failed")
+
+
+def test_rejects_bad_dependencies(session):
+    print("\n[TEST] Unknown, failed, self and cyclic dependencies are refused")
+    enqueue("a", "exit 0", session)
+    enqueue("b", "exit 0", session, after="a")
+    session.add(DeadJob(id="gone", command="x", failed_at=datetime.utcnow()))
+    session.commit()
+    for job_id, after in [("x", "nope"), ("x", "gone"), ("x", "x")]:
+        with pytest.raises(ValueError):
+            enqueue(job_id, "exit 0", session, after=after)
+    assert session.get(Job, "x") is None
+    with pytest.raises(ValueError):
+        enqueue("a", "exit 0", session, replace=True, after="b")
+    assert session.get(Job, "a") is not None  # a failed replace keeps the job
+    with pytest.raises(ValueError):
+        # parents must come earlier in the file
+        enqueue_many(
+            [{"id": "y", "command": "x", "after": "z"}, {"id": "z", "command": "x"}],
+            session,
+            batch_size=1,
+        )
+    assert session.get(Job, "y") is None
+
+
+def test_in_chunk_duplicates_keep_the_winners_dependencies(session):
+    print("\n[TEST] Only the record kept for a repeated id adds its edges")
+    enqueue("p", "exit 0", session)
+    enqueue_many(
+        [
+            {"id": "c", "command": "exit 0", "after": "p"},
+            {"id": "c", "command": "exit 0", "after": "p"},
+            {"id": "d", "command": "exit 0", "after": "p"},
+            {"id": "d", "command": "exit 0"},
+        ],
+        session,
+        on_conflict="replace",
+    )
+    edges = session.query(JobDep.child_id, JobDep.parent_id).all()
+    assert sorted(edges) == [("c", "p")]
+    assert session.get(Job, "d").status == "pending"
+
+    enqueue_many(
+        [
+            {"id": "e", "command": "exit 0"},
+            {"id": "e", "command": "exit 0", "after": "p"},
+        ],
+        session,
+        on_conflict="skip",
+    )
+    assert session.query(JobDep).filter_by(child_id="e").count() == 0
@@ -0,0 +1,123 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy import select
+
+from flam.db.models import IdempotencyKey, Job
+from flam.idempotency import claim_keys, content_key, lookup_keys, prune_keys
+from flam.queue_manager import (
+    claim_jobs,
+    complete_job,
+    enqueue,
+    enqueue_many,
+    move_to_dead,
+)
+
+
+def _run(session, job_id, ok=True):
+    (job,) = [j for j in claim_jobs(session, 10, owner="w") if j.id == job_id]
+    if ok:
+        complete_job(job, session, owner="w")
+    else:
+        move_to_dead(job, session, error="boom", owner="w")
+
+
+def test_key_coalesces_then_serves_cached_result(session):
+    print("\n[TEST] A key coalesces while its job is live, then is cached")
+    first = enqueue("a", "echo hi", session, idempotency_key="k")
+    assert first == {"id": "a", "outcome": "enqueued"}
+    assert enqueue("b", "echo hi", session, idempotency_key="k") == {
+        "id": "a",
+        "outcome": "coalesced",
+    }
+    assert session.get(Job, "b") is None
+
+    _run(session, "a")
+    again = enqueue("c", "echo hi", session, idempotency_key="k")
+    assert (again["id"], again["outcome"]) == ("a", "cached")
+    assert again["completed_at"] is not None
+    assert session.get(Job, "c") is None
+
+    # --dedupe keys on the content, not the id
+    enqueue("d", "echo x", session, dedupe=True)
+    assert enqueue("e", "echo x", session, dedupe=True)["outcome"] == "coalesced"
+    assert enqueue("f", "echo y", session, dedupe=True)["outcome"] == "enqueued"
+    assert content_key("shell", "echo x") != content_key("python", "echo x")
+
+
+def test_failed_or_expired_key_is_taken_over(session):
+    print("\n[TEST] A key whose job died or whose TTL ran out can be reused")
+    enqueue("a", "exit 1", session, idempotency_key="k")
+    _run(session, "a", ok=False)
+    assert enqueue("b", "exit 0", session, idempotency_key="k")["outcome"] == (
+        "enqueued"
+    )
+    assert session.get(IdempotencyKey, "k").job_id == "b"
+
+    _run(session, "b")
+    expired = datetime.utcnow() - timedelta(seconds=1)
+    session.query(IdempotencyKey).update({"expires_at": expired})
+    session.commit()
+    enqueue("c", "exit 0", session, idempotency_key="k", key_ttl=timedelta(hours=1))
+    key = session.get(IdempotencyKey, "k")
+    assert (key.job_id, key.completed_at) == ("c", None)
+
+    # a stale holder changed since the lookup: the takeover loses
+    later = datetime.utcnow() + timedelta(hours=2)
+    holder = lookup_keys(session, ["k"], later)["k"]
+    holder["created_at"] -= timedelta(seconds=1)
+    assert not claim_keys(session, {"k": ("d", holder)}, later, 60)
+    session.rollback()
+
+
+def test_bulk_dedupe_counts_skipped(session):
+    print("\n[TEST] Bulk records with held or repeated keys are skipped")
+    enqueue("held", "x", session, idempotency_key="k1")
+    stats = enqueue_many(
+        [
+            {"id": "r1", "command": "x", "idempotency_key": "k1"},
+            {"id": "r2", "command": "y", "idempotency_key": "k2"},
+            {"id": "r3", "command": "z", "idempotency_key": "k2"},
+            {"id": "r4", "command": "same", "dedupe": True},
+            {"id": "r5", "command": "same", "dedupe": "true"},
+            {"id": "r6", "command": "plain"},
+        ],
+        session,
+    )
+    assert stats == {"inserted": 3, "replaced": 0, "skipped": 3}
+    assert sorted(session.scalars(select(Job.id))) == ["held", "r2", "r4", "r6"]
+    assert session.get(IdempotencyKey, "k2").job_id == "r2"
+
+
+def test_skipped_id_claims_no_key(session):
+    print("\n[TEST] A record skipped for its id does not claim its key")
+    enqueue("x", "echo old", session)
+    stats = enqueue_many(
+        [{"id": "x", "command": "echo new", "idempotency_key": "K"}],
+        session,
+        on_conflict="skip",
+    )
+    assert stats == {"inserted": 0, "replaced": 0, "skipped": 1}
+    assert session.get(IdempotencyKey, "K") is None
+    assert enqueue("y", "echo new", session, idempotency_key="K")["outcome"] == (
+        "enqueued"
+    )
+
+
+def test_prune_drops_expired_then_least_recently_used(session):
+    print("\n[TEST] Pruning drops expired keys, then LRU keys over the cap")
+    now = datetime.utcnow()
+    for i in range(5):
+        session.add(
+            IdempotencyKey(
+                key=f"k{i}",
+                job_id=f"j{i}",
+                created_at=now,
+                expires_at=now + timedelta(hours=1 if i else -1),
+                used_at=now + timedelta(seconds=i),
+            )
+        )
+    session.commit()
+    assert prune_keys(session, now) == 1
+    assert prune_keys(session, now, max_keys=2) == 2
+    session.commit()
+    assert sorted(session.scalars(select(IdempotencyKey.key))) == ["k3", "k4"]
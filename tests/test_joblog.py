@@ -0,0 +1,56 @@
+import gzip
+import os
+import sys
+
+from flam.executor import run_command
+from flam.joblog import JobLog, log_path, read_tail, remove_logs
+
+
+def test_run_command_streams_to_log_and_keeps_bounded_tail(tmp_path):
+    print("\n[TEST] Large stdout goes to the file, not into memory")
+    path = str(tmp_path / "big.log")
+    log = JobLog(path, max_bytes=0, tail_bytes=1024)
+    code, stdout, stderr = run_command(
+        f'"{sys.executable}" -c "import sys; sys.stdout.write(\'x\' * 2000000); '
+        f'sys.stderr.write(\'boom\')"',
+        log,
+    )
+    log.close()
+    assert code == 0
+    assert len(stdout) == 1024
+    assert stderr == "boom"
+    assert os.path.getsize(path) == 2000000 + len("boom")
+
+
+def test_joblog_rotates_and_compresses(tmp_path):
+    print("\n[TEST] Size cap rotates into gzip segments")
+    path = str(tmp_path / "rot.log")
+    log = JobLog(path, max_bytes=100, backups=2, compress=True)
+    for i in range(5):
+        log.write("stdout", (f"{i}" * 60 + "\n").encode())
+    log.close()
+    assert os.path.exists(path + ".1.gz")
+    assert os.path.exists(path + ".2.gz")
+    assert not os.path.exists(path + ".3.gz")
+    with gzip.open(path + ".1.gz") as f:
+        assert f.read().startswith(b"2")
+
+
+def test_read_tail_and_log_path(tmp_path):
+    print("\n[TEST] Tail reads only the end of the file")
+    path = tmp_path / "t.log"
+    path.write_bytes(b"".join(f"line {i}\n".encode() for i in range(10000)))
+    assert read_tail(str(path), 2, block_size=64) == b"line 9998\nline 9999\n"
+    assert log_path("a/b", "logs") != log_path("a_b", "logs")
+
+
+def test_remove_logs_takes_rotated_segments(tmp_path):
+    print("\n[TEST] A job's logs go with every rotated segment, and only those")
+    logs = str(tmp_path)
+    mine = log_path("a", logs)
+    other = log_path("a.log.1", logs)  # a job id that looks like a segment
+    for path in (mine, mine + ".1", mine + ".2.gz", other):
+        open(path, "w").close()
+    assert remove_logs(["a"], logs) == 3
+    assert os.listdir(logs) == [os.path.basename(other)]
+    assert remove_logs(["missing"], str(tmp_path / "none")) == 0
@@ -0,0 +1,68 @@
+import os
+import time
+
+from flam.metrics import (
+    EXITED_FILE,
+    Histogram,
+    Metrics,
+    collect,
+    fold_exited,
+    metrics_path,
+    render_prometheus,
+)
+
+
+def test_histogram_buckets_and_prometheus_text():
+    print("\n[TEST] Histograms render as cumulative Prometheus buckets")
+    h = Histogram(buckets=(0.1, 1.0))
+    for v in (0.05, 0.5, 0.7, 3.0):
+        h.observe(v)
+    assert h.counts == [1, 2] and h.count == 4
+    m = Metrics(buckets=(0.1, 1.0))
+    m.histograms["execution_seconds"] = h
+    m.inc("jobs_completed_total", 3)
+    text = render_prometheus(
+        m.snapshot(), {"jobs": ("Jobs by state", {"pending": 2, "dead": 0})}
+    )
+    print(text)
+    assert 'queuectl_execution_seconds_bucket{le="0.1"} 1' in text
+    assert 'queuectl_execution_seconds_bucket{le="1.0"} 3' in text
+    assert 'queuectl_execution_seconds_bucket{le="+Inf"} 4' in text
+    assert "queuectl_execution_seconds_count 4" in text
+    assert "queuectl_jobs_completed_total 3" in text
+    assert 'queuectl_jobs{state="pending"} 2' in text
+
+
+def test_collect_merges_worker_files(tmp_path):
+    print("\n[TEST] Per-worker snapshot files are summed into one view")
+    for worker_id, n in (("host:1", 2), ("host:2", 5)):
+        m = Metrics()
+        m.inc("jobs_claimed_total", n)
+        for _ in range(n):
+            m.observe("claim_latency_seconds", 0.002)
+        m.flush(metrics_path(worker_id, 1000.0, str(tmp_path)))
+    (tmp_path / "broken.json").write_text("{not json")
+
+    merged = collect(str(tmp_path))
+    assert merged["workers"] == 2
+    assert merged["counters"]["jobs_claimed_total"] == 7
+    assert merged["histograms"]["claim_latency_seconds"]["count"] == 7
+    assert merged["histograms"]["execution_seconds"]["count"] == 0
+
+
+def test_reused_pid_and_gc_keep_counters(tmp_path):
+    print("\n[TEST] A reused pid gets its own file; gc folds exited workers")
+    for started, n in ((1000.0, 4), (2000.0, 1)):
+        m = Metrics()
+        m.inc("jobs_completed_total", n)
+        m.flush(metrics_path("host:7", started, str(tmp_path)))
+    assert collect(str(tmp_path))["counters"]["jobs_completed_total"] == 5
+
+    old = time.time() - 7200
+    os.utime(metrics_path("host:7", 1000.0, str(tmp_path)), (old, old))
+    assert fold_exited(str(tmp_path)) == 1
+    assert fold_exited(str(tmp_path)) == 0
+    assert sorted(os.listdir(tmp_path)) == [EXITED_FILE, "host_7.2000000.json"]
+    merged = collect(str(tmp_path))
+    assert merged["workers"] == 1
+    assert merged["counters"]["jobs_completed_total"] == 5
@@ -0,0 +1,94 @@
+from datetime import datetime
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from flam.db.base import create_sqlite_engine, read_pragmas
+from flam.db.migrations import init_db, get_schema_version, SCHEMA_VERSION
+from flam.queue_manager import _claim_update, _runnable_ids, claim_jobs, enqueue
+
+
+@pytest.fixture()
+def engine():
+    return create_engine(
+        "sqlite:///:memory:", connect_args={"check_same_thread": False}
+    )
+
+
+def _plan(conn, sql, params=()):
+    rows = conn.exec_driver_sql("EXPLAIN QUERY PLAN " + sql, params).all()
+    return " | ".join(r[-1] for r in rows)
+
+
+def test_fresh_db_is_stamped_with_current_version(engine):
+    print("\n[TEST] Fresh database lands on SCHEMA_VERSION")
+    assert init_db(engine) == SCHEMA_VERSION
+    with engine.connect() as conn:
+        assert get_schema_version(conn) == SCHEMA_VERSION
+    # re-running is a no-op
+    assert init_db(engine) == SCHEMA_VERSION
+
+
+def test_legacy_db_is_upgraded_in_place(engine):
+    print("\n[TEST] Pre-versioning job.db gets indexes without losing rows")
+    with engine.begin() as conn:
+        conn.exec_driver_sql(
+            "CREATE TABLE jobs (id VARCHAR PRIMARY KEY, command TEXT NOT NULL, "
+            "status VARCHAR, attempts INTEGER, max_retries INTEGER, last_error TEXT, "
+            "next_run_at DATETIME, created_at DATETIME, updated_at DATETIME)"
+        )
+        conn.exec_driver_sql(
+            "INSERT INTO jobs (id, command, status, attempts, created_at) "
+            "VALUES ('old', 'echo old', 'pending', 0, ?)",
+            (str(datetime.utcnow()),),
+        )
+    init_db(engine)
+    with engine.connect() as conn:
+        names = {r[1] for r in conn.exec_driver_sql("PRAGMA index_list(jobs)").all()}
+        assert "ix_jobs_claim" in names
+        assert "ix_jobs_lease" in names
+        cols = {r[1] for r in conn.exec_driver_sql("PRAGMA table_info(jobs)").all()}
+        assert {"lease_owner", "lease_expires_at"} <= cols
+        assert conn.exec_driver_sql("SELECT count(*) FROM jobs").scalar() == 1
+
+
+def _plan_of(conn, stmt):
+    compiled = stmt.compile(dialect=conn.dialect)
+    params = [compiled.params[name] for name in compiled.positiontup]
+    params = [str(p) if isinstance(p, datetime) else p for p in params]
+    return _plan(conn, str(compiled), tuple(params))
+
+
+@pytest.mark.parametrize(
+    "queue, index", [(None, "ix_jobs_priority"), ("mail", "ix_jobs_queue_claim")]
+)
+def test_claim_query_uses_index(engine, queue, index):
+    print("\n[TEST] Claim path is an index range scan with no sort step")
+    init_db(engine)
+    session = sessionmaker(bind=engine, expire_on_commit=False)()
+    enqueue("p1", "echo hi", session, queue=queue)
+    now = datetime.utcnow()
+    runnable_ids = _runnable_ids(queue, 8, now)
+    lease = {"status": "processing", "updated_at": now, "lease_owner": "w"}
+    with engine.connect() as conn:
+        plans = [
+            _plan_of(conn, runnable_ids),
+            _plan_of(conn, _claim_update(runnable_ids, lease)),
+        ]
+    for plan in plans:
+        print("[DEBUG] plan:", plan)
+        assert index in plan
+        assert "TEMP B-TREE" not in plan
+    queues = {queue: 8} if queue else None
+    assert [j.id for j in claim_jobs(session, limit=8, queues=queues)] == ["p1"]
+
+
+def test_engine_profile_applies_pragmas(tmp_path):
+    print("\n[TEST] File-backed engine comes up in WAL with busy_timeout")
+    eng = create_sqlite_engine(f"sqlite:///{tmp_path / 'tuned.db'}")
+    active = read_pragmas(eng)
+    assert active["journal_mode"] == "wal"
+    assert active["busy_timeout"] == 5000
+    assert active["synchronous"] == 1  # NORMAL
+    eng.dispose()
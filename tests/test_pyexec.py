@@ -0,0 +1,49 @@
+import json
+
+import pytest
+
+from flam.pyexec import CallablePool, call_with_args, encode_args, split_target
+
+
+@pytest.fixture()
+def pool(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    p = CallablePool(size=1, preload=["json"], max_jobs=3)
+    yield p
+    p.close()
+
+
+def _log(tmp_path, name):
+    return {"path": str(tmp_path / f"{name}.log"), "tail_bytes": 4096}
+
+
+def test_pool_runs_callables_in_a_warm_process(pool, tmp_path):
+    print("\n[TEST] Callables run in a reused child; failures map to exit codes")
+    first = pool.pids()
+    code, out, err = pool.run("builtins:print", '["hello", 42]', _log(tmp_path, "a"), "a")
+    assert (code, out, err) == (0, "hello 42\n", "")
+    assert "hello 42" in (tmp_path / "a.log").read_text()
+
+    code, out, err = pool.run("math:sqrt", "[-1]", _log(tmp_path, "b"), "b")
+    assert code == 1
+    assert "ValueError: math domain error" in err
+    # same process for both jobs: no interpreter start per job
+    assert pool.pids() == first
+
+    # third job hits max_jobs: the child retires and a fresh one replaces it
+    code, _, _ = pool.run("sys:exit", "[3]", _log(tmp_path, "c"), "c")
+    assert code == 3
+    assert len(pool.pids()) == 1 and pool.pids() != first
+
+
+def test_callable_helpers():
+    print("\n[TEST] Target parsing and argument mapping")
+    assert split_target("pkg.mod:Cls.method") == ("pkg.mod", "Cls.method")
+    with pytest.raises(ValueError):
+        split_target("pkg.mod.func")
+    assert encode_args({"a": 1}) == json.dumps({"a": 1})
+    with pytest.raises(ValueError):
+        encode_args("{not json")
+    assert call_with_args(lambda a, b=0: a - b, {"a": 5, "b": 2}) == 3
+    assert call_with_args(lambda a, b: a - b, [5, 2]) == 3
+    assert call_with_args(lambda a: a, 7) == 7
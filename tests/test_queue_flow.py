@@ -1,19 +1,45 @@
+import io
+import json
+
 import pytest
 from datetime import datetime, timedelta
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 
-from flam.db.base import Base
-from flam.db.models import Job, DeadJob
+from flam.db.migrations import init_db
+from flam.db.models import Job, DeadJob, JobCount, Worker
 from flam.queue_manager import (
     enqueue,
+    enqueue_many,
     list_jobs,
     list_dead_jobs,
     retry_dead_job,
     move_to_dead,
     claim_next_job,
+    claim_jobs,
+    delete_job,
+    release_jobs,
+    next_run_due,
+    summarize_jobs,
+    recount_jobs,
+    iter_jobs,
+    iter_dead_jobs,
+    complete_job,
+    renew_leases,
+    reap_expired_leases,
+    backlog,
+    LEASE_EXPIRED_ERROR,
 )
 from flam.config import set_config, get_float
+from flam.records import read_records, write_records
+from flam.registry import (
+    beat,
+    count_live_workers,
+    list_workers,
+    prune_workers,
+    register_worker,
+    thresholds,
+)
 
 
 @pytest.fixture()
@@ -23,7 +49,7 @@ def session():
         "sqlite:///:memory:", connect_args={"check_same_thread": False}
     )
     TestingSessionLocal = sessionmaker(bind=engine, expire_on_commit=False)
-    Base.metadata.create_all(bind=engine)
+    init_db(engine)
     return TestingSessionLocal()
 
 
@@ -107,6 +133,22 @@ def test_failed_job_moves_to_dlq(session):
     assert session.query(DeadJob).filter_by(id="job3").first() is not None
 
 
+def test_second_death_replaces_the_dlq_entry(session):
+    print("\n[TEST] A job that dies again after re-enqueue replaces its DLQ row")
+    enqueue("x", "exit 1", session)
+    move_to_dead(session.get(Job, "x"), session, error="first")
+    enqueue("x", "exit 2", session)
+    (job,) = claim_jobs(session, limit=1, owner="w")
+    assert move_to_dead(job, session, error="boom", owner="w")
+    enqueue("x", "exit 3", session)
+    move_to_dead(session.get(Job, "x"), session, error="third")
+    session.expire_all()
+    dead = session.get(DeadJob, "x")
+    assert (dead.command, dead.last_error) == ("exit 3", "third")
+    assert session.query(DeadJob).count() == 1
+    assert summarize_jobs(session)["dead"] == 1
+
+
 def test_retry_from_dlq(session):
     print("\n[TEST] Retry job from DLQ")
     dj = DeadJob(id="job4", command="echo hi", last_error="fail")
@@ -124,3 +166,256 @@ def test_concurrent_claim_safety(session):
     assert job1 is not None
     job2 = claim_next_job(session)
     assert job2 is None
+
+
+def test_claim_jobs_batch(session):
+    print("\n[TEST] Batch claim returns up to N jobs in FIFO order")
+    for i in range(5):
+        enqueue(f"b{i}", "echo hi", session)
+    batch = claim_jobs(session, limit=3)
+    assert [j.id for j in batch] == ["b0", "b1", "b2"]
+    assert all(j.status == "processing" for j in batch)
+    rest = claim_jobs(session, limit=10)
+    assert [j.id for j in rest] == ["b3", "b4"]
+    assert claim_jobs(session, limit=10) == []
+
+
+def test_release_jobs_returns_batch_to_queue(session):
+    print("\n[TEST] Released jobs become claimable again")
+    enqueue("r1", "echo a", session)
+    enqueue("r2", "echo b", session)
+    batch = claim_jobs(session, limit=2)
+    assert release_jobs(batch[1:], session) == 1
+    again = claim_jobs(session, limit=2)
+    assert [j.id for j in again] == ["r2"]
+
+
+def test_claim_sets_lease_and_renewal_extends_it(session):
+    print("\n[TEST] Claims carry a lease the owner can renew")
+    enqueue("l1", "echo a", session)
+    (job,) = claim_jobs(session, limit=1, owner="host:1", lease_seconds=30)
+    assert job.lease_owner == "host:1"
+    first = job.lease_expires_at
+    assert first > datetime.utcnow() + timedelta(seconds=20)
+    assert renew_leases(session, "host:1", lease_seconds=120) == 1
+    assert renew_leases(session, "host:2") == 0
+    session.refresh(job)
+    assert job.lease_expires_at > first
+
+
+def test_reaper_requeues_expired_leases(session):
+    print("\n[TEST] Jobs of a dead worker go back to pending or to the DLQ")
+    enqueue("lost", "echo a", session)
+    enqueue("last-try", "echo b", session, max_retries=1)
+    enqueue("alive", "echo c", session)
+    dead_owner = claim_jobs(session, limit=2, owner="host:1", lease_seconds=0)
+    claim_jobs(session, limit=1, owner="host:2", lease_seconds=60)
+    assert [j.id for j in dead_owner] == ["lost", "last-try"]
+
+    assert reap_expired_leases(session) == {"requeued": 1, "dead": 1}
+    session.expire_all()
+    lost = session.get(Job, "lost")
+    assert (lost.status, lost.attempts, lost.lease_owner) == ("pending", 1, None)
+    assert session.get(DeadJob, "last-try") is not None
+    assert session.get(Job, "alive").status == "processing"
+    assert summarize_jobs(session)["dead"] == 1
+    assert reap_expired_leases(session) == {"requeued": 0, "dead": 0}
+
+    # the old owner comes back: its result no longer applies
+    assert complete_job(lost, session, owner="host:1") is False
+    assert session.get(Job, "lost").status == "pending"
+
+
+def test_reaper_replaces_an_older_dlq_entry(session):
+    print("\n[TEST] A reaped job with a stale DLQ row of the same id replaces it")
+    stale = DeadJob(id="j", command="old", last_error="old", failed_at=datetime.utcnow())
+    session.add(stale)
+    session.commit()
+    enqueue("j", "echo new", session, max_retries=1)
+    claim_jobs(session, limit=1, owner="host:1", lease_seconds=0)
+    assert reap_expired_leases(session) == {"requeued": 0, "dead": 1}
+    session.expire_all()
+    assert session.get(Job, "j") is None
+    dead = session.get(DeadJob, "j")
+    assert (dead.command, dead.last_error) == ("echo new", LEASE_EXPIRED_ERROR)
+
+
+def test_enqueue_many_streams_in_chunks(session):
+    print("\n[TEST] Bulk enqueue keeps input order and chunking")
+    records = ({"id": f"bulk{i}", "command": "echo hi"} for i in range(25))
+    stats = enqueue_many(records, session, batch_size=10)
+    assert stats == {"inserted": 25, "replaced": 0, "skipped": 0}
+    jobs = list_jobs(session)
+    assert [j.id for j in jobs] == [f"bulk{i}" for i in range(25)]
+    assert all(j.status == "pending" for j in jobs)
+
+
+def test_enqueue_many_conflict_policies(session):
+    print("\n[TEST] skip / replace / fail on duplicate ids")
+    enqueue("dup", "echo old", session)
+    stats = enqueue_many(
+        [{"id": "dup", "command": "echo new"}, {"id": "new", "command": "echo n"}],
+        session,
+        on_conflict="skip",
+    )
+    assert stats == {"inserted": 1, "replaced": 0, "skipped": 1}
+    assert session.query(Job).filter_by(id="dup").first().command == "echo old"
+
+    stats = enqueue_many(
+        [{"id": "dup", "command": "echo new"}], session, on_conflict="replace"
+    )
+    assert stats == {"inserted": 0, "replaced": 1, "skipped": 0}
+    session.expire_all()
+    assert session.query(Job).filter_by(id="dup").first().command == "echo new"
+
+    # a repeat inside the batch supersedes a record, not a stored job
+    stats = enqueue_many(
+        [{"id": "once", "command": "echo a"}, {"id": "once", "command": "echo b"}],
+        session,
+        on_conflict="replace",
+    )
+    assert stats == {"inserted": 1, "replaced": 0, "skipped": 1}
+    assert session.query(Job).filter_by(id="once").first().command == "echo b"
+
+    with pytest.raises(ValueError):
+        enqueue_many([{"id": "dup", "command": "echo x"}], session, on_conflict="fail")
+
+
+def test_read_records_jsonl_and_csv():
+    print("\n[TEST] JSONL and CSV readers")
+    jsonl = io.StringIO('{"id": "a", "command": "echo a"}\n\n{"id": "b", "command": "echo b"}\n')
+    assert [r["id"] for r in read_records(jsonl, "jsonl")] == ["a", "b"]
+    csv_text = io.StringIO("id,command,max_retries\nc,echo c,5\n")
+    assert list(read_records(csv_text, "csv")) == [
+        {"id": "c", "command": "echo c", "max_retries": "5"}
+    ]
+
+
+def test_next_run_due_is_earliest_scheduled_retry(session):
+    print("\n[TEST] Idle workers can sleep until the earliest retry")
+    assert next_run_due(session) is None
+    enqueue("soon", "echo a", session)
+    enqueue("later", "echo b", session)
+    soon = datetime.utcnow() + timedelta(seconds=5)
+    session.query(Job).filter_by(id="soon").first().next_run_at = soon
+    session.query(Job).filter_by(id="later").first().next_run_at = soon + timedelta(
+        seconds=60
+    )
+    session.commit()
+    assert next_run_due(session) == soon
+
+
+def test_summary_counters_follow_every_transition(session):
+    print("\n[TEST] Trigger-maintained counters match the table")
+    enqueue_many(({"id": f"s{i}", "command": "echo"} for i in range(6)), session)
+    claimed = claim_jobs(session, limit=3)
+    claimed[0].status = "completed"
+    claimed[1].status = "failed"
+    session.commit()
+    move_to_dead(claimed[2], session)
+    retry_dead_job("s2", session)
+    delete_job("s5", session)
+    summary = summarize_jobs(session)
+    print("[DEBUG] summary:", summary)
+    assert summary == {
+        "total": 5,
+        "pending": 3,
+        "processing": 0,
+        "completed": 1,
+        "failed": 1,
+        "dead": 0,
+    }
+
+
+def test_recount_repairs_drifted_counters(session):
+    print("\n[TEST] --recount rebuilds job_counts")
+    enqueue("rc1", "echo", session)
+    session.execute(JobCount.__table__.update().values(count=42))
+    session.commit()
+    assert summarize_jobs(session)["pending"] == 42
+    assert recount_jobs(session)["pending"] == 1
+
+
+def test_iter_jobs_keyset_pages_cover_everything_once(session):
+    print("\n[TEST] --limit/--after pages through the queue without gaps")
+    enqueue_many(({"id": f"k{i:02d}", "command": "echo"} for i in range(23)), session)
+    seen, after = [], None
+    while True:
+        page = list(iter_jobs(session, after=after, limit=10, fields=("id",)))
+        if not page:
+            break
+        seen.extend(r.id for r in page)
+        after = page[-1].id
+    assert seen == [f"k{i:02d}" for i in range(23)]
+    with pytest.raises(ValueError):
+        list(iter_jobs(session, after="nope"))
+
+
+def test_iter_dead_jobs_projection_and_json_output(session):
+    print("\n[TEST] DLQ listing loads only requested columns")
+    for i in range(3):
+        session.add(
+            DeadJob(
+                id=f"d{i}",
+                command="x" * 1000,
+                last_error="boom",
+                failed_at=datetime(2024, 1, 1 + i),
+            )
+        )
+    session.commit()
+    rows = list(iter_dead_jobs(session, fields=("id", "failed_at"), limit=2))
+    assert [tuple(r) for r in rows] == [
+        ("d2", datetime(2024, 1, 3)),
+        ("d1", datetime(2024, 1, 2)),
+    ]
+    rest = list(iter_dead_jobs(session, after="d1", fields=("id",)))
+    assert [r.id for r in rest] == ["d0"]
+    out = io.StringIO()
+    assert write_records(rows, ("id", "failed_at"), out, "json") == 2
+    assert json.loads(out.getvalue())[0] == {
+        "id": "d2",
+        "failed_at": "2024-01-03T00:00:00",
+    }
+
+
+def test_worker_registry_states(session):
+    print("\n[TEST] Registry reports live, stale and dead workers in one query")
+    register_worker(session, "host-a:1")
+    register_worker(session, "host-b:2")
+    register_worker(session, "host-c:3")
+    now = datetime.utcnow()
+    session.query(Worker).filter_by(id="host-b:2").update(
+        {Worker.last_seen: now - timedelta(seconds=30)}
+    )
+    session.query(Worker).filter_by(id="host-c:3").update(
+        {Worker.last_seen: now - timedelta(minutes=10)}
+    )
+    session.commit()
+    assert beat(session, "host-a:1", current_job="j1", jobs_done=7)
+    assert not beat(session, "gone:9")
+
+    stale_after, dead_after = thresholds(5, 60)
+    rows = list_workers(session, stale_after, dead_after)
+    assert [(r.id, r.state) for r in rows] == [
+        ("host-a:1", "live"),
+        ("host-b:2", "stale"),
+        ("host-c:3", "dead"),
+    ]
+    assert (rows[0].host, rows[0].pid, rows[0].current_job) == ("host-a", 1, "j1")
+    assert rows[0].jobs_done == 7
+    assert count_live_workers(session, stale_after) == 1
+    assert prune_workers(session, dead_after) == 1
+
+
+def test_backlog_reports_pending_and_oldest_wait(session):
+    print("\n[TEST] Backlog for the autoscaler comes from counters and one index probe")
+    assert backlog(session) == {"pending": 0, "runnable": 0, "oldest_wait": 0.0}
+    enqueue("w1", "echo a", session)
+    enqueue("w2", "echo b", session)
+    session.query(Job).filter_by(id="w1").update(
+        {Job.created_at: datetime.utcnow() - timedelta(seconds=90)}
+    )
+    session.commit()
+    load = backlog(session)
+    assert (load["pending"], load["runnable"]) == (2, 2)
+    assert 89 <= load["oldest_wait"] < 120
@@ -0,0 +1,67 @@
+import pytest
+
+from flam.broker import Broker
+from flam.queue_manager import (
+    FairQueues,
+    claim_jobs,
+    enqueue,
+    enqueue_many,
+    parse_queues,
+    recount_jobs,
+    summarize_queues,
+)
+
+
+def test_fair_queues_share_slots_by_weight():
+    print("\n[TEST] Claim slots are shared by weight, interleaved")
+    assert parse_queues("high:5, default") == [("high", 5), ("default", 1)]
+    for bad in ("", "a:0", "a:x", "a,a"):
+        with pytest.raises(ValueError):
+            parse_queues(bad)
+    fair = FairQueues([("high", 5), ("default", 1)])
+    turns = [next(q for q, n in fair.plan(1).items() if n) for _ in range(12)]
+    assert turns.count("high") == 10 and turns.count("default") == 2
+    assert "default" in turns[:6]  # not starved behind a burst of "high"
+    assert fair.plan(6) == {"high": 5, "default": 1}
+
+
+def test_claim_by_priority_and_queue_quota(session):
+    print("\n[TEST] Claims take the highest priority first, per queue quota")
+    enqueue_many(
+        [{"id": f"bulk{i}", "command": "x", "queue": "bulk"} for i in range(5)]
+        + [{"id": "urgent", "command": "x", "queue": "bulk", "priority": 10}],
+        session,
+    )
+    enqueue("api1", "x", session, queue="api")
+    enqueue("api2", "x", session, queue="api", priority=-1)
+    assert summarize_queues(session) == {"api": {"pending": 2}, "bulk": {"pending": 6}}
+
+    claimed = claim_jobs(session, 3, owner="w", queues={"bulk": 1, "api": 2})
+    assert [j.id for j in claimed] == ["urgent", "api1", "api2"]
+    # api is empty now: its slots go to bulk, oldest first
+    claimed = claim_jobs(session, 3, owner="w", queues={"api": 2, "bulk": 1})
+    assert [j.id for j in claimed] == ["bulk0", "bulk1", "bulk2"]
+    assert claim_jobs(session, 5, owner="w", queues={"other": 5}) == []
+
+    backlog = summarize_queues(session)
+    assert backlog["bulk"] == {"pending": 2, "processing": 4}
+    recount_jobs(session)
+    assert summarize_queues(session) == backlog
+
+
+def test_broker_claims_by_queue(session):
+    print("\n[TEST] The broker applies the same priority and quota rules")
+    enqueue("low", "x", session, queue="bulk")
+    enqueue("high", "x", session, queue="bulk", priority=5)
+    enqueue("api", "x", session, queue="api")
+    broker = Broker()
+    broker.start()
+    try:
+        result, _ = broker.claim(2, "w", 30, queues={"bulk": 1, "api": 1})
+        assert [j["id"] for j in result["jobs"]] == ["high", "api"]
+        result, _ = broker.claim(2, "w", 30, queues={"api": 2})
+        assert result["jobs"] == []
+        result, _ = broker.claim(2, "w", 30)
+        assert [j["id"] for j in result["jobs"]] == ["low"]
+    finally:
+        broker.stop()
@@ -0,0 +1,90 @@
+import os
+from datetime import datetime
+
+from flam import worker
+from flam.broker import Broker
+from flam.db.models import Job, JobResult
+from flam.queue_manager import chunk_rows, enqueue, worker_identity
+from flam.results import prune_result_files, read_result, result_dir, split_results
+
+
+def test_worker_stores_outputs_per_attempt(session):
+    print("\n[TEST] Each attempt's output tails are kept, compressed and deferred")
+    enqueue("flaky", "echo try; echo oops >&2; exit 3", session, max_retries=2)
+    owner = worker_identity()
+    for _ in range(2):
+        session.query(Job).filter_by(id="flaky").update({"next_run_at": None})
+        session.commit()
+        for job in worker._claim(session, 1, owner, 60):
+            worker._run_job(job, session, 0.01)
+
+    latest = read_result(session, "flaky")
+    assert (latest["attempt"], latest["exit_code"], latest["worker"]) == (2, 3, owner)
+    assert (latest["stdout"], latest["stderr"]) == ("try\n", "oops\n")
+    assert read_result(session, "flaky", attempt=1)["attempt"] == 1
+    assert read_result(session, "flaky", attempt=3) is None
+
+    session.expire_all()
+    stored = session.query(JobResult).filter_by(job_id="flaky").first()
+    # the blobs stay unloaded until asked for
+    assert "stdout" not in stored.__dict__
+    assert (stored.codec, stored.stdout_bytes) == ("zlib", 4)
+    assert stored.stdout != b"try\n"
+
+
+def test_large_outputs_go_to_shared_files(session):
+    print("\n[TEST] Blobs over the inline limit are content-addressed files")
+    now = datetime.utcnow()
+    big = "".join(f"line {i}\n" for i in range(5000))
+    attempts = [
+        {"job_id": j, "attempt": 1, "finished_at": now, "stdout": big}
+        for j in ("a", "b")
+    ]
+    plain, results = split_results(
+        attempts, session.get_bind().url.database, "zlib", 64
+    )
+    assert [set(row) for row in plain] == [{"job_id", "attempt", "finished_at"}] * 2
+    assert results[0]["stdout"] is None
+    assert results[0]["stdout_ref"] == results[1]["stdout_ref"]
+    session.add_all(JobResult(**r) for r in results)
+    session.commit()
+    assert read_result(session, "b")["stdout"] == big
+
+    directory = result_dir(session.get_bind().url.database)
+    assert sum(len(files) for _, _, files in os.walk(directory)) == 1
+    assert prune_result_files(session, min_age=0) == 0
+    session.query(JobResult).delete()
+    session.commit()
+    assert prune_result_files(session, min_age=0) == 1
+
+
+def test_broker_writes_results_at_snapshot(session):
+    print("\n[TEST] Outputs acked through the broker land in job_results")
+    rows, _ = chunk_rows(
+        [{"id": "j", "command": "echo hi"}],
+        "fail",
+        {"inserted": 0, "replaced": 0, "skipped": 0},
+    )
+    broker = Broker()
+    broker.start()
+    try:
+        broker.dispatch(
+            {"op": "enqueue", "rows": list(rows.values()), "on_conflict": "fail"}
+        )
+        broker.claim(1, "w", 30)
+        now = datetime.utcnow()
+        attempt = {
+            "job_id": "j",
+            "attempt": 1,
+            "worker": "w",
+            "started_at": now,
+            "finished_at": now,
+            "exit_code": 0,
+            "stdout": "hi\n",
+        }
+        broker.dispatch({"op": "ack", "job_id": "j", "owner": "w", "attempt": attempt})
+        broker.snapshot()
+    finally:
+        broker.stop()
+    found = read_result(session, "j")
+    assert (found["exit_code"], found["stdout"], found["stderr"]) == (0, "hi\n", "")
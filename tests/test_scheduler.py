@@ -0,0 +1,82 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from flam.db.base import get_session
+from flam.db.models import Job
+from flam.queue_manager import claim_jobs, enqueue, enqueue_many
+from flam.scheduler import (
+    Cron,
+    Scheduler,
+    add_schedule,
+    due_fires,
+    materialize_due,
+)
+
+
+def test_cron_next_after():
+    print("\n[TEST] Cron expressions find the next fire time")
+    t = datetime(2025, 12, 31, 23, 50, 30)
+    assert Cron("*/15 * * * *").next_after(t) == datetime(2026, 1, 1, 0, 0)
+    assert Cron("@hourly").next_after(t) == datetime(2026, 1, 1, 0, 0)
+    assert Cron("0 0 1 * *").next_after(t) == datetime(2026, 1, 1, 0, 0)
+    # 2026-01-01 is a Thursday
+    assert Cron("30 9 * * mon-fri").next_after(t) == datetime(2026, 1, 1, 9, 30)
+    assert Cron("0 12 * * sat,sun").next_after(t) == datetime(2026, 1, 3, 12, 0)
+    # both day fields restricted: either one matches
+    assert Cron("0 0 15 * 5").next_after(t) == datetime(2026, 1, 2, 0, 0)
+    for bad in ("* * *", "61 * * * *", "*/0 * * * *", "0 0 30 2 *"):
+        with pytest.raises(ValueError):
+            Cron(bad).next_after(t)
+
+
+def test_catch_up_policies():
+    print("\n[TEST] Missed fires are handled per catch-up policy")
+    cron = Cron("*/10 * * * *")
+    start = datetime(2025, 1, 1, 0, 0)
+    now = datetime(2025, 1, 1, 0, 35)
+    fires, following = due_fires(cron, start, now, "all")
+    assert [f.minute for f in fires] == [0, 10, 20, 30]
+    assert following == datetime(2025, 1, 1, 0, 40)
+    assert due_fires(cron, start, now, "latest")[0] == [datetime(2025, 1, 1, 0, 30)]
+    # 5 minutes late is past the grace period
+    assert due_fires(cron, start, now, "skip") == ([], following)
+
+
+def test_materialize_fires_once_across_schedulers(session):
+    print("\n[TEST] Due schedules become jobs exactly once")
+    add_schedule(session, "report", "*/5 * * * *", "echo report", catch_up="all")
+    other = get_session()
+    try:
+        # both schedulers see the schedule as due...
+        late = datetime.utcnow() + timedelta(minutes=11)
+        stale = Scheduler(other, client_factory=None)
+        stale.reload()
+        created, advanced = materialize_due(session, late)
+        assert created >= 2 and list(advanced) == ["report"]
+        # ...but only the first one to advance it creates jobs
+        assert stale.run_due(late) == 0
+        assert stale.next_due() == advanced["report"]
+    finally:
+        other.close()
+    jobs = session.query(Job).order_by(Job.id).all()
+    assert len(jobs) == created
+    assert all(j.id.startswith("report@") for j in jobs)
+    assert all(j.next_run_at <= late for j in jobs)
+    assert materialize_due(session, late) == (0, {})
+
+
+def test_delayed_enqueue_waits(session):
+    print("\n[TEST] --delay/--run-at jobs are not claimed early")
+    later = datetime.utcnow() + timedelta(hours=1)
+    enqueue("later", "exit 0", session, run_at=later.isoformat() + "Z")
+    enqueue_many(
+        [
+            {"id": "soon", "command": "exit 0", "delay": "1h"},
+            {"id": "now", "command": "x"},
+        ],
+        session,
+    )
+    assert session.get(Job, "later").next_run_at == later
+    assert session.get(Job, "soon").next_run_at > datetime.utcnow()
+    assert [j.id for j in claim_jobs(session, 10)] == ["now"]
@@ -0,0 +1,54 @@
+import os
+import signal
+import threading
+import time
+
+import pytest
+
+from flam.worker_manager import Supervisor
+
+
+def _wait_for(predicate, timeout=15.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.05)
+    return False
+
+
+@pytest.fixture()
+def supervisor(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    sup = Supervisor(count=2, restart_backoff=0.1, stop_timeout=5.0)
+    t = threading.Thread(target=sup.run, kwargs={"tick": 0.05})
+    t.start()
+    yield sup, t
+    sup.request("stop")
+    t.join(20)
+
+
+@pytest.mark.skipif(os.name == "nt", reason="POSIX signals")
+def test_supervisor_restarts_crashed_worker(supervisor):
+    print("\n[TEST] A killed worker is replaced; the pool stays at --count")
+    sup, _ = supervisor
+    assert _wait_for(lambda: len(sup.pids()) == 2)
+    victim = sup.pids()[0]
+    os.kill(victim, signal.SIGKILL)
+    assert _wait_for(lambda: len(sup.pids()) == 2 and victim not in sup.pids())
+    assert sup.slots[0].failures == 1
+
+
+@pytest.mark.skipif(os.name == "nt", reason="POSIX signals")
+def test_supervisor_rolling_restart_then_drain(supervisor):
+    print("\n[TEST] Rolling restart replaces every worker, drain exits cleanly")
+    sup, t = supervisor
+    assert _wait_for(lambda: len(sup.pids()) == 2)
+    before = set(sup.pids())
+    sup.request("restart")
+    assert _wait_for(lambda: len(sup.pids()) == 2 and not before & set(sup.pids()))
+    sup.request("drain")
+    t.join(20)
+    assert not t.is_alive()
+    assert sup.pids() == []
+    assert not os.path.exists(os.path.join("data", "supervisor.pid"))
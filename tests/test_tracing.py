@@ -0,0 +1,54 @@
+import pstats
+
+from sqlalchemy import text
+
+from flam import tracing
+from flam.db.base import create_sqlite_engine
+from flam.tracing import Profiler, Tracer, span, trace_sql, traced
+
+
+def test_spans_are_free_when_off_and_aggregate_when_on():
+    print("\n[TEST] Spans are a shared no-op until a tracer is installed")
+    assert tracing.get_tracer() is None
+    assert span("a") is span("b")
+
+    @traced("fn")
+    def double(x):
+        return x * 2
+
+    tracer = Tracer()
+    tracing.set_tracer(tracer)
+    try:
+        for _ in range(3):
+            with span("phase"):
+                pass
+        assert double(2) == 4
+    finally:
+        tracing.set_tracer(None)
+    window, stats = tracer.take()
+    assert stats["phase"][0] == 3 and stats["fn"][0] == 1
+    assert tracer.take()[1] == {}
+    assert "phase" in tracing.format_summary(window, stats)
+
+
+def test_profiler_writes_spans_sql_and_cprofile(tmp_path):
+    print("\n[TEST] Profiler writes span summaries with SQL timings and .prof")
+    engine = create_sqlite_engine(f"sqlite:///{tmp_path / 't.db'}")
+    untrace = trace_sql(engine)
+    profiler = Profiler("host:1", "cprofile", directory=str(tmp_path / "profiles"))
+    profiler.start()
+    try:
+        with span("worker.claim"), engine.connect() as conn:
+            conn.execute(text("SELECT 1"))
+    finally:
+        profiler.stop()
+        untrace()
+        engine.dispose()
+    assert tracing.get_tracer() is None
+
+    files = sorted(p.name for p in (tmp_path / "profiles").iterdir())
+    print("[DEBUG] files:", files)
+    summary = (tmp_path / "profiles" / "host_1.spans.txt").read_text()
+    assert "worker.claim" in summary and "sql SELECT 1" in summary
+    prof = next((tmp_path / "profiles").glob("host_1-*.prof"))
+    assert pstats.Stats(str(prof)).total_calls > 0
@@ -0,0 +1,178 @@
+import asyncio
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+from flam import worker
+from flam.notify import WakeChannel, wake_workers
+from flam.db.base import get_session
+from flam.db.models import DeadJob, Job
+from flam.queue_manager import claim_jobs, enqueue, iter_attempts, worker_identity
+from flam.registry import list_workers, thresholds
+
+
+def _wait_for(predicate, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.05)
+    return False
+
+
+def test_concurrent_mode_overlaps_jobs(session, tmp_path):
+    print("\n[TEST] --concurrency runs jobs side by side in one process")
+    sleep = f'"{sys.executable}" -c "import time; time.sleep(0.6)"'
+    for i in range(4):
+        enqueue(f"c{i}", sleep, session)
+
+    started = time.monotonic()
+    t = threading.Thread(
+        target=lambda: asyncio.run(worker._concurrent_loop(get_session(), 0.05, 3.0, 4))
+    )
+    t.start()
+    try:
+        done = _wait_for(
+            lambda: session.query(Job).filter_by(status="completed").count() == 4
+        )
+    finally:
+        worker._shutdown.set()
+        t.join(10)
+    elapsed = time.monotonic() - started
+    print("[DEBUG] elapsed:", elapsed)
+    assert done
+    # four 0.6s jobs run serially would take 2.4s
+    assert elapsed < 2.0
+
+
+def test_concurrent_mode_waits_for_in_flight_on_shutdown(session, tmp_path):
+    print("\n[TEST] Shutdown drains running children instead of dropping them")
+    enqueue("slow", f'"{sys.executable}" -c "import time; time.sleep(0.5)"', session)
+    t = threading.Thread(
+        target=lambda: asyncio.run(worker._concurrent_loop(get_session(), 0.05, 3.0, 2))
+    )
+    t.start()
+    assert _wait_for(
+        lambda: session.query(Job).filter_by(status="processing").count() == 1
+    )
+    worker._shutdown.set()
+    t.join(10)
+    session.expire_all()
+    assert session.query(Job).filter_by(id="slow").first().status == "completed"
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="Unix datagram sockets")
+def test_wake_channel_wakes_idle_waiter(tmp_path):
+    print("\n[TEST] wake_workers interrupts an idle wait")
+    channel = WakeChannel(str(tmp_path))
+    try:
+        assert channel.wait(0.01) is False
+        assert wake_workers(str(tmp_path)) == 1
+        started = time.monotonic()
+        assert channel.wait(5) is True
+        assert time.monotonic() - started < 1
+    finally:
+        channel.close()
+    # the socket file is gone, so nothing is left to wake
+    assert wake_workers(str(tmp_path)) == 0
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="Unix datagram sockets")
+def test_idle_worker_picks_up_enqueue_without_polling(session, tmp_path, monkeypatch):
+    print("\n[TEST] Enqueue wakes a worker that is sleeping on a long backoff")
+    t = threading.Thread(
+        target=worker._serial_loop, args=(get_session(), 10.0, 3.0, 1, 10.0)
+    )
+    t.start()
+    try:
+        time.sleep(0.3)  # let it go idle
+        # the wake sockets sit next to job.db, not under the cwd
+        monkeypatch.chdir(tmp_path.parent)
+        enqueue("wake-me", "echo hi", session)
+        started = time.monotonic()
+        done = _wait_for(
+            lambda: session.query(Job).filter_by(status="completed").count() == 1,
+            timeout=5,
+        )
+        elapsed = time.monotonic() - started
+    finally:
+        worker._handle_signal(None, None)
+        t.join(10)
+    assert done
+    assert elapsed < 2
+    assert not t.is_alive()
+
+
+def test_worker_registers_and_heartbeats(session, monkeypatch):
+    print("\n[TEST] worker_loop keeps a registry row fresh off the job path")
+    monkeypatch.setattr(worker, "HEARTBEAT_INTERVAL", 0.1)
+    monkeypatch.setattr(worker, "_activity", worker._Activity())
+    enqueue("reg1", "echo hi", session)
+    t = threading.Thread(target=worker.worker_loop, args=("data", 0.05, 3.0))
+    t.start()
+    me = worker_identity()
+    stale_after, dead_after = thresholds(0.1, 60)
+
+    def seen():
+        session.expire_all()
+        rows = {r.id: r for r in list_workers(session, stale_after, dead_after)}
+        return me in rows and rows[me].jobs_done == 1 and rows[me]
+
+    try:
+        row = _wait_for(seen) and seen()
+    finally:
+        worker._handle_signal(None, None)
+        t.join(10)
+    assert row
+    assert row.state == "live"
+    assert row.pid == os.getpid()
+    assert row.current_job is None
+    # a clean stop removes the row
+    assert list_workers(session, stale_after, dead_after) == []
+
+
+def test_callable_jobs_share_retry_and_dlq_path(session):
+    print("\n[TEST] Callable jobs complete, or fail into the DLQ like shell jobs")
+    enqueue("py-ok", "json:dumps", session, kind="callable", args=[[1, 2]])
+    enqueue(
+        "py-bad", "math:sqrt", session, kind="callable", args=[-1], max_retries=1
+    )
+    for job in claim_jobs(session, limit=2, owner=worker_identity()):
+        worker._run_job(job, session, 3.0)
+    session.expire_all()
+    assert session.get(Job, "py-ok").status == "completed"
+    assert session.get(Job, "py-bad") is None
+    dead = session.get(DeadJob, "py-bad")
+    assert (dead.kind, dead.args) == ("callable", "[-1]")
+    assert "math domain error" in dead.last_error
+
+
+def test_attempts_are_recorded_and_measured(session, monkeypatch):
+    print("\n[TEST] Every attempt gets a row and feeds the worker's histograms")
+    monkeypatch.setattr(worker, "_metrics", worker.Metrics())
+    enqueue("flaky", "exit 3", session, max_retries=2)
+    owner = worker_identity()
+    for _ in range(2):
+        session.query(Job).filter_by(id="flaky").update({"next_run_at": None})
+        session.commit()
+        for job in worker._claim(session, 1, owner, 60):
+            worker._run_job(job, session, 0.01)
+
+    rows = list(iter_attempts(session, "flaky"))
+    print("[DEBUG] attempts:", rows)
+    assert [(r.attempt, r.exit_code, r.worker) for r in rows] == [
+        (1, 3, owner),
+        (2, 3, owner),
+    ]
+    assert all(r.finished_at >= r.started_at for r in rows)
+
+    snap = worker._metrics.snapshot()
+    assert snap["counters"]["jobs_claimed_total"] == 2
+    assert snap["counters"]["jobs_failed_total"] == 2
+    assert snap["counters"]["jobs_retried_total"] == 1
+    assert snap["counters"]["jobs_dead_total"] == 1
+    for name in ("queue_wait_seconds", "execution_seconds", "db_commit_seconds"):
+        assert snap["histograms"][name]["count"] == 2
@@ -0,0 +1,47 @@
+# Small helpers for human-friendly durations on the command line ("7d", "90s")
+# and absolute times ("2025-11-09T14:30:00Z").
+import re
+from datetime import datetime, timedelta, timezone
+
+_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800}
+_PART = re.compile(r"(\d+(?:\.\d+)?)([smhdw]?)")
+
+
+def parse_duration(text):
+    """
+    Parse "45s", "10m", "12h", "7d", "2w" or combinations like "1h30m" into a
+    timedelta. A bare number means seconds.
+    """
+    text = str(text).strip().lower()
+    pos = 0
+    seconds = 0.0
+    for m in _PART.finditer(text):
+        if m.start() != pos:
+            break
+        seconds += float(m.group(1)) * _UNITS[m.group(2) or "s"]
+        pos = m.end()
+    if not text or pos != len(text):
+        raise ValueError(f"Invalid duration '{text}' (use e.g. 30s, 10m, 12h, 7d)")
+    return timedelta(seconds=seconds)
+
+
+def parse_timestamp(text):
+    """
+    Parse an ISO 8601 time into a naive UTC datetime, as stored in the
+    database. A time without an offset is taken to be UTC already.
+    """
+    if isinstance(text, datetime):
+        value = text
+    else:
+        text = str(text).strip()
+        if text[-1:] in ("Z", "z"):
+            text = text[:-1] + "+00:00"
+        try:
+            value = datetime.fromisoformat(text)
+        except ValueError:
+            raise ValueError(
+                f"Invalid time '{text}' (use ISO 8601, e.g. 2025-11-09T14:30:00Z)"
+            )
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
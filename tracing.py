@@ -0,0 +1,246 @@
+# Instrumentation spans for the worker's hot paths (claim, execute, output,
+# commit) and the queue_manager transitions. Off by default: `span()` then
+# returns one shared no-op context manager, so instrumented code pays a
+# function call and nothing else. `worker start --profile` installs a Tracer
+# and writes periodic summaries (and optionally sampled cProfile windows) to
+# data/profiles/.
+import cProfile
+import functools
+import os
+import threading
+import time
+from datetime import datetime
+
+from sqlalchemy import event
+
+PROFILE_DIR = os.path.join("data", "profiles")
+PROFILE_MODES = ("spans", "cprofile")
+DEFAULT_PROFILE_INTERVAL = 60.0
+DEFAULT_PROFILE_SAMPLE = 5.0
+
+_tracer = None  # anything with .span(name) -> context manager; None = off
+
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+def span(name):
+    """Time the enclosed block as `name` when tracing is on."""
+    tracer = _tracer
+    if tracer is None:
+        return _NULL_SPAN
+    return tracer.span(name)
+
+
+def traced(name):
+    """Decorator form of span() for whole functions."""
+
+    def wrap(func):
+        @functools.wraps(func)
+        def inner(*args, **kwargs):
+            tracer = _tracer
+            if tracer is None:
+                return func(*args, **kwargs)
+            with tracer.span(name):
+                return func(*args, **kwargs)
+
+        return inner
+
+    return wrap
+
+
+def set_tracer(tracer):
+    """
+    Install `tracer` process-wide (None turns tracing off). Any object with
+    a `span(name)` method returning a context manager plugs in, e.g. an
+    adapter to an external tracing system.
+    """
+    global _tracer
+    _tracer = tracer
+
+
+def get_tracer():
+    return _tracer
+
+
+class _Span:
+    __slots__ = ("_tracer", "_name", "_started")
+
+    def __init__(self, tracer, name):
+        self._tracer = tracer
+        self._name = name
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._tracer.record(self._name, time.perf_counter() - self._started)
+        return False
+
+
+class Tracer:
+    """
+    Aggregates span timings per name: count, total and max seconds. Safe to
+    use from the worker's loop and heartbeat threads at once.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}
+        self._since = time.monotonic()
+
+    def span(self, name):
+        return _Span(self, name)
+
+    def record(self, name, seconds):
+        with self._lock:
+            stat = self._stats.get(name)
+            if stat is None:
+                self._stats[name] = [1, seconds, seconds]
+            else:
+                stat[0] += 1
+                stat[1] += seconds
+                if seconds > stat[2]:
+                    stat[2] = seconds
+
+    def take(self):
+        """Return (window_seconds, {name: (count, total, max)}) and reset."""
+        with self._lock:
+            stats, self._stats = self._stats, {}
+            now = time.monotonic()
+            window, self._since = now - self._since, now
+        return window, {name: tuple(s) for name, s in stats.items()}
+
+
+def format_summary(window, stats):
+    """Text table of span stats, most total time first."""
+    stamp = datetime.utcnow().isoformat(timespec="seconds")
+    lines = [
+        f"--- {stamp} window={window:.1f}s ---",
+        f"{'span':<64} {'count':>8} {'total_s':>10} {'mean_ms':>9} "
+        f"{'max_ms':>9} {'share':>6}",
+    ]
+    for name, (count, total, longest) in sorted(
+        stats.items(), key=lambda kv: kv[1][1], reverse=True
+    ):
+        share = total / window if window else 0.0
+        lines.append(
+            f"{name[:64]:<64} {count:>8} {total:>10.3f} "
+            f"{total / count * 1000:>9.3f} {longest * 1000:>9.3f} {share:>6.1%}"
+        )
+    return "\n".join(lines) + "\n"
+
+
+def trace_sql(engine):
+    """
+    Time every statement `engine` executes as a "sql <statement>" span.
+    Returns a function that removes the hooks again.
+    """
+
+    def before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("_trace_started", []).append(time.perf_counter())
+
+    def after(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info["_trace_started"].pop()
+        tracer = _tracer
+        if tracer is not None:
+            # statements are parameterised, so this key set stays small
+            key = "sql " + " ".join(statement.split())[:80]
+            tracer.record(key, time.perf_counter() - started)
+
+    event.listen(engine, "before_cursor_execute", before)
+    event.listen(engine, "after_cursor_execute", after)
+
+    def remove():
+        event.remove(engine, "before_cursor_execute", before)
+        event.remove(engine, "after_cursor_execute", after)
+
+    return remove
+
+
+class Profiler:
+    """
+    Periodic profile output for one worker. Every `interval` seconds the
+    span summary is appended to `<dir>/<worker>.spans.txt`. In
+    "cprofile" mode the loop thread is also profiled for the first `sample`
+    seconds of each interval and dumped as a .prof file (pstats format), so
+    cProfile's own overhead is paid only a fraction of the time.
+
+    `tick()` must be called from the thread to profile (the worker loop).
+    """
+
+    def __init__(
+        self,
+        worker_id,
+        mode="spans",
+        interval=DEFAULT_PROFILE_INTERVAL,
+        sample=DEFAULT_PROFILE_SAMPLE,
+        directory=PROFILE_DIR,
+        tracer=None,
+    ):
+        if mode not in PROFILE_MODES:
+            raise ValueError(f"Unknown profile mode {mode!r}")
+        self.mode = mode
+        self.interval = max(interval, 1.0)
+        self.sample = min(sample, self.interval)
+        self.directory = directory
+        self.prefix = "".join(
+            c if c.isalnum() or c in "._-" else "_" for c in worker_id
+        )
+        self.tracer = tracer or Tracer()
+        self._profile = None
+        self._window_end = time.monotonic() + self.interval
+        self._sample_end = None
+
+    def start(self):
+        os.makedirs(self.directory, exist_ok=True)
+        set_tracer(self.tracer)
+        self._start_sample()
+
+    def _prof_path(self):
+        stamp = datetime.utcnow().strftime("%Y%m%dT%H%M%S")
+        return os.path.join(self.directory, f"{self.prefix}-{stamp}.prof")
+
+    def _start_sample(self):
+        if self.mode == "cprofile":
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+            self._sample_end = time.monotonic() + self.sample
+
+    def _stop_sample(self):
+        if self._profile is not None:
+            self._profile.disable()
+            self._profile.dump_stats(self._prof_path())
+            self._profile = None
+
+    def _write_spans(self):
+        window, stats = self.tracer.take()
+        if stats:
+            path = os.path.join(self.directory, f"{self.prefix}.spans.txt")
+            with open(path, "a") as f:
+                f.write(format_summary(window, stats) + "\n")
+
+    def tick(self):
+        now = time.monotonic()
+        if self._profile is not None and now >= self._sample_end:
+            self._stop_sample()
+        if now >= self._window_end:
+            self._window_end = now + self.interval
+            self._write_spans()
+            self._start_sample()
+
+    def stop(self):
+        """Write whatever the current window holds and turn tracing off."""
+        self._stop_sample()
+        self._write_spans()
+        if _tracer is self.tracer:
+            set_tracer(None)
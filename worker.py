@@ -88,99 +88,684 @@
 # if __name__ == "__main__":
 #     worker_loop()
 # Background worker: claims jobs, runs commands, prints output, retries with backoff, writes heartbeat.
+import asyncio
 import os
 import signal
+import threading
 import time
 from datetime import datetime, timedelta, timezone
 from threading import Event
 
-from flam.db.base import get_session
-from flam.executor import run_command
-from flam.queue_manager import claim_next_job, move_to_dead
-from flam.config import get_int, get_float
+from flam.broker import BrokerError, broker_state, connect
+from flam.db.base import engine, get_session
+from flam.executor import run_command, run_command_async
+from flam.metrics import Metrics, metrics_path
+from flam.joblog import (
+    DEFAULT_BACKUPS,
+    DEFAULT_MAX_BYTES,
+    DEFAULT_TAIL_BYTES,
+    JobLog,
+    log_path,
+)
+from flam.notify import WakeChannel, wake_workers
+from flam.registry import HEARTBEAT_INTERVAL, beat, register_worker, unregister_worker
+from flam.queue_manager import (
+    DEFAULT_LEASE_SECONDS,
+    FairQueues,
+    attempt_row,
+    claim_jobs,
+    complete_job,
+    move_to_dead,
+    next_run_due,
+    parse_queues,
+    reap_expired_leases,
+    record_attempt,
+    release_jobs,
+    renew_leases,
+    schedule_retry,
+    worker_identity,
+)
+from flam.config import get_bool, get_int, get_float, get_str
+from flam.pyexec import DEFAULT_MAX_JOBS, DEFAULT_MAX_RSS_MB, CallablePool
+from flam.tracing import (
+    DEFAULT_PROFILE_INTERVAL,
+    DEFAULT_PROFILE_SAMPLE,
+    Profiler,
+    span,
+    trace_sql,
+)
 
 _shutdown = Event()
+_channel = None  # this worker's WakeChannel while it is running
+_profiler = None  # Profiler while running with --profile
+_broker = None  # BrokerClient while a broker owns the queue
+_queues = None  # FairQueues when started with --queues
 
 
 def _handle_signal(signum, frame):
     _shutdown.set()
+    if _channel is not None:
+        # cut an idle wait short so shutdown is prompt
+        _channel.poke()
 
 
-# Register signals (SIGTERM may not exist on Windows)
-signal.signal(signal.SIGINT, _handle_signal)
-try:
-    signal.signal(signal.SIGTERM, _handle_signal)
-except Exception:
-    pass
-
-def _heartbeat(path: str):
+def install_signal_handlers():
+    # Register signals (SIGTERM may not exist on Windows)
+    signal.signal(signal.SIGINT, _handle_signal)
     try:
-        with open(path, "w") as f:
-            f.write(str(time.time()))
+        signal.signal(signal.SIGTERM, _handle_signal)
     except Exception:
-        # Heartbeat should never crash the worker
         pass
 
-def worker_loop(heartbeat_dir="data", poll_interval=0.2, max_backoff_cap=3.0):
-    os.makedirs(heartbeat_dir, exist_ok=True)
-    hb_path = os.path.join(heartbeat_dir, f"worker-{os.getpid()}.hb")
-    session = get_session()
 
-    print(f"[worker {os.getpid()}] started. heartbeat={hb_path}")
+install_signal_handlers()
 
-    while not _shutdown.is_set():
-        _heartbeat(hb_path)
+class _Activity:
+    """What this worker is doing; published by the heartbeat thread."""
+
+    def __init__(self):
+        self.running = set()
+        self.done = 0
+
+    def current_job(self):
+        ids = sorted(list(self.running))
+        return ",".join(ids)[:255] if ids else None
+
+
+_activity = _Activity()
+
+# this process's histograms and counters; the heartbeat flushes them to disk
+_metrics = Metrics()
 
-        job = claim_next_job(session)
-        if not job:
-            time.sleep(poll_interval)
-            continue
 
-        print(f"[worker {os.getpid()}] running job '{job.id}': {job.command}")
+def _claim(session, limit, owner, lease_seconds):
+    if _profiler is not None:
+        # one place both loops pass through; rolls the profile windows over
+        _profiler.tick()
+    quotas = _queues.plan(limit) if _queues is not None else None
+    started = time.perf_counter()
+    with span("worker.claim"):
+        batch = _via_broker(
+            lambda b: b.claim(limit, owner, lease_seconds, quotas),
+            lambda: claim_jobs(session, limit, owner, lease_seconds, quotas),
+        )
+    _metrics.observe("claim_latency_seconds", time.perf_counter() - started)
+    if batch:
+        _metrics.inc("jobs_claimed_total", len(batch))
+    return batch
 
-        exit_code, stdout, stderr = run_command(job.command)
 
-        # Always echo outputs so the CLI shows something useful.
+def _attach_broker():
+    """
+    A client when a broker owns the queue, else None. A journal left by a
+    crashed broker is not in SQLite yet, so we wait for the broker to come
+    back rather than run against stale tables.
+    """
+    waiting = False
+    while not _shutdown.is_set():
+        state = broker_state()
+        if state == "down":
+            return None
+        if state == "up":
+            client = connect()
+            if client is not None:
+                print(f"[worker {os.getpid()}] using the queue broker")
+                return client
+        elif not waiting:
+            waiting = True
+            print(
+                f"[worker {os.getpid()}] broker journal pending recovery; "
+                "waiting for `queuectl broker run`"
+            )
+        _shutdown.wait(1.0)
+    return None
+
+
+def _via_broker(call, direct):
+    """
+    `call(client)` while a broker owns the queue, `direct()` against SQLite
+    otherwise. A broker that stops cleanly has written everything back, so
+    the worker carries on against SQLite.
+    """
+    global _broker
+    client = _broker
+    if client is not None:
+        try:
+            return call(client)
+        except (BrokerError, OSError) as e:
+            deadline = time.monotonic() + 10
+            state = broker_state()
+            while state == "crashed" and time.monotonic() < deadline:
+                time.sleep(0.2)  # may still be writing its final snapshot
+                state = broker_state()
+            if state != "down":
+                raise
+            print(f"[worker {os.getpid()}] broker stopped ({e!r}); using SQLite")
+            _broker = None
+            client.close()
+    return direct()
+
+
+def _started(job):
+    """Note the attempt's start; returns its timestamp."""
+    now = datetime.utcnow()
+    runnable = (job.next_run_at or job.created_at or now).replace(tzinfo=None)
+    _metrics.observe("queue_wait_seconds", max((now - runnable).total_seconds(), 0))
+    return now
+
+
+def _log_settings(job):
+    # Output streams to logs/<job>.log; only a bounded tail stays in memory.
+    return dict(
+        path=log_path(job.id),
+        max_bytes=get_int("log_max_bytes", DEFAULT_MAX_BYTES),
+        backups=get_int("log_backups", DEFAULT_BACKUPS),
+        compress=get_bool("log_compress", False),
+        tail_bytes=get_int("log_tail_bytes", DEFAULT_TAIL_BYTES),
+    )
+
+
+def _log_header(job):
+    return (
+        f"attempt {(job.attempts or 0) + 1} worker={os.getpid()} "
+        f"started={datetime.utcnow().isoformat()}"
+    )
+
+
+def _open_log(job):
+    log = JobLog(**_log_settings(job))
+    log.header(_log_header(job))
+    return log
+
+
+_pool = None  # CallablePool for kind="callable" jobs
+
+
+def _callables(size=1):
+    """This worker's callable pool; worker_loop starts it ahead of any job."""
+    global _pool
+    if _pool is None:
+        preload = [m.strip() for m in get_str("callable_preload", "").split(",")]
+        _pool = CallablePool(
+            size=size,
+            preload=[m for m in preload if m],
+            max_jobs=get_int("callable_max_jobs", DEFAULT_MAX_JOBS),
+            max_rss_mb=get_float("callable_max_rss_mb", DEFAULT_MAX_RSS_MB),
+        )
+    return _pool
+
+
+def _run_callable(job):
+    # the pool child writes the job log itself
+    pool = _callables()
+    return pool.run(job.command, job.args, _log_settings(job), _log_header(job))
+
+
+def _run_job(job, session, max_backoff_cap):
+    print(f"[worker {os.getpid()}] running job '{job.id}': {job.command}")
+    _activity.running.add(job.id)
+    started_at = _started(job)
+    try:
+        with span("worker.execute"):
+            if job.kind == "callable":
+                exit_code, stdout, stderr = _run_callable(job)
+            else:
+                log = _open_log(job)
+                try:
+                    exit_code, stdout, stderr = run_command(job.command, log)
+                finally:
+                    log.close()
+        _record_result(
+            job, exit_code, stdout, stderr, session, max_backoff_cap, started_at
+        )
+    finally:
+        _activity.running.discard(job.id)
+        _activity.done += 1
+
+
+async def _run_job_async(job, session, max_backoff_cap):
+    print(f"[worker {os.getpid()}] running job '{job.id}': {job.command}")
+    _activity.running.add(job.id)
+    started_at = _started(job)
+    try:
+        # overlapping jobs each count their own wall time
+        with span("worker.execute"):
+            if job.kind == "callable":
+                loop = asyncio.get_running_loop()
+                exit_code, stdout, stderr = await loop.run_in_executor(
+                    None, _run_callable, job
+                )
+            else:
+                log = _open_log(job)
+                try:
+                    exit_code, stdout, stderr = await run_command_async(
+                        job.command, log
+                    )
+                finally:
+                    log.close()
+        # DB bookkeeping stays synchronous: it runs on the loop thread between
+        # awaits, so the shared session is never used concurrently.
+        _record_result(
+            job, exit_code, stdout, stderr, session, max_backoff_cap, started_at
+        )
+    finally:
+        _activity.running.discard(job.id)
+        _activity.done += 1
+
+
+def _record_result(
+    job, exit_code, stdout, stderr, session, max_backoff_cap, started_at=None
+):
+    # Always echo outputs so the CLI shows something useful (tails only;
+    # the full output is in the job's log file).
+    with span("worker.output"):
         if stdout:
             print(f"[job {job.id}] STDOUT:\n{stdout}")
         if stderr:
             print(f"[job {job.id}] STDERR:\n{stderr}")
 
-        if exit_code == 0:
-            job.status = "completed"
-            job.last_error = None
-            job.next_run_at = None
-            session.commit()
+    owner = worker_identity()
+    finished_at = datetime.utcnow()
+    started_at = started_at or finished_at
+    _metrics.observe("execution_seconds", (finished_at - started_at).total_seconds())
+    # the attempt and its output tails ride on the outcome's commit, which is
+    # what we time
+    timing = (owner, started_at, finished_at, exit_code, stdout, stderr)
+    commit_started = time.perf_counter()
+    try:
+        with span("worker.commit"):
+            _record_outcome(
+                job, exit_code, stderr, session, max_backoff_cap, owner, timing
+            )
+    finally:
+        _metrics.observe("db_commit_seconds", time.perf_counter() - commit_started)
+
+
+def _outcome(job, session, timing, call, direct):
+    """Record an outcome plus its attempt row in the broker or SQLite."""
+
+    def _direct():
+        record_attempt(job, session, *timing)
+        return direct()
+
+    return _via_broker(lambda b: call(b, attempt_row(job, *timing)), _direct)
+
+
+def _record_outcome(
+    job, exit_code, stderr, session, max_backoff_cap, owner, timing=None
+):
+    timing = timing or (owner, datetime.utcnow(), datetime.utcnow(), exit_code)
+    if exit_code == 0:
+        if _outcome(
+            job,
+            session,
+            timing,
+            lambda b, attempt: b.ack(job, owner, attempt),
+            lambda: complete_job(job, session, owner),
+        ):
+            _metrics.inc("jobs_completed_total")
             print(f"[worker {os.getpid()}] job '{job.id}' -> completed")
         else:
-            job.attempts += 1
-            job.last_error = stderr or "Command failed"
-
-            max_retries = job.max_retries or get_int("max_retries", 3)
-            backoff_base = get_float("backoff_base", 2.0)
-
-            if job.attempts >= max_retries:
-                move_to_dead(job, session)
-                print(
-                    f"[worker {os.getpid()}] job '{job.id}' -> DLQ (attempts={job.attempts})"
-                )
+            _lease_lost(job)
+    else:
+        _metrics.inc("jobs_failed_total")
+        attempts = (job.attempts or 0) + 1
+        error = stderr or "Command failed"
+
+        max_retries = job.max_retries or get_int("max_retries", 3)
+        backoff_base = get_float("backoff_base", 2.0)
+
+        if attempts >= max_retries:
+            if _outcome(
+                job,
+                session,
+                timing,
+                lambda b, attempt: b.bury(job, owner, error, attempt),
+                lambda: move_to_dead(job, session, error, owner),
+            ):
+                _metrics.inc("jobs_dead_total")
+                print(f"[worker {os.getpid()}] job '{job.id}' -> DLQ ({attempts=})")
+            else:
+                _lease_lost(job)
+        else:
+            # exponential backoff with cap
+            delay = min((backoff_base**attempts), max_backoff_cap)
+            # store next_run_at in UTC
+            run_at = datetime.now(timezone.utc) + timedelta(seconds=delay)
+            if not _outcome(
+                job,
+                session,
+                timing,
+                lambda b, attempt: b.nack(job, owner, attempts, error, run_at, attempt),
+                lambda: schedule_retry(job, session, attempts, error, run_at, owner),
+            ):
+                _lease_lost(job)
+                return
+            _metrics.inc("jobs_retried_total")
+            if _broker is None:
+                # idle workers re-arm their timer for the new earliest
+                # next_run_at (the broker wakes them itself)
+                wake_workers()
+            print(
+                f"[worker {os.getpid()}] job '{job.id}' failed (attempts={attempts}); retry in {delay:.2f}s"
+            )
+
+
+def _lease_lost(job):
+    # Our lease lapsed (e.g. the process was stopped for longer than the TTL)
+    # and the reaper handed the job on; its new owner records the outcome.
+    print(f"[worker {os.getpid()}] job '{job.id}': lease lost, result discarded")
+
+
+class _Heartbeat(threading.Thread):
+    """
+    Background liveness for this worker. Every `interval` seconds (at most a
+    third of the lease TTL) it renews all of the worker's leases in one
+    UPDATE, refreshes its workers-table row and writes the process's metrics
+    to `metrics_file`; every `reap_interval` seconds it also reclaims jobs
+    whose leases have lapsed. Keeps these writes off the per-job path.
+    Under the broker, leases are renewed there and the broker reaps.
+    """
+
+    def __init__(
+        self,
+        owner,
+        lease_seconds,
+        reap_interval,
+        interval,
+        metrics_file=None,
+        queues=None,
+    ):
+        super().__init__(name="heartbeat", daemon=True)
+        self.owner = owner
+        self.queues = queues
+        self.metrics_file = metrics_file
+        self.lease_seconds = lease_seconds
+        self.reap_interval = reap_interval
+        self.interval = min(interval, lease_seconds / 3)
+        self._stopped = Event()
+
+    def run(self):
+        session = get_session()
+        next_reap = time.monotonic()
+        try:
+            while True:
+                try:
+                    _via_broker(
+                        lambda b: b.renew(self.owner, self.lease_seconds),
+                        lambda: renew_leases(session, self.owner, self.lease_seconds),
+                    )
+                    if not beat(
+                        session, self.owner, _activity.current_job(), _activity.done
+                    ):
+                        # pruned while we were unreachable; show up again
+                        register_worker(session, self.owner, self.queues)
+                    reap = self.reap_interval and _broker is None
+                    if reap and time.monotonic() >= next_reap:
+                        next_reap = time.monotonic() + self.reap_interval
+                        reaped = reap_expired_leases(
+                            session, get_int("max_retries", 3)
+                        )
+                        if reaped["requeued"] or reaped["dead"]:
+                            print(
+                                f"[worker {os.getpid()}] reaped expired leases: "
+                                f"{reaped['requeued']} requeued, "
+                                f"{reaped['dead']} to DLQ"
+                            )
+                except Exception as e:
+                    # a busy database must not take the keeper down
+                    session.rollback()
+                    print(f"[worker {os.getpid()}] heartbeat failed: {e!r}")
+                self.flush_metrics()
+                if self._stopped.wait(self.interval):
+                    break
+        finally:
+            session.close()
+
+    def flush_metrics(self):
+        if self.metrics_file is None:
+            return
+        try:
+            _metrics.flush(self.metrics_file)
+        except OSError as e:
+            print(f"[worker {os.getpid()}] writing metrics failed: {e!r}")
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+        # the final numbers, including the jobs finished since the last beat
+        self.flush_metrics()
+
+
+def _idle_timeout(session, idle_wait):
+    """
+    How long an idle worker may sleep: its current backoff, cut short by the
+    earliest scheduled retry so that retries fire on time without polling.
+    """
+    due = _broker.next_due if _broker is not None else next_run_due(session)
+    if due is not None:
+        until_due = (due.replace(tzinfo=None) - datetime.utcnow()).total_seconds()
+        idle_wait = min(idle_wait, max(until_due, 0.0))
+    return idle_wait
+
+
+def _serial_loop(
+    session,
+    poll_interval,
+    max_backoff_cap,
+    batch_size,
+    max_idle_wait,
+    lease_seconds=DEFAULT_LEASE_SECONDS,
+):
+    global _channel
+    owner = worker_identity()
+    channel = _channel = WakeChannel()
+    idle_wait = poll_interval
+    try:
+        while not _shutdown.is_set():
+            # Claim a local batch in one statement, then drain it before polling again.
+            batch = _claim(session, batch_size, owner, lease_seconds)
+            if not batch:
+                # Sleep until an enqueue/retry wakes us, a retry is due, or the
+                # (exponentially growing) idle backoff runs out.
+                with span("worker.idle"):
+                    woke = channel.wait(_idle_timeout(session, idle_wait))
+                if not woke:
+                    idle_wait = min(idle_wait * 2, max_idle_wait)
+                continue
+            idle_wait = poll_interval
+
+            for i, job in enumerate(batch):
+                if _shutdown.is_set():
+                    # Don't sit on jobs we won't run; let other workers pick them up.
+                    rest = batch[i:]
+                    _via_broker(
+                        lambda b: b.release(rest, owner),
+                        lambda: release_jobs(rest, session),
+                    )
+                    break
+                _run_job(job, session, max_backoff_cap)
+    finally:
+        _channel = None
+        channel.close()
+
+
+async def _concurrent_loop(
+    session,
+    poll_interval,
+    max_backoff_cap,
+    concurrency,
+    max_idle_wait=2.0,
+    lease_seconds=DEFAULT_LEASE_SECONDS,
+):
+    """
+    Keep up to `concurrency` subprocesses running from this one process.
+    Free slots are filled with a single batch claim; on shutdown we stop
+    claiming and wait for the in-flight children to finish.
+    """
+    global _channel
+    owner = worker_identity()
+    channel = _channel = WakeChannel()
+    woken = asyncio.Event()
+    if not channel.attach(asyncio.get_running_loop(), woken.set):
+        woken = None
+    idle_wait = poll_interval
+    in_flight = set()
+    try:
+        while not _shutdown.is_set():
+            free = concurrency - len(in_flight)
+            claimed = []
+            if free > 0:
+                claimed = _claim(session, free, owner, lease_seconds)
+                for job in claimed:
+                    in_flight.add(
+                        asyncio.create_task(
+                            _run_job_async(job, session, max_backoff_cap)
+                        )
+                    )
+
+            # Wait for a job to finish, a wakeup, or the idle timeout. The
+            # timeout stays short so SIGTERM is noticed promptly.
+            if claimed:
+                idle_wait = poll_interval
+                timeout = poll_interval
             else:
-                # exponential backoff with cap
-                delay = min((backoff_base**job.attempts), max_backoff_cap)
-                job.status = "pending"
-                # store next_run_at in UTC
-                job.next_run_at = datetime.now(timezone.utc) + timedelta(seconds=delay)
-                session.commit()
-                print(
-                    f"[worker {os.getpid()}] job '{job.id}' failed (attempts={job.attempts}); retry in {delay:.2f}s"
+                timeout = max_idle_wait
+                if free > 0:
+                    timeout = _idle_timeout(session, idle_wait)
+            waiters = set(in_flight)
+            wake_task = None
+            if woken is not None and free > 0:
+                woken.clear()
+                wake_task = asyncio.ensure_future(woken.wait())
+                waiters.add(wake_task)
+            if waiters:
+                done, _ = await asyncio.wait(
+                    waiters,
+                    timeout=min(timeout, max_idle_wait),
+                    return_when=asyncio.FIRST_COMPLETED,
                 )
-
-        if _shutdown.is_set():
-            break
-
-    # Cleanup heartbeat
+            else:
+                done = set()
+                await asyncio.sleep(timeout)
+            if wake_task is not None:
+                wake_task.cancel()
+            if not claimed and not done:
+                idle_wait = min(idle_wait * 2, max_idle_wait)
+
+            for task in done:
+                if task is wake_task:
+                    continue
+                in_flight.discard(task)
+                if task.exception() is not None:
+                    session.rollback()
+                    print(
+                        f"[worker {os.getpid()}] job task failed: {task.exception()!r}"
+                    )
+
+        if in_flight:
+            print(
+                f"[worker {os.getpid()}] waiting for {len(in_flight)} in-flight job(s)"
+            )
+            await asyncio.gather(*in_flight, return_exceptions=True)
+    finally:
+        _channel = None
+        channel.close()
+
+
+def worker_loop(
+    data_dir="data",
+    poll_interval=0.2,
+    max_backoff_cap=3.0,
+    batch_size=1,
+    concurrency=1,
+    max_idle_wait=2.0,
+    profile=None,
+    profile_sql=False,
+    queues=None,
+):
+    """
+    Run one worker until signalled. `profile` ("spans" or "cprofile")
+    writes periodic span summaries, plus sampled cProfile windows, to
+    data/profiles/; `profile_sql` adds per-statement SQL timings to them.
+    `queues` ("high:5,default:1") restricts claims to those queues, shared
+    by weight; by default the worker takes jobs from every queue.
+    """
+    global _broker, _pool, _profiler, _queues
+    os.makedirs(data_dir, exist_ok=True)
+    _queues = FairQueues(parse_queues(queues)) if queues else None
+    session = get_session()
+    owner = worker_identity()
+    register_worker(session, owner, queues)
+
+    print(f"[worker {os.getpid()}] started as {owner}")
+    if queues:
+        print(f"[worker {os.getpid()}] claiming from queues {queues}")
+    _broker = _attach_broker()
+    untrace_sql = None
+    if profile:
+        _profiler = Profiler(
+            owner,
+            profile,
+            get_float("profile_interval", DEFAULT_PROFILE_INTERVAL),
+            get_float("profile_sample", DEFAULT_PROFILE_SAMPLE),
+        )
+        _profiler.start()
+        if profile_sql:
+            untrace_sql = trace_sql(engine)
+        print(f"[worker {os.getpid()}] profiling ({profile}) to {_profiler.directory}")
+
+    lease_seconds = max(get_int("lease_seconds", DEFAULT_LEASE_SECONDS), 3)
+    heartbeat = _Heartbeat(
+        owner,
+        lease_seconds,
+        get_float("reap_interval", float(lease_seconds)),
+        get_float("heartbeat_interval", HEARTBEAT_INTERVAL),
+        metrics_path(owner, time.time()),
+        queues,
+    )
+    heartbeat.start()
+    if get_bool("callable_prefork", True):
+        # warm interpreters for callable jobs, one per concurrent slot
+        _callables(max(concurrency, 1))
     try:
-        os.remove(hb_path)
-    except Exception:
-        pass
+        if concurrency > 1:
+            asyncio.run(
+                _concurrent_loop(
+                    session,
+                    poll_interval,
+                    max_backoff_cap,
+                    concurrency,
+                    max_idle_wait,
+                    lease_seconds,
+                )
+            )
+        else:
+            _serial_loop(
+                session,
+                poll_interval,
+                max_backoff_cap,
+                batch_size,
+                max_idle_wait,
+                lease_seconds,
+            )
+    finally:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
+        if _profiler is not None:
+            _profiler.stop()
+            _profiler = None
+        if untrace_sql is not None:
+            untrace_sql()
+        heartbeat.stop()
+        if _broker is not None:
+            _broker.close()
+            _broker = None
+        _queues = None
+        try:
+            unregister_worker(session, owner)
+        except Exception:
+            # a missing row only means the worker shows as dead until pruned
+            session.rollback()
     print(f"[worker {os.getpid()}] stopped.")
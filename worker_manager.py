@@ -78,13 +78,20 @@
 import json
 import os
 import signal
+import socket
 import subprocess
+import threading
+import time
 from multiprocessing import Process
 from time import sleep
 
-from flam.worker import worker_loop
+from flam.db.base import get_session
+from flam.db.models import Worker
+from flam.queue_manager import backlog
+from flam.worker import install_signal_handlers, worker_loop
 
 PIDS_FILE = os.path.join("data", "workers.pids")
+SUPERVISOR_PID_FILE = os.path.join("data", "supervisor.pid")
 
 
 def _write_pids(pids):
@@ -101,12 +108,19 @@ def _read_pids():
     except Exception:
         return []
 
-def start_workers(count=1):
+def start_workers(
+    count=1, batch_size=1, concurrency=1, profile=None, profile_sql=False, queues=None
+):
     os.makedirs("data", exist_ok=True)
     pids = _read_pids()
     procs = []
     for _ in range(count):
-        p = Process(target=worker_loop, args=("data", 0.1, 3.0), daemon=False)
+        p = Process(
+            target=worker_loop,
+            args=("data", 0.1, 3.0, batch_size, concurrency),
+            kwargs={"profile": profile, "profile_sql": profile_sql, "queues": queues},
+            daemon=False,
+        )
         p.start()
         pids.append(p.pid)
         procs.append(p)
@@ -132,27 +146,308 @@ def _kill_pid(pid):
         pass
 
 def stop_workers():
+    supervisor = _read_supervisor_pid()
+    if supervisor is not None:
+        # the supervisor stops its own workers (and does not restart them)
+        _kill_pid(supervisor)
+        print(f"Supervisor {supervisor} signaled to stop.")
+
     pids = _read_pids()
     if not pids:
-        print("No worker PIDs found.")
+        if supervisor is None:
+            print("No worker PIDs found.")
         return
 
     for pid in pids:
         _kill_pid(pid)
 
-    # Let workers exit and clean up their heartbeat files
+    # Give workers a moment to exit and drop their registry rows
     sleep(1.5)
 
-    for pid in pids:
-        hb = os.path.join("data", f"worker-{pid}.hb")
-        try:
-            if os.path.exists(hb):
-                os.remove(hb)
-        except Exception:
-            pass
-
     try:
         os.remove(PIDS_FILE)
     except Exception:
         pass
     print("Workers signaled to stop.")
+
+
+# Supervised pool (`queuectl worker run`)
+def _read_supervisor_pid():
+    try:
+        with open(SUPERVISOR_PID_FILE, "r") as f:
+            pid = int(f.read().strip())
+        os.kill(pid, 0)
+        return pid
+    except (OSError, ValueError):
+        return None
+
+
+def signal_supervisor(name):
+    """
+    Send the named signal ("SIGUSR1", "SIGHUP") to the running supervisor.
+    Returns its pid, or None if no supervisor is running.
+    """
+    sig = getattr(signal, name, None)
+    if sig is None:
+        raise RuntimeError(f"{name} is not available on this platform")
+    pid = _read_supervisor_pid()
+    if pid is not None:
+        os.kill(pid, sig)
+    return pid
+
+
+def _run_worker(batch_size, concurrency, queues=None):
+    # A forked child inherits the supervisor's handlers; put the worker's back
+    # and ignore the signals that are meant for the supervisor only.
+    install_signal_handlers()
+    for name in ("SIGHUP", "SIGUSR1"):
+        if hasattr(signal, name):
+            signal.signal(getattr(signal, name), signal.SIG_IGN)
+    worker_loop("data", 0.1, 3.0, batch_size, concurrency, queues=queues)
+
+
+class _Slot:
+    def __init__(self):
+        self.process = None
+        self.started = 0.0
+        self.failures = 0
+        self.restart_at = 0.0
+
+
+class Supervisor:
+    """
+    Long-running owner of `count` worker processes (`queuectl worker run`).
+    Workers that die are restarted with exponential backoff. Signals:
+    SIGTERM/SIGINT stop (in-flight jobs get `stop_timeout` seconds), SIGUSR1
+    drains (stop claiming, wait for in-flight jobs, exit), SIGHUP rolls the
+    pool one worker at a time, starting each replacement before retiring the
+    old process so throughput never drops to zero.
+    With an `autoscaler` the pool starts at its minimum and is resized from
+    the backlog every `scale_interval` seconds.
+    """
+
+    def __init__(
+        self,
+        count=1,
+        batch_size=1,
+        concurrency=1,
+        restart_backoff=1.0,
+        max_restart_backoff=30.0,
+        healthy_after=30.0,
+        stop_timeout=30.0,
+        ready_timeout=10.0,
+        autoscaler=None,
+        scale_interval=2.0,
+        queues=None,
+    ):
+        if autoscaler is not None:
+            count = autoscaler.min_workers
+        self.count = count
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.queues = queues
+        self.restart_backoff = restart_backoff
+        self.max_restart_backoff = max_restart_backoff
+        self.healthy_after = healthy_after
+        self.stop_timeout = stop_timeout
+        self.ready_timeout = ready_timeout
+        self.autoscaler = autoscaler
+        self.scale_interval = scale_interval
+        self.slots = [_Slot() for _ in range(count)]
+        self._retiring = []  # scaled-down workers finishing their jobs
+        self._requested = None
+        self._wake = threading.Event()
+
+    def request(self, action):
+        """Ask the run loop to "stop", "drain" or "restart"."""
+        if self._requested not in ("stop", "drain") or action == "stop":
+            self._requested = action
+        self._wake.set()
+
+    def _on_signal(self, signum, frame):
+        actions = {"SIGHUP": "restart", "SIGUSR1": "drain"}
+        self.request(actions.get(signal.Signals(signum).name, "stop"))
+
+    def _install_signals(self):
+        for name in ("SIGINT", "SIGTERM", "SIGHUP", "SIGUSR1"):
+            if hasattr(signal, name):
+                signal.signal(getattr(signal, name), self._on_signal)
+
+    def pids(self):
+        return [
+            s.process.pid
+            for s in self.slots
+            if s.process is not None and s.process.is_alive()
+        ]
+
+    def _spawn(self):
+        p = Process(
+            target=_run_worker,
+            args=(self.batch_size, self.concurrency, self.queues),
+            daemon=False,
+        )
+        p.start()
+        print(f"[supervisor] started worker {p.pid}")
+        return p
+
+    def _start(self, slot):
+        slot.process = self._spawn()
+        slot.started = time.monotonic()
+
+    def _check_children(self):
+        now = time.monotonic()
+        for p in list(self._retiring):
+            if not p.is_alive():
+                p.join()
+                self._retiring.remove(p)
+        for slot in self.slots:
+            p = slot.process
+            if p is not None and not p.is_alive():
+                p.join()
+                if now - slot.started >= self.healthy_after:
+                    slot.failures = 0
+                slot.failures += 1
+                delay = min(
+                    self.restart_backoff * 2 ** (slot.failures - 1),
+                    self.max_restart_backoff,
+                )
+                print(
+                    f"[supervisor] worker {p.pid} exited (code {p.exitcode}); "
+                    f"restarting in {delay:.1f}s"
+                )
+                slot.process = None
+                slot.restart_at = now + delay
+            if slot.process is None and now >= slot.restart_at:
+                self._start(slot)
+
+    def _resize(self, size):
+        while len(self.slots) < size:
+            slot = _Slot()
+            self._start(slot)
+            self.slots.append(slot)
+        while len(self.slots) > size:
+            # prefer a slot that is only waiting out a restart backoff
+            idle = [s for s in self.slots if s.process is None]
+            slot = idle[-1] if idle else self.slots[-1]
+            self.slots.remove(slot)
+            if slot.process is not None:
+                # SIGTERM: the worker finishes its in-flight jobs, then exits
+                _kill_pid(slot.process.pid)
+                self._retiring.append(slot.process)
+        self.count = size
+
+    def _autoscale(self):
+        session = get_session()
+        try:
+            load = backlog(session)
+        finally:
+            session.close()
+        current = len(self.slots)
+        # jobs waiting out a retry backoff or run_at need no worker yet
+        size, reason = self.autoscaler.decide(
+            current, load["runnable"], load["oldest_wait"]
+        )
+        if size != current:
+            print(
+                f"[autoscale] runnable={load['runnable']} "
+                f"oldest_wait={load['oldest_wait']:.1f}s "
+                f"workers {current} -> {size} ({reason})"
+            )
+            self._resize(size)
+
+    def _wait_ready(self, p):
+        # ready once the new worker has registered itself in the workers table
+        worker_id = f"{socket.gethostname()}:{p.pid}"
+        deadline = time.monotonic() + self.ready_timeout
+        session = get_session()
+        try:
+            while p.is_alive() and time.monotonic() < deadline:
+                if session.get(Worker, worker_id) is not None:
+                    return True
+                session.rollback()
+                time.sleep(0.1)
+        finally:
+            session.close()
+        return False
+
+    def _stop_processes(self, procs, timeout):
+        """
+        SIGTERM `procs` and wait for them; workers finish their in-flight jobs
+        first. Stragglers are killed after `timeout` (None waits until a stop
+        request arrives, then allows stop_timeout). Their leases get reaped.
+        """
+        for p in procs:
+            _kill_pid(p.pid)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while any(p.is_alive() for p in procs):
+            if deadline is None and self._requested == "stop":
+                deadline = time.monotonic() + self.stop_timeout
+            if deadline is not None and time.monotonic() >= deadline:
+                for p in procs:
+                    if p.is_alive():
+                        print(f"[supervisor] worker {p.pid} did not stop; killing")
+                        p.kill()
+                break
+            time.sleep(0.1)
+        for p in procs:
+            p.join()
+
+    def _rolling_restart(self):
+        print("[supervisor] rolling restart")
+        for slot in self.slots:
+            if self._requested in ("stop", "drain"):
+                return
+            old = slot.process
+            new = self._spawn()
+            if not self._wait_ready(new):
+                print(f"[supervisor] worker {new.pid} not ready; keeping the old one")
+                self._stop_processes([new], self.stop_timeout)
+                continue
+            slot.process, slot.started, slot.failures = new, time.monotonic(), 0
+            if old is not None and old.is_alive():
+                self._stop_processes([old], None)
+        print("[supervisor] rolling restart done")
+
+    def run(self, tick=0.5):
+        if threading.current_thread() is threading.main_thread():
+            self._install_signals()
+        os.makedirs("data", exist_ok=True)
+        with open(SUPERVISOR_PID_FILE, "w") as f:
+            f.write(str(os.getpid()))
+        print(f"[supervisor {os.getpid()}] running {self.count} worker(s)")
+        try:
+            for slot in self.slots:
+                self._start(slot)
+            next_scale = time.monotonic()
+            while True:
+                self._wake.wait(tick)
+                self._wake.clear()
+                action = self._requested
+                if action == "restart":
+                    self._requested = None
+                    self._rolling_restart()
+                    continue
+                if action in ("stop", "drain"):
+                    break
+                self._check_children()
+                if self.autoscaler is not None and time.monotonic() >= next_scale:
+                    next_scale = time.monotonic() + self.scale_interval
+                    try:
+                        self._autoscale()
+                    except Exception as e:
+                        # a busy database only delays the next decision
+                        print(f"[autoscale] backlog check failed: {e!r}")
+
+            procs = [s.process for s in self.slots if s.process is not None]
+            procs += self._retiring
+            if action == "drain":
+                print("[supervisor] draining: waiting for in-flight jobs")
+                self._stop_processes(procs, None)
+            else:
+                self._stop_processes(procs, self.stop_timeout)
+        finally:
+            try:
+                os.remove(SUPERVISOR_PID_FILE)
+            except OSError:
+                pass
+        print(f"[supervisor {os.getpid()}] stopped.")